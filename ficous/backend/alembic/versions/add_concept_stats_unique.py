@@ -0,0 +1,35 @@
+"""add unique (user_id, concept) to user concept stats (batched upsert)
+
+Revision ID: 013_concept_stats_unique
+Revises: 012_embedding_canonical
+Create Date: 2025-02-XX
+"""
+from alembic import op
+
+
+def upgrade():
+    # Duplicatas criadas pelo SELECT + INSERT concorrente: mantém uma linha por (user_id, concept)
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("""
+            DELETE FROM ficous_user_concept_stats a
+            USING ficous_user_concept_stats b
+            WHERE a.user_id = b.user_id AND a.concept = b.concept AND a.ctid < b.ctid
+        """)
+    else:
+        op.execute("""
+            DELETE FROM ficous_user_concept_stats
+            WHERE rowid NOT IN (
+                SELECT MAX(rowid) FROM ficous_user_concept_stats GROUP BY user_id, concept
+            )
+        """)
+    # Índice único (em vez de ALTER ADD CONSTRAINT) funciona também no SQLite e serve ao ON CONFLICT
+    op.create_index(
+        'uq_user_concept_stats_user_concept',
+        'ficous_user_concept_stats',
+        ['user_id', 'concept'],
+        unique=True
+    )
+
+
+def downgrade():
+    op.drop_index('uq_user_concept_stats_user_concept')
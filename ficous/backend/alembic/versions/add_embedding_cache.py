@@ -0,0 +1,33 @@
+"""add content-addressed embedding cache
+
+Revision ID: 004_embedding_cache
+Revises: 003_embedding_vector_f32
+Create Date: 2025-02-XX
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# Mesmo mapeamento do GUID de app/models.py
+GUID = sa.CHAR(36).with_variant(postgresql.UUID(as_uuid=True), 'postgresql')
+
+
+def upgrade():
+    op.create_table(
+        'ficous_embedding_cache',
+        sa.Column('id', GUID, primary_key=True),
+        sa.Column('model', sa.String(64), nullable=False),
+        sa.Column('content_hash', sa.String(64), nullable=False),
+        sa.Column('vector_f32', sa.LargeBinary(), nullable=False),
+        sa.Column('hits', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column('last_used_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.UniqueConstraint('model', 'content_hash', name='uq_embedding_cache_model_hash'),
+    )
+    # Evicção LRU percorre por last_used_at
+    op.create_index('idx_embedding_cache_last_used', 'ficous_embedding_cache', ['last_used_at'])
+
+
+def downgrade():
+    op.drop_index('idx_embedding_cache_last_used')
+    op.drop_table('ficous_embedding_cache')
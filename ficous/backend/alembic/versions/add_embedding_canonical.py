@@ -0,0 +1,23 @@
+"""add canonical reference to embeddings (index-time near-duplicate suppression)
+
+Revision ID: 012_embedding_canonical
+Revises: 011_embedding_factors
+Create Date: 2025-02-XX
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+GUID = sa.CHAR(36).with_variant(postgresql.UUID(as_uuid=True), 'postgresql')
+
+
+def upgrade():
+    # NULL = linha canônica (vetor próprio); preenchido = referência sem vetor
+    op.add_column('ficous_embeddings', sa.Column('canonical_id', GUID, nullable=True))
+    op.create_index('idx_embeddings_canonical', 'ficous_embeddings', ['canonical_id'])
+
+
+def downgrade():
+    op.drop_index('idx_embeddings_canonical')
+    op.drop_column('ficous_embeddings', 'canonical_id')
@@ -0,0 +1,29 @@
+"""self foreign key on embeddings.canonical_id (ON DELETE SET NULL)
+
+Revision ID: 015_embedding_canonical_fk
+Revises: 014_reindex_owner_claims
+Create Date: 2025-02-XX
+"""
+from alembic import op
+
+
+def upgrade():
+    # Referências cuja canônica já sumiu: sem vetor e sem canônica = pendentes (reembed_pending)
+    op.execute("""
+        UPDATE ficous_embeddings SET canonical_id = NULL
+        WHERE canonical_id IS NOT NULL
+          AND canonical_id NOT IN (SELECT id FROM ficous_embeddings)
+    """)
+    # SQLite não altera constraints (e não as aplica sem PRAGMA foreign_keys): o GC cobre
+    if op.get_bind().dialect.name == 'postgresql':
+        op.create_foreign_key(
+            'fk_embeddings_canonical_id',
+            'ficous_embeddings', 'ficous_embeddings',
+            ['canonical_id'], ['id'],
+            ondelete='SET NULL'
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_constraint('fk_embeddings_canonical_id', 'ficous_embeddings', type_='foreignkey')
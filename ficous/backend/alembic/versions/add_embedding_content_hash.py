@@ -0,0 +1,46 @@
+"""add embedding content hash for incremental reindex
+
+Revision ID: 005_embedding_content_hash
+Revises: 004_embedding_cache
+Create Date: 2025-02-XX
+"""
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+BATCH_SIZE = 1000
+
+
+def upgrade():
+    op.add_column('ficous_embeddings', sa.Column('content_hash', sa.String(64), nullable=True))
+    op.create_index('idx_embeddings_owner_hash', 'ficous_embeddings', ['owner_type', 'owner_id', 'content_hash'])
+
+    # Backfill do hash a partir do chunk_text, em lotes
+    bind = op.get_bind()
+    embeddings = sa.table(
+        'ficous_embeddings',
+        sa.column('id'),
+        sa.column('chunk_text', sa.Text()),
+        sa.column('content_hash', sa.String(64)),
+    )
+    while True:
+        rows = bind.execute(
+            sa.select(embeddings.c.id, embeddings.c.chunk_text)
+            .where(embeddings.c.content_hash.is_(None))
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        for row_id, chunk_text in rows:
+            digest = hashlib.sha256((chunk_text or '').encode('utf-8')).hexdigest()
+            bind.execute(
+                embeddings.update()
+                .where(embeddings.c.id == row_id)
+                .values(content_hash=digest)
+            )
+
+
+def downgrade():
+    op.drop_index('idx_embeddings_owner_hash')
+    op.drop_column('ficous_embeddings', 'content_hash')
@@ -0,0 +1,43 @@
+"""denormalize discipline onto embeddings
+
+Revision ID: 008_embedding_discipline
+Revises: 007_embedding_model
+Create Date: 2025-02-XX
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# Mesmo mapeamento do GUID de app/models.py
+GUID = sa.CHAR(36).with_variant(postgresql.UUID(as_uuid=True), 'postgresql')
+
+
+def upgrade():
+    op.add_column('ficous_embeddings', sa.Column(
+        'discipline_id', GUID,
+        sa.ForeignKey('ficous_disciplines.id', ondelete='SET NULL'),
+        nullable=True
+    ))
+    # Filtro do RAG por disciplina resolvido só pelo índice (user, disciplina, tipo)
+    op.create_index(
+        'idx_embeddings_user_discipline_type',
+        'ficous_embeddings',
+        ['user_id', 'discipline_id', 'owner_type']
+    )
+
+    # Backfill a partir das notas e fontes donas dos chunks
+    op.execute(
+        "UPDATE ficous_embeddings SET discipline_id = "
+        "(SELECT discipline_id FROM ficous_notes WHERE ficous_notes.id = ficous_embeddings.owner_id) "
+        "WHERE owner_type = 'note'"
+    )
+    op.execute(
+        "UPDATE ficous_embeddings SET discipline_id = "
+        "(SELECT discipline_id FROM ficous_sources WHERE ficous_sources.id = ficous_embeddings.owner_id) "
+        "WHERE owner_type = 'source'"
+    )
+
+
+def downgrade():
+    op.drop_index('idx_embeddings_user_discipline_type')
+    op.drop_column('ficous_embeddings', 'discipline_id')
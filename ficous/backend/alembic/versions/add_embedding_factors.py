@@ -0,0 +1,42 @@
+"""add typed PersoScore factor columns to embeddings
+
+Revision ID: 011_embedding_factors
+Revises: 010_reindex_runs
+Create Date: 2025-02-XX
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+FACTORS = (
+    ('strength', sa.Float()),
+    ('success_rate', sa.Float()),
+    ('frequency', sa.Integer()),
+    ('concept_affinity', sa.Float()),
+)
+
+
+def upgrade():
+    # NULL = default do PersoScore; recency deixa de ser persistida (sai de created_at)
+    for name, type_ in FACTORS:
+        op.add_column('ficous_embeddings', sa.Column(name, type_, nullable=True))
+
+    # Backfill a partir do JSON meta (chaves antigas ficam no meta, só não são mais lidas)
+    if op.get_bind().dialect.name == 'postgresql':
+        casts = {'frequency': 'integer'}
+        for name, _ in FACTORS:
+            op.execute(
+                f"UPDATE ficous_embeddings SET {name} = (meta->>'{name}')::{casts.get(name, 'double precision')} "
+                f"WHERE meta->>'{name}' IS NOT NULL"
+            )
+    else:
+        for name, _ in FACTORS:
+            op.execute(
+                f"UPDATE ficous_embeddings SET {name} = json_extract(meta, '$.{name}') "
+                f"WHERE json_extract(meta, '$.{name}') IS NOT NULL"
+            )
+
+
+def downgrade():
+    for name, _ in reversed(FACTORS):
+        op.drop_column('ficous_embeddings', name)
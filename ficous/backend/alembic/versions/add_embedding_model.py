@@ -0,0 +1,19 @@
+"""add embedding model column for pluggable providers
+
+Revision ID: 007_embedding_model
+Revises: 006_embedding_pgvector
+Create Date: 2025-02-XX
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # NULL = vetor legado gerado pela OpenAI (text-embedding-3-small)
+    op.add_column('ficous_embeddings', sa.Column('embedding_model', sa.String(64), nullable=True))
+    op.create_index('idx_embeddings_user_model', 'ficous_embeddings', ['user_id', 'embedding_model'])
+
+
+def downgrade():
+    op.drop_index('idx_embeddings_user_model')
+    op.drop_column('ficous_embeddings', 'embedding_model')
@@ -0,0 +1,71 @@
+"""add pgvector column and HNSW index (PostgreSQL only)
+
+Revision ID: 006_embedding_pgvector
+Revises: 005_embedding_content_hash
+Create Date: 2025-02-XX
+"""
+from alembic import op
+import sqlalchemy as sa
+import numpy as np
+
+EMBEDDING_DIM = 1536
+BATCH_SIZE = 1000
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return  # SQLite e outros: recuperação continua em NumPy
+
+    op.execute('CREATE EXTENSION IF NOT EXISTS vector')
+    op.execute(f'ALTER TABLE ficous_embeddings ADD COLUMN IF NOT EXISTS embedding_pgv vector({EMBEDDING_DIM})')
+
+    # Backfill a partir do float32 empacotado, em lotes (antes do índice: build único)
+    embeddings = sa.table(
+        'ficous_embeddings',
+        sa.column('id'),
+        sa.column('vector_f32', sa.LargeBinary()),
+    )
+    last_id = None
+    while True:
+        query = (
+            sa.select(embeddings.c.id, embeddings.c.vector_f32)
+            .where(embeddings.c.vector_f32.isnot(None))
+            .order_by(embeddings.c.id)
+            .limit(BATCH_SIZE)
+        )
+        if last_id is not None:
+            query = query.where(embeddings.c.id > last_id)
+        rows = bind.execute(query).fetchall()
+        if not rows:
+            break
+        params = []
+        for row_id, packed in rows:
+            vector = np.frombuffer(packed, dtype='<f4')
+            if vector.shape[0] == EMBEDDING_DIM:
+                params.append({
+                    'id': row_id,
+                    'vec': '[' + ','.join(f'{float(x):.7g}' for x in vector) + ']'
+                })
+        if params:
+            bind.execute(
+                sa.text('UPDATE ficous_embeddings SET embedding_pgv = CAST(:vec AS vector) WHERE id = :id'),
+                params
+            )
+        last_id = rows[-1][0]
+
+    op.execute(
+        'CREATE INDEX IF NOT EXISTS idx_embeddings_pgv_hnsw ON ficous_embeddings '
+        'USING hnsw (embedding_pgv vector_cosine_ops)'
+    )
+    op.create_index('idx_embeddings_user_pgv', 'ficous_embeddings', ['user_id'],
+                    postgresql_where=sa.text('embedding_pgv IS NOT NULL'))
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+    op.drop_index('idx_embeddings_user_pgv')
+    op.execute('DROP INDEX IF EXISTS idx_embeddings_pgv_hnsw')
+    op.execute('ALTER TABLE ficous_embeddings DROP COLUMN IF EXISTS embedding_pgv')
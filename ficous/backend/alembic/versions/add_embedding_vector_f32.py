@@ -0,0 +1,67 @@
+"""add packed float32 embedding vectors
+
+Revision ID: 003_embedding_vector_f32
+Revises: 002_exercise_indexes
+Create Date: 2025-02-XX
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+import numpy as np
+
+BATCH_SIZE = 500
+
+
+def upgrade():
+    op.add_column('ficous_embeddings', sa.Column('vector_f32', sa.LargeBinary(), nullable=True))
+
+    # Backfill: converte o JSON legado para float32 empacotado, em lotes
+    bind = op.get_bind()
+    embeddings = sa.table(
+        'ficous_embeddings',
+        sa.column('id'),
+        sa.column('vector', sa.Text()),
+        sa.column('vector_f32', sa.LargeBinary()),
+    )
+    while True:
+        rows = bind.execute(
+            sa.select(embeddings.c.id, embeddings.c.vector)
+            .where(embeddings.c.vector_f32.is_(None), embeddings.c.vector.isnot(None))
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        for row_id, vector in rows:
+            try:
+                packed = np.asarray(json.loads(vector), dtype='<f4').tobytes()
+            except Exception:
+                packed = None  # vetor corrompido: sem vetor = pendente, re-embedado por reembed_pending
+            bind.execute(
+                embeddings.update()
+                .where(embeddings.c.id == row_id)
+                .values(vector_f32=packed, vector=None)
+            )
+
+
+def downgrade():
+    # Restaura o JSON a partir do binário antes de remover a coluna
+    bind = op.get_bind()
+    embeddings = sa.table(
+        'ficous_embeddings',
+        sa.column('id'),
+        sa.column('vector', sa.Text()),
+        sa.column('vector_f32', sa.LargeBinary()),
+    )
+    rows = bind.execute(
+        sa.select(embeddings.c.id, embeddings.c.vector_f32)
+        .where(embeddings.c.vector.is_(None), embeddings.c.vector_f32.isnot(None))
+    ).fetchall()
+    for row_id, packed in rows:
+        vector = np.frombuffer(packed, dtype='<f4').tolist()
+        bind.execute(
+            embeddings.update()
+            .where(embeddings.c.id == row_id)
+            .values(vector=json.dumps(vector))
+        )
+    op.drop_column('ficous_embeddings', 'vector_f32')
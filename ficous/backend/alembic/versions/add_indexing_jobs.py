@@ -0,0 +1,39 @@
+"""add background indexing jobs table
+
+Revision ID: 009_indexing_jobs
+Revises: 008_embedding_discipline
+Create Date: 2025-02-XX
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# Mesmo mapeamento do GUID de app/models.py
+GUID = sa.CHAR(36).with_variant(postgresql.UUID(as_uuid=True), 'postgresql')
+
+
+def upgrade():
+    op.create_table(
+        'ficous_indexing_jobs',
+        sa.Column('id', GUID, primary_key=True),
+        sa.Column('user_id', GUID, nullable=False),
+        sa.Column('owner_type', sa.String(20), nullable=False),
+        sa.Column('owner_id', GUID, nullable=False),
+        sa.Column('status', sa.String(20), nullable=False, server_default='pending'),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('next_run_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index('idx_indexing_jobs_user', 'ficous_indexing_jobs', ['user_id'])
+    # Workers buscam jobs pendentes vencidos; coalescência procura pelo owner
+    op.create_index('idx_indexing_jobs_status_next_run', 'ficous_indexing_jobs', ['status', 'next_run_at'])
+    op.create_index('idx_indexing_jobs_owner', 'ficous_indexing_jobs', ['owner_type', 'owner_id', 'status'])
+
+
+def downgrade():
+    op.drop_index('idx_indexing_jobs_owner')
+    op.drop_index('idx_indexing_jobs_status_next_run')
+    op.drop_index('idx_indexing_jobs_user')
+    op.drop_table('ficous_indexing_jobs')
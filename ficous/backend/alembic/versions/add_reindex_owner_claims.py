@@ -0,0 +1,38 @@
+"""one running indexing job per owner; failed owners on reindex runs
+
+Revision ID: 014_reindex_owner_claims
+Revises: 013_concept_stats_unique
+Create Date: 2025-02-XX
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # Jobs running duplicados do mesmo owner: mantém o mais recente, os outros voltam para a fila
+    op.execute("""
+        UPDATE ficous_indexing_jobs SET status = 'pending'
+        WHERE status = 'running' AND id NOT IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY owner_type, owner_id ORDER BY updated_at DESC
+                ) AS position
+                FROM ficous_indexing_jobs WHERE status = 'running'
+            ) ranked WHERE position = 1
+        )
+    """)
+    # Claim atômico do owner: o segundo UPDATE/INSERT para running falha na constraint
+    op.create_index(
+        'uq_indexing_jobs_running_owner',
+        'ficous_indexing_jobs',
+        ['owner_type', 'owner_id'],
+        unique=True,
+        postgresql_where=sa.text("status = 'running'"),
+        sqlite_where=sa.text("status = 'running'")
+    )
+    op.add_column('ficous_reindex_runs', sa.Column('failed_owners', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('ficous_reindex_runs', 'failed_owners')
+    op.drop_index('uq_indexing_jobs_running_owner')
@@ -0,0 +1,40 @@
+"""add resumable bulk reindex runs
+
+Revision ID: 010_reindex_runs
+Revises: 009_indexing_jobs
+Create Date: 2025-02-XX
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# Mesmo mapeamento do GUID de app/models.py
+GUID = sa.CHAR(36).with_variant(postgresql.UUID(as_uuid=True), 'postgresql')
+
+
+def upgrade():
+    op.create_table(
+        'ficous_reindex_runs',
+        sa.Column('id', GUID, primary_key=True),
+        sa.Column('user_id', GUID, nullable=False),
+        sa.Column('content_type', sa.String(20), nullable=False),
+        sa.Column('status', sa.String(20), nullable=False, server_default='running'),
+        sa.Column('total_items', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('processed_items', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('failed_items', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('indexed_chunks', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('checkpoint_owner_type', sa.String(20), nullable=True),
+        sa.Column('checkpoint_owner_id', GUID, nullable=True),
+        sa.Column('elapsed_seconds', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('started_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+    )
+    # Polling e retomada procuram a última execução do usuário
+    op.create_index('idx_reindex_runs_user_started', 'ficous_reindex_runs', ['user_id', 'started_at'])
+
+
+def downgrade():
+    op.drop_index('idx_reindex_runs_user_started')
+    op.drop_table('ficous_reindex_runs')
@@ -43,6 +43,9 @@ def _build_engine():
     else:
         # Caso contrário, usa DATABASE_URL diretamente
         logger.info(f"Building engine with DATABASE_URL: {DATABASE_URL}")
+        if DATABASE_URL.startswith("sqlite"):
+            # Rotas async usam a sessão em mais de uma thread do threadpool (uma de cada vez)
+            return create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
         return create_engine(DATABASE_URL)
 
 def initialize_db():
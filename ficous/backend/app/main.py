@@ -6,12 +6,16 @@ from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 
-from .database import engine, Base, get_db_driver_info
+from .database import engine, Base, get_db_driver_info, SessionLocal
 from .config import CORS_ORIGINS
 from .routers import health
 from .routers import disciplines, notes, upload, sage
 from .routers import flashcards, exercises, progress, library
 from .routers import admin
+from .services.indexing_queue import recover_indexing_jobs
+from .services.embedding_gc import start_embedding_gc_scheduler, stop_embedding_gc_scheduler
+from .services.ann_index import flush_user_indexes
+from .services.openai_client import close_http_client, aclose_async_http_client
 
 
 @asynccontextmanager
@@ -23,7 +27,24 @@ async def lifespan(app: FastAPI):
         print(f"[Ficous] Database driver: {driver}")
     except Exception:
         pass
+    # Retomar a fila de indexação (jobs interrompidos por restart)
+    try:
+        db = SessionLocal()
+        try:
+            recovered = recover_indexing_jobs(db)
+        finally:
+            db.close()
+        if recovered:
+            print(f"[Ficous] Indexing jobs retomados: {recovered}")
+    except Exception:
+        pass
+    # Coleta periódica de embeddings órfãos (EMBEDDING_GC_INTERVAL_SECONDS > 0)
+    start_embedding_gc_scheduler()
     yield
+    stop_embedding_gc_scheduler()
+    flush_user_indexes()
+    close_http_client()
+    await aclose_async_http_client()
 
 
 # Configurar rate limiter
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, ForeignKey, Text, Float
+from sqlalchemy import Column, String, DateTime, ForeignKey, Text, Float, LargeBinary, Integer, UniqueConstraint, Index, text
 from sqlalchemy.dialects.postgresql import UUID as PG_UUID
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -184,6 +184,8 @@ class UserConceptStat(Base):
     success_rate = Column(String(20), nullable=True)
     last_seen_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
+    __table_args__ = (UniqueConstraint("user_id", "concept", name="uq_user_concept_stats_user_concept"),)
+
 
 class UserDisciplineStat(Base):
     __tablename__ = "ficous_user_discipline_stats"
@@ -206,10 +208,86 @@ class Embedding(Base):
     user_id = Column(GUID(), nullable=False, index=True)
     owner_type = Column(String(20), nullable=False)  # note|source|summary|concept
     owner_id = Column(GUID(), nullable=True, index=True)
+    # Desnormalizado da nota/fonte: filtro por disciplina sem subquery
+    discipline_id = Column(GUID(), ForeignKey("ficous_disciplines.id", ondelete="SET NULL"), nullable=True)
     chunk_text = Column(Text, nullable=False)
-    vector = Column(Text, nullable=True)  # JSON array de floats (1536d para OpenAI)
-    meta = Column(JSON, nullable=True)  # {concept_tags, strength, recency, tokens}
+    content_hash = Column(String(64), nullable=True)  # sha256 do chunk (diff incremental)
+    vector = Column(Text, nullable=True)  # legado: JSON array de floats (1536d para OpenAI)
+    vector_f32 = Column(LargeBinary, nullable=True)  # float32 little-endian empacotado (4 bytes/dim); NULL = pendente
+    embedding_model = Column(String(64), nullable=True)  # provedor/modelo do vetor (NULL = OpenAI legado)
+    # Quase-duplicata de outro chunk do usuário: sem vetor próprio, usa o da linha canônica.
+    # Canônica removida sem release_references: SET NULL deixa a referência pendente
+    canonical_id = Column(GUID(), ForeignKey("ficous_embeddings.id", ondelete="SET NULL"), nullable=True)
+    # Fatores do PersoScore carregados como arrays (NULL = default); recency sai de created_at na consulta
+    strength = Column(Float, nullable=True)
+    success_rate = Column(Float, nullable=True)
+    frequency = Column(Integer, nullable=True)
+    concept_affinity = Column(Float, nullable=True)
+    meta = Column(JSON, nullable=True)  # {concept_tags, tokens}
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class EmbeddingCacheEntry(Base):
+    """Cache endereçado por conteúdo: mesmo texto + modelo => mesmo vetor"""
+    __tablename__ = "ficous_embedding_cache"
+    __table_args__ = (
+        UniqueConstraint("model", "content_hash", name="uq_embedding_cache_model_hash"),
+    )
+
+    id = Column(GUID(), primary_key=True, default=uuid.uuid4, index=True)
+    model = Column(String(64), nullable=False)
+    content_hash = Column(String(64), nullable=False)  # sha256 hex do chunk
+    vector_f32 = Column(LargeBinary, nullable=False)
+    hits = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_used_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+
+class IndexingJob(Base):
+    """Fila de indexação em background (uma linha por pedido de (re)indexação)"""
+    __tablename__ = "ficous_indexing_jobs"
+    __table_args__ = (
+        # No máximo um job running por owner (worker da fila ou reindexação em massa)
+        Index(
+            "uq_indexing_jobs_running_owner", "owner_type", "owner_id", unique=True,
+            postgresql_where=text("status = 'running'"), sqlite_where=text("status = 'running'")
+        ),
+    )
+
+    id = Column(GUID(), primary_key=True, default=uuid.uuid4, index=True)
+    user_id = Column(GUID(), nullable=False, index=True)
+    owner_type = Column(String(20), nullable=False)  # note|source
+    owner_id = Column(GUID(), nullable=False)
+    status = Column(String(20), nullable=False, default="pending")  # pending|running|done|failed
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    next_run_at = Column(DateTime(timezone=True), server_default=func.now())  # backoff entre tentativas
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class ReindexRun(Base):
+    """Reindexação em massa (admin) com checkpoint para retomar de onde parou"""
+    __tablename__ = "ficous_reindex_runs"
+
+    id = Column(GUID(), primary_key=True, default=uuid.uuid4, index=True)
+    user_id = Column(GUID(), nullable=False, index=True)
+    content_type = Column(String(20), nullable=False)  # notes|sources|all
+    status = Column(String(20), nullable=False, default="running")  # running|done|failed|cancelled
+    total_items = Column(Integer, nullable=False, default=0)
+    processed_items = Column(Integer, nullable=False, default=0)
+    failed_items = Column(Integer, nullable=False, default=0)
+    indexed_chunks = Column(Integer, nullable=False, default=0)
+    # Checkpoint: último owner concluído (fase note/source + id, percorridos em ordem de id)
+    checkpoint_owner_type = Column(String(20), nullable=True)
+    checkpoint_owner_id = Column(GUID(), nullable=True)
+    elapsed_seconds = Column(Float, nullable=False, default=0.0)  # tempo efetivo de execução (sem pausas)
+    last_error = Column(Text, nullable=True)
+    # Owners que falharam (atrás do checkpoint): [[owner_type, owner_id], ...], re-tentados ao retomar
+    failed_owners = Column(JSON, nullable=True)
+    started_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
 
 
 class ExerciseItem(Base):
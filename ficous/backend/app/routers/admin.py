@@ -10,10 +10,20 @@ from datetime import datetime
 
 from ..database import get_db
 from ..security import get_current_user_id
-from .. import models
-from ..services.embeddings import index_note_content, index_source_content, retrieve_relevant_chunks
+from .. import models, schemas
+from ..services.embeddings import (
+    retrieve_relevant_chunks, retrieve_relevant_chunks_batch, count_pending_embeddings,
+    benchmark_quantization
+)
+from ..services.embedding_providers import get_embedding_provider
 from ..services.summaries import trigger_summary_updates, update_global_summary, update_discipline_summary
 from ..services.cache import get_cache_stats, clear_cache
+from ..services.embedding_cache import get_embedding_cache_stats
+from ..services.indexing_queue import get_indexing_status
+from ..services.bulk_reindex import (
+    start_reindex, get_reindex_status, CONTENT_TYPES as REINDEX_CONTENT_TYPES
+)
+from ..services.embedding_gc import collect_orphan_embeddings, get_embedding_gc_status
 
 
 router = APIRouter(prefix="/ficous/admin", tags=["ficous-admin"])
@@ -117,35 +127,50 @@ def recompute_stats(
 @router.post("/index-content")
 def index_content(
     content_type: str = Query(..., description="Tipo: 'notes', 'sources', 'all'"),
+    wait: bool = Query(False, description="Aguardar o fim da reindexação na própria requisição"),
+    restart: bool = Query(False, description="Começar do zero em vez de retomar do checkpoint"),
     user_id: UUID = Depends(get_current_user_id),
     db: Session = Depends(get_db)
 ):
-    """Indexa conteúdo para embeddings"""
+    """Reindexação em massa (em background, retomável); acompanhar em /index-content/status"""
     if not ADMIN_ENABLED:
         raise HTTPException(status_code=403, detail="Admin endpoints desabilitados")
+    if content_type not in REINDEX_CONTENT_TYPES:
+        raise HTTPException(status_code=400, detail="content_type deve ser 'notes', 'sources' ou 'all'")
     
     try:
-        indexed = 0
-        
-        if content_type in ["notes", "all"]:
-            notes = db.query(models.Note).filter(models.Note.user_id == user_id).all()
-            for note in notes:
-                indexed += index_note_content(note, db)
-        
-        if content_type in ["sources", "all"]:
-            sources = db.query(models.Source).filter(models.Source.user_id == user_id).all()
-            for source in sources:
-                indexed += index_source_content(source, db)
+        run = start_reindex(user_id, content_type, db, wait=wait, restart=restart)
+        progress = get_reindex_status(db, user_id, run_id=run.id)
         
         return {
             "success": True,
-            "message": f"Conteúdo indexado: {indexed} chunks",
-            "indexed_chunks": indexed
+            "message": f"Reindexação {progress['status']}: {progress['indexed_chunks']} chunks",
+            "indexed_chunks": progress["indexed_chunks"],
+            "run": progress
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao indexar conteúdo: {e}")
 
 
+@router.get("/index-content/status")
+def index_content_status(
+    run_id: Optional[UUID] = Query(None, description="Execução (default: a mais recente)"),
+    user_id: UUID = Depends(get_current_user_id),
+    db: Session = Depends(get_db)
+):
+    """Progresso da reindexação em massa: itens, chunks/s e ETA"""
+    if not ADMIN_ENABLED:
+        raise HTTPException(status_code=403, detail="Admin endpoints desabilitados")
+    
+    progress = get_reindex_status(db, user_id, run_id=run_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Nenhuma reindexação encontrada")
+    return {
+        "success": True,
+        "run": progress
+    }
+
+
 @router.get("/dry-run")
 def dry_run_rag(
     query: str = Query(..., description="Query para testar RAG"),
@@ -177,6 +202,120 @@ def dry_run_rag(
         raise HTTPException(status_code=500, detail=f"Erro no dry-run RAG: {e}")
 
 
+@router.post("/batch-retrieve")
+def batch_retrieve(
+    payload: schemas.BatchRetrieveIn,
+    user_id: UUID = Depends(get_current_user_id),
+    db: Session = Depends(get_db)
+):
+    """RAG para várias queries de uma vez (uma requisição de embeddings, um produto matriz-matriz)"""
+    if not ADMIN_ENABLED:
+        raise HTTPException(status_code=403, detail="Admin endpoints desabilitados")
+    
+    try:
+        discipline_id = str(payload.discipline_id) if payload.discipline_id else None
+        batches = retrieve_relevant_chunks_batch(
+            payload.queries, str(user_id), db, top_k=payload.top_k, discipline_id=discipline_id
+        )
+        return {
+            "success": True,
+            "results": [
+                {
+                    "query": query,
+                    "chunks_found": len(chunks),
+                    "chunks": [
+                        {
+                            "text": chunk["chunk_text"][:200] + "...",
+                            "similarity": chunk["similarity"],
+                            "perso_score": chunk["perso_score"],
+                            "owner_type": chunk["owner_type"],
+                            "owner_id": chunk["owner_id"]
+                        }
+                        for chunk in chunks
+                    ]
+                }
+                for query, chunks in zip(payload.queries, batches)
+            ]
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro no RAG em lote: {e}")
+
+
+@router.get("/quantization-benchmark")
+def quantization_benchmark(
+    k: int = Query(10, ge=1, le=100),
+    queries: int = Query(50, ge=1, le=1000),
+    user_id: UUID = Depends(get_current_user_id),
+    db: Session = Depends(get_db)
+):
+    """Recall dos modos float16/int8 contra float32 no corpus do usuário"""
+    if not ADMIN_ENABLED:
+        raise HTTPException(status_code=403, detail="Admin endpoints desabilitados")
+    
+    try:
+        return {
+            "success": True,
+            "benchmark": benchmark_quantization(str(user_id), db, k=k, n_queries=queries)
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro no benchmark de quantização: {e}")
+
+
+@router.get("/indexing-status")
+def indexing_status(
+    user_id: UUID = Depends(get_current_user_id),
+    db: Session = Depends(get_db)
+):
+    """Jobs de indexação em background (pending/running/done/failed) por nota/fonte"""
+    if not ADMIN_ENABLED:
+        raise HTTPException(status_code=403, detail="Admin endpoints desabilitados")
+    
+    try:
+        return {
+            "success": True,
+            **get_indexing_status(db, user_id)
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao obter status da indexação: {e}")
+
+
+@router.post("/embedding-gc")
+def embedding_gc(
+    dry_run: bool = Query(False, description="Só contar as linhas órfãs, sem remover"),
+    all_users: bool = Query(False, description="Varrer os embeddings de todos os usuários"),
+    user_id: UUID = Depends(get_current_user_id),
+    db: Session = Depends(get_db)
+):
+    """Remove embeddings de notas/fontes excluídas (em lotes) e compacta os índices"""
+    if not ADMIN_ENABLED:
+        raise HTTPException(status_code=403, detail="Admin endpoints desabilitados")
+    
+    try:
+        report = collect_orphan_embeddings(db, user_id=None if all_users else user_id, dry_run=dry_run)
+        return {
+            "success": True,
+            "message": (
+                f"{report['deleted_rows']} embeddings órfãos {'encontrados' if dry_run else 'removidos'}, "
+                f"{report['stale_rows']} vetores de outro modelo {'encontrados' if dry_run else 'liberados'}"
+            ),
+            "report": report
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro na coleta de embeddings órfãos: {e}")
+
+
+@router.get("/embedding-gc/status")
+def embedding_gc_status():
+    """Agendamento e resultado da última coleta de embeddings órfãos"""
+    if not ADMIN_ENABLED:
+        raise HTTPException(status_code=403, detail="Admin endpoints desabilitados")
+    
+    return {
+        "success": True,
+        **get_embedding_gc_status()
+    }
+
+
 @router.get("/cache-stats")
 def get_cache_stats_endpoint():
     """Retorna estatísticas do cache"""
@@ -222,20 +361,30 @@ def admin_health_check(
         # Contar entidades
         notes_count = db.query(models.Note).filter(models.Note.user_id == user_id).count()
         embeddings_count = db.query(models.Embedding).filter(models.Embedding.user_id == user_id).count()
+        pending_embeddings = count_pending_embeddings(db, user_id=user_id)
+        deduplicated_embeddings = db.query(models.Embedding).filter(
+            models.Embedding.user_id == user_id,
+            models.Embedding.canonical_id.isnot(None)
+        ).count()
         summaries_count = db.query(models.Summary).filter(models.Summary.user_id == user_id).count()
         interactions_count = db.query(models.Interaction).filter(models.Interaction.user_id == user_id).count()
         
         # Stats do cache
         cache_stats = get_cache_stats()
+        embedding_cache_stats = get_embedding_cache_stats(db)
         
         return {
             "success": True,
             "health": {
                 "notes": notes_count,
                 "embeddings": embeddings_count,
+                "pending_embeddings": pending_embeddings,
+                "deduplicated_embeddings": deduplicated_embeddings,
+                "embedding_model": get_embedding_provider().model,
                 "summaries": summaries_count,
                 "interactions": interactions_count,
-                "cache": cache_stats
+                "cache": cache_stats,
+                "embedding_cache": embedding_cache_stats
             }
         }
     except Exception as e:
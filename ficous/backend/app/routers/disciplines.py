@@ -6,6 +6,7 @@ from uuid import UUID
 from ..database import get_db
 from ..security import get_current_user_id
 from .. import models, schemas
+from ..services.embedding_gc import delete_owner_embeddings
 
 
 router = APIRouter(prefix="/ficous/disciplines", tags=["ficous-disciplines"])
@@ -59,7 +60,10 @@ def delete_discipline(
     item = db.query(models.Discipline).filter(models.Discipline.id == discipline_id, models.Discipline.user_id == user_id).first()
     if not item:
         raise HTTPException(status_code=404, detail="Disciplina não encontrada")
+    # As notas da disciplina são excluídas em cascata: seus chunks também saem
+    note_ids = [note_id for (note_id,) in db.query(models.Note.id).filter(models.Note.discipline_id == discipline_id).all()]
     db.delete(item)
+    delete_owner_embeddings(user_id, "note", note_ids, db)
     db.commit()
     return
 
@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from uuid import UUID
 from typing import List
@@ -10,7 +11,8 @@ from .sage import _call_openai_answer
 from .library import upload_source  # referência para contexto de source (somente uso de modelo de dados)
 from ..utils import extract_text_from_pdf_bytes
 from ..models import Source
-from ..services.embeddings import _get_embedding
+from ..services.embeddings import _get_embedding, LEGACY_EMBEDDING_MODEL
+from ..services.embedding_providers import get_embedding_provider
 from sklearn.metrics.pairwise import cosine_similarity
 from ..middleware.rate_limiting import limiter
 import json
@@ -159,11 +161,12 @@ def evaluate_open_answer(
             ans = json.loads(ans)
         
         reference_embedding_json = ans.get("reference_embedding")
-        if not reference_embedding_json:
+        # Referência de outro provedor não é comparável com o embedding atual
+        same_model = ans.get("embedding_model", LEGACY_EMBEDDING_MODEL) == get_embedding_provider().model
+        if not reference_embedding_json or not same_model:
             # Fallback: gerar embedding agora
             model_answer = ans.get("model_answer", "")
             reference_text = model_answer if model_answer else item.question
-            from ..services.embeddings import _get_embedding
             reference_embedding = _get_embedding(reference_text)
         else:
             reference_embedding = json.loads(reference_embedding_json)
@@ -177,13 +180,19 @@ def evaluate_open_answer(
             detail="Erro ao processar resposta modelo"
         )
     
+    if reference_embedding is None:
+        raise HTTPException(status_code=503, detail="Serviço de embeddings indisponível")
+    
     # Avaliar usando pipeline de pós-processamento
-    evaluation = evaluate_open_answer_semantic(
-        student_answer=payload.answer_text,
-        reference_embedding=reference_embedding,
-        key_concepts=key_concepts,
-        similarity_threshold=similarity_threshold
-    )
+    try:
+        evaluation = evaluate_open_answer_semantic(
+            student_answer=payload.answer_text,
+            reference_embedding=reference_embedding,
+            key_concepts=key_concepts,
+            similarity_threshold=similarity_threshold
+        )
+    except RuntimeError:
+        raise HTTPException(status_code=503, detail="Serviço de embeddings indisponível")
     
     return schemas.ExerciseEvaluateOut(
         similarity=evaluation["similarity"],
@@ -257,13 +266,8 @@ def grade_exercise(
 
     return schemas.ExerciseGradeOut(exercise_id=exercise_id, score=score_obj, items_results=results)
 
-@router.post("/generate", response_model=schemas.ExerciseOut)
-@limiter.limit("3/minute")  # ADICIONAR ESTA LINHA
-def generate_exercise(
-    payload: schemas.ExerciseGenerateIn,
-    db: Session = Depends(get_db),
-    user_id: UUID = Depends(get_current_user_id)
-):
+def _prepare_exercise_generation(payload: schemas.ExerciseGenerateIn, user_id: UUID, db: Session) -> dict:
+    """Contexto (banco), pré-processamento e prompt da geração"""
     # 1. OBTER CONTEXTO
     context = None
     if payload.note_id:
@@ -372,10 +376,32 @@ def generate_exercise(
         f"- Para questões 'open': sempre inclua pelo menos 2 key_concepts\n"
         f"- Dificuldade '{difficulty}': ajuste complexidade adequadamente\n"
     )
-    
-    # 5. CHAMADA À IA
-    result = _call_openai_answer(clean_context, prompt, level=2, lang=lang)
-    
+    return {
+        "clean_context": clean_context,
+        "prompt": prompt,
+        "lang": lang,
+        "qty": qty,
+        "kind": kind,
+        "difficulty": difficulty,
+        "pattern_mode": pattern_mode,
+        "topics": topics,
+        "entities": entities,
+        "word_count": preprocessed["validation"]["word_count"]
+    }
+
+
+def _save_generated_exercise(
+    payload: schemas.ExerciseGenerateIn,
+    user_id: UUID,
+    result,
+    prepared: dict,
+    db: Session
+):
+    """Pós-processamento da resposta da IA e gravação do exercício"""
+    qty, kind, difficulty = prepared["qty"], prepared["kind"], prepared["difficulty"]
+    pattern_mode, topics, entities = prepared["pattern_mode"], prepared["topics"], prepared["entities"]
+    from ..services.exercise_processing import postprocess_mcq_questions, postprocess_open_questions
+
     # 6. PÓS-PROCESSAMENTO
     try:
         data = result.payload or {}
@@ -442,7 +468,7 @@ def generate_exercise(
             "preprocessing": {
                 "topics": topics,
                 "entities": entities,
-                "word_count": preprocessed["validation"]["word_count"]
+                "word_count": prepared["word_count"]
             }
         }
     )
@@ -467,6 +493,22 @@ def generate_exercise(
     return ex
 
 
+@router.post("/generate", response_model=schemas.ExerciseOut)
+@limiter.limit("3/minute")  # ADICIONAR ESTA LINHA
+async def generate_exercise(
+    payload: schemas.ExerciseGenerateIn,
+    db: Session = Depends(get_db),
+    user_id: UUID = Depends(get_current_user_id)
+):
+    # Rota async: a chamada à IA aguarda sem ocupar thread; banco e pré/pós-processamento no threadpool
+    prepared = await run_in_threadpool(_prepare_exercise_generation, payload, user_id, db)
+
+    # 5. CHAMADA À IA
+    result = await _call_openai_answer(prepared["clean_context"], prepared["prompt"], level=2, lang=prepared["lang"])
+
+    return await run_in_threadpool(_save_generated_exercise, payload, user_id, result, prepared, db)
+
+
 @router.post("/{exercise_id}/submit", response_model=schemas.ExerciseOut)
 def submit_exercise(
     exercise_id: UUID,
@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from uuid import UUID
 from datetime import datetime, timedelta, timezone
@@ -41,27 +42,38 @@ def create_flashcard(
     return item
 
 
-@router.post("/generate", response_model=List[schemas.FlashcardOut])
-def generate_flashcards(
-    payload: schemas.FlashcardGenerateIn,
-    db: Session = Depends(get_db),
-    user_id: UUID = Depends(get_current_user_id)
-):
+def _load_flashcard_context(payload: schemas.FlashcardGenerateIn, user_id: UUID, db: Session) -> str:
     # montar contexto
-    context = None
     if payload.note_id:
         note = db.query(models.Note).filter(models.Note.id == payload.note_id, models.Note.user_id == user_id).first()
         if not note:
             raise HTTPException(status_code=404, detail="Nota não encontrada")
-        context = note.content or ""
+        return note.content or ""
     elif payload.raw_context:
-        context = payload.raw_context
-    else:
-        raise HTTPException(status_code=400, detail="Forneça note_id ou raw_context")
+        return payload.raw_context
+    raise HTTPException(status_code=400, detail="Forneça note_id ou raw_context")
+
+
+def _save_flashcards(cards: List[models.Flashcard], db: Session) -> List[models.Flashcard]:
+    for c in cards:
+        db.add(c)
+    db.commit()
+    for c in cards:
+        db.refresh(c)
+    return cards
+
+
+@router.post("/generate", response_model=List[schemas.FlashcardOut])
+async def generate_flashcards(
+    payload: schemas.FlashcardGenerateIn,
+    db: Session = Depends(get_db),
+    user_id: UUID = Depends(get_current_user_id)
+):
+    context = await run_in_threadpool(_load_flashcard_context, payload, user_id, db)
 
     # usar answer level2 para gerar conteúdo estruturado e derivar flashcards simples
     lang = (payload.output_language or "pt-BR").strip()
-    result = _call_openai_answer(context, f"Gere {payload.qty} flashcards (pergunta e resposta).", level=2, lang=lang)
+    result = await _call_openai_answer(context, f"Gere {payload.qty} flashcards (pergunta e resposta).", level=2, lang=lang)
 
     cards: List[models.Flashcard] = []
     # Esperamos slides com bullets ou payload livre; fallback: um card básico
@@ -84,12 +96,7 @@ def generate_flashcards(
     except Exception:
         cards.append(models.Flashcard(user_id=user_id, question="Resumo?", answer=""))
 
-    for c in cards:
-        db.add(c)
-    db.commit()
-    for c in cards:
-        db.refresh(c)
-    return cards
+    return await run_in_threadpool(_save_flashcards, cards, db)
 
 
 @router.get("/review", response_model=List[schemas.FlashcardOut])
@@ -9,6 +9,7 @@ from ..security import get_current_user_id
 from .. import models, schemas
 from ..utils import extract_text_from_pdf_bytes
 from ..config import MAX_UPLOAD_MB
+from ..services.embedding_gc import delete_owner_embeddings
 
 
 router = APIRouter(prefix="/ficous/library", tags=["ficous-library"])
@@ -80,7 +81,8 @@ def delete_source(
     if not src:
         raise HTTPException(status_code=404, detail="Fonte não encontrada")
     db.delete(src)
-    db.commit()
+    # Chunks da fonte saem na mesma transação (owner_id não tem FK/cascade)
+    delete_owner_embeddings(user_id, "source", [source_id], db)
     return
 
 
@@ -1,14 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from typing import List
 from uuid import UUID
 
 from ..database import get_db
 from ..security import get_current_user_id
-from .. import models, schemas
-from .sage import _call_openai_summarize_and_questions, _extract_concepts_and_tags
-from ..services.embeddings import index_note_content
+from .. import database, models, schemas
+from .sage import SageProcessOut, _call_openai_summarize_and_questions, _extract_concepts_and_tags
+from ..services.embeddings import set_owner_discipline
+from ..services.indexing_queue import enqueue_indexing
+from ..services.embedding_gc import delete_owner_embeddings
 import os
+import asyncio
 
 
 router = APIRouter(prefix="/ficous/notes", tags=["ficous-notes"])
@@ -35,12 +39,55 @@ def get_note(
     return item
 
 
-@router.post("/", response_model=schemas.NoteOut)
-def create_note(
-    payload: schemas.NoteCreate,
-    db: Session = Depends(get_db),
-    user_id: UUID = Depends(get_current_user_id)
-):
+def _load_note(note_id: UUID, db: Session):
+    return db.query(models.Note).filter(models.Note.id == note_id).first()
+
+
+def _save_auto_process(
+    item: models.Note,
+    user_id: UUID,
+    res: SageProcessOut,
+    concepts: List[str],
+    tags: List[str],
+    db: Session
+) -> None:
+    item.summary = res.summary
+    item.questions_json = res.questions
+    item.concepts_json = concepts
+    item.tags_json = tags
+    db.commit()
+    db.refresh(item)
+
+    # Indexar para embeddings (RAG) em background
+    try:
+        enqueue_indexing(user_id, "note", item.id, db)
+    except Exception as e:
+        print(f"Erro ao agendar indexação da nota {item.id}: {e}")
+
+
+async def _auto_process_note(note_id: UUID, user_id: UUID) -> None:
+    """
+    Tarefa em background (depois da resposta): resumo/perguntas e conceitos/tags
+    em paralelo, grava e agenda a indexação. Usa sessão própria.
+    """
+    db = database.SessionLocal()
+    try:
+        item = await run_in_threadpool(_load_note, note_id, db)
+        if item is None:
+            return  # excluída antes do processamento
+        lang = os.getenv("SAGE_DEFAULT_LANG", "pt-BR")
+        res, (concepts, tags) = await asyncio.gather(
+            _call_openai_summarize_and_questions(item.content, output_language=lang),
+            _extract_concepts_and_tags(item.content, output_language=lang)
+        )
+        await run_in_threadpool(_save_auto_process, item, user_id, res, concepts, tags, db)
+    except Exception as e:
+        print(f"Erro no auto-processamento da nota {note_id}: {e}")
+    finally:
+        db.close()
+
+
+def _insert_note(payload: schemas.NoteCreate, user_id: UUID, db: Session) -> models.Note:
     item = models.Note(
         user_id=user_id,
         discipline_id=payload.discipline_id,
@@ -50,36 +97,28 @@ def create_note(
     db.add(item)
     db.commit()
     db.refresh(item)
-    # Auto-processamento (resumo, perguntas, conceitos, tags)
-    if os.getenv("SAGE_AUTO_PROCESS", "true").lower() == "true":
-        lang = os.getenv("SAGE_DEFAULT_LANG", "pt-BR")
-        res = _call_openai_summarize_and_questions(item.content, output_language=lang)
-        concepts, tags = _extract_concepts_and_tags(item.content, output_language=lang)
-        item.summary = res.summary
-        item.questions_json = res.questions
-        item.concepts_json = concepts
-        item.tags_json = tags
-        db.commit()
-        db.refresh(item)
-        
-        # Indexar para embeddings (RAG)
-        try:
-            index_note_content(item, db)
-        except Exception as e:
-            print(f"Erro ao indexar nota {item.id} para embeddings: {e}")
     return item
 
 
-@router.put("/{note_id}", response_model=schemas.NoteOut)
-def update_note(
-    note_id: UUID,
-    payload: schemas.NoteUpdate,
+@router.post("/", response_model=schemas.NoteOut)
+async def create_note(
+    payload: schemas.NoteCreate,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     user_id: UUID = Depends(get_current_user_id)
 ):
+    item = await run_in_threadpool(_insert_note, payload, user_id, db)
+    # Auto-processamento (resumo, perguntas, conceitos, tags) depois da resposta
+    if os.getenv("SAGE_AUTO_PROCESS", "true").lower() == "true":
+        background_tasks.add_task(_auto_process_note, item.id, user_id)
+    return item
+
+
+def _apply_note_update(note_id: UUID, payload: schemas.NoteUpdate, user_id: UUID, db: Session) -> models.Note:
     item = db.query(models.Note).filter(models.Note.id == note_id, models.Note.user_id == user_id).first()
     if not item:
         raise HTTPException(status_code=404, detail="Nota não encontrada")
+    discipline_moved = payload.discipline_id is not None and str(payload.discipline_id) != str(item.discipline_id)
     if payload.discipline_id is not None:
         item.discipline_id = payload.discipline_id
     if payload.title is not None:
@@ -96,23 +135,24 @@ def update_note(
         item.concepts_json = payload.concepts_json
     db.commit()
     db.refresh(item)
-    # Auto-processamento se o conteúdo foi alterado
+    # Embeddings guardam a disciplina (filtro do RAG sem subquery)
+    if discipline_moved:
+        set_owner_discipline(user_id, "note", item.id, item.discipline_id, db)
+    return item
+
+
+@router.put("/{note_id}", response_model=schemas.NoteOut)
+async def update_note(
+    note_id: UUID,
+    payload: schemas.NoteUpdate,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    user_id: UUID = Depends(get_current_user_id)
+):
+    item = await run_in_threadpool(_apply_note_update, note_id, payload, user_id, db)
+    # Auto-processamento (depois da resposta) se o conteúdo foi alterado
     if payload.content is not None and os.getenv("SAGE_AUTO_PROCESS", "true").lower() == "true":
-        lang = os.getenv("SAGE_DEFAULT_LANG", "pt-BR")
-        res = _call_openai_summarize_and_questions(item.content, output_language=lang)
-        concepts, tags = _extract_concepts_and_tags(item.content, output_language=lang)
-        item.summary = res.summary
-        item.questions_json = res.questions
-        item.concepts_json = concepts
-        item.tags_json = tags
-        db.commit()
-        db.refresh(item)
-        
-        # Re-indexar para embeddings (RAG)
-        try:
-            index_note_content(item, db)
-        except Exception as e:
-            print(f"Erro ao re-indexar nota {item.id} para embeddings: {e}")
+        background_tasks.add_task(_auto_process_note, item.id, user_id)
     return item
 
 
@@ -126,7 +166,8 @@ def delete_note(
     if not item:
         raise HTTPException(status_code=404, detail="Nota não encontrada")
     db.delete(item)
-    db.commit()
+    # Chunks da nota saem na mesma transação (owner_id não tem FK/cascade)
+    delete_owner_embeddings(user_id, "note", [note_id], db)
     return
 
 
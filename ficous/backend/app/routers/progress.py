@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from uuid import UUID
 from datetime import datetime, timezone
@@ -46,11 +47,7 @@ def overview(
     }
 
 
-@router.get("/insights")
-def insights(
-    db: Session = Depends(get_db),
-    user_id: UUID = Depends(get_current_user_id)
-):
+def _insights_context(user_id: UUID, db: Session) -> str:
     # Montar um contexto curto a partir dos últimos itens do usuário
     latest_notes = db.query(models.Note).filter(models.Note.user_id == user_id).order_by(models.Note.created_at.desc()).limit(3).all()
     ctx_parts = []
@@ -59,13 +56,21 @@ def insights(
             ctx_parts.append(n.summary)
         elif n.content:
             ctx_parts.append((n.content or "")[:500])
-    context = "\n".join(ctx_parts)[:2000] if ctx_parts else ""
+    return "\n".join(ctx_parts)[:2000] if ctx_parts else ""
+
+
+@router.get("/insights")
+async def insights(
+    db: Session = Depends(get_db),
+    user_id: UUID = Depends(get_current_user_id)
+):
+    context = await run_in_threadpool(_insights_context, user_id, db)
 
     prompt = "Gere 2-3 insights objetivos sobre estudo/progresso e uma sugestão de próxima ação. Responda em JSON: {insights: string[], next_action: string}"
     lang = "pt-BR"
 
     try:
-        result = _call_openai_answer(context, prompt, level=1, lang=lang)
+        result = await _call_openai_answer(context, prompt, level=1, lang=lang)
         payload = result.payload or {}
         # Tentar mapear balloons -> insights
         balloons = payload.get("balloons") or []
@@ -1,6 +1,7 @@
 import os
 from typing import List, Optional, Any
 from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from pydantic import BaseModel, Field
 from uuid import UUID
@@ -9,10 +10,12 @@ from ..database import get_db
 from ..security import get_current_user_id
 from .. import models
 from ..utils import _clean_text
-from ..services.embeddings import retrieve_relevant_chunks, update_concept_strength
+from ..services.embeddings import retrieve_relevant_chunks_async
+from ..services.concept_stats import update_concept_strengths
 from ..services.cache import get_cached_response, set_cached_response
 from ..services.summaries import update_global_summary, update_discipline_summary
 from ..services.circuit_breaker import call_openai_with_retry
+from ..services.openai_client import achat_completion
 from ..utils.sanitization import sanitize_prompt, sanitize_context, validate_sage_input
 from ..middleware.rate_limiting import sage_rate_limit, SAGE_ANSWER_LIMITS
 
@@ -32,7 +35,7 @@ class SageProcessOut(BaseModel):
     questions: List[str]
 
 
-def _call_openai_summarize_and_questions(text: str, output_language: str = "pt-BR") -> SageProcessOut:
+async def _call_openai_summarize_and_questions(text: str, output_language: str = "pt-BR") -> SageProcessOut:
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         # Fallback simples se falta API key
@@ -44,7 +47,7 @@ def _call_openai_summarize_and_questions(text: str, output_language: str = "pt-B
         ]
         return SageProcessOut(summary=summary, questions=questions)
 
-    import httpx
+    import json
     system_prompt = (
         "Você é um assistente que escreve no idioma solicitado. "
         f"Idioma de saída: {output_language}. "
@@ -52,21 +55,16 @@ def _call_openai_summarize_and_questions(text: str, output_language: str = "pt-B
         "Responda em JSON: {summary: string, questions: string[]}"
     )
     user_prompt = text[:8000]
-    payload = {
-        "model": "gpt-4o-mini",
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ],
-        "temperature": 0.2
-    }
-    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
     try:
-        with httpx.Client(timeout=30) as client:
-            resp = client.post("https://api.openai.com/v1/chat/completions", json=payload, headers=headers)
-            resp.raise_for_status()
-            data = resp.json()
-            content = data["choices"][0]["message"]["content"]
+        content = await achat_completion(system_prompt, user_prompt, timeout=30, api_key=api_key)
+        parsed = json.loads(content)
+        summary = parsed.get("summary") or ""
+        questions = parsed.get("questions") or []
+        if not isinstance(questions, list):
+            questions = [str(questions)]
+        if not summary:
+            summary = (text[:200] + "...") if len(text) > 200 else text
+        return SageProcessOut(summary=str(summary), questions=[str(q) for q in questions][:5])
     except Exception as e:
         # Fallback mínimo
         summary = (text[:200] + "...") if len(text) > 200 else text
@@ -74,7 +72,7 @@ def _call_openai_summarize_and_questions(text: str, output_language: str = "pt-B
         return SageProcessOut(summary=summary, questions=questions)
 
 
-def _extract_concepts_and_tags(text: str, output_language: str = "pt-BR") -> tuple[list[str], list[str]]:
+async def _extract_concepts_and_tags(text: str, output_language: str = "pt-BR") -> tuple[list[str], list[str]]:
     """Extrai listas de conceitos e tags via OpenAI; fallback heurístico simples.
     Retorna (concepts, tags).
     """
@@ -96,7 +94,7 @@ def _extract_concepts_and_tags(text: str, output_language: str = "pt-BR") -> tup
         tags = [u.lower() for u in uniq[:8]]
         return concepts, tags
 
-    import httpx, json
+    import json
     system_prompt = (
         "Você é um assistente que escreve no idioma solicitado. "
         f"Idioma de saída: {output_language}. "
@@ -104,21 +102,8 @@ def _extract_concepts_and_tags(text: str, output_language: str = "pt-BR") -> tup
         "Responda em JSON: {concepts: string[], tags: string[]}"
     )
     user_prompt = text[:8000]
-    payload = {
-        "model": "gpt-4o-mini",
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ],
-        "temperature": 0.2
-    }
-    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
     try:
-        with httpx.Client(timeout=30) as client:
-            resp = client.post("https://api.openai.com/v1/chat/completions", json=payload, headers=headers)
-            resp.raise_for_status()
-            data = resp.json()
-            content = data["choices"][0]["message"]["content"]
+        content = await achat_completion(system_prompt, user_prompt, timeout=30, api_key=api_key)
         parsed = json.loads(content)
         concepts = parsed.get("concepts") or []
         tags = parsed.get("tags") or []
@@ -189,7 +174,7 @@ def _build_level_system_prompt(level: int, lang: str) -> str:
     )
 
 
-def _call_openai_answer(context: str, prompt: str, level: int, lang: str) -> SageAnswerOut:
+async def _call_openai_answer(context: str, prompt: str, level: int, lang: str) -> SageAnswerOut:
     api_key = os.getenv("OPENAI_API_KEY")
     # Fallback simples sem API: devolve estrutura mínima
     if not api_key:
@@ -205,27 +190,14 @@ def _call_openai_answer(context: str, prompt: str, level: int, lang: str) -> Sag
             {"title": "Resumo", "content": prompt[:400]}
         ]})
 
-    import httpx, json
+    import json
     system_prompt = _build_level_system_prompt(level, lang)
     user_prompt = (
         "Contexto:\n" + context[:6000] + "\n\n" +
         "Solicitação:\n" + prompt[:1500]
     )
-    payload = {
-        "model": "gpt-4o-mini",
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ],
-        "temperature": 0.2
-    }
-    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
     try:
-        with httpx.Client(timeout=40) as client:
-            resp = client.post("https://api.openai.com/v1/chat/completions", json=payload, headers=headers)
-            resp.raise_for_status()
-            data = resp.json()
-            content = data["choices"][0]["message"]["content"]
+        content = await achat_completion(system_prompt, user_prompt, timeout=40, api_key=api_key)
         parsed = json.loads(content)
         # Validação mínima
         t = parsed.get("type") or (f"level{level}")
@@ -246,18 +218,12 @@ def _call_openai_answer(context: str, prompt: str, level: int, lang: str) -> Sag
         ]})
 
 
-@router.post("/answer", response_model=SageAnswerOut)
-def answer(
-    payload: SageAnswerIn,
-    request: Request,
-    db: Session = Depends(get_db),
-    user_id: UUID = Depends(get_current_user_id)
-):
-    # 1. Montar contexto principal
+def _load_answer_context(payload: SageAnswerIn, user_id: UUID, db: Session):
+    """Contexto principal da pergunta: (nota, disciplina, texto)"""
     context: Optional[str] = None
     note: Optional[models.Note] = None
     discipline: Optional[models.Discipline] = None
-    
+
     if payload.note_id:
         note = db.query(models.Note).filter(models.Note.id == payload.note_id, models.Note.user_id == user_id).first()
         if not note:
@@ -276,49 +242,24 @@ def answer(
         context = payload.raw_context
     else:
         raise HTTPException(status_code=400, detail="Forneça note_id, discipline_id ou raw_context")
+    return note, discipline, context
 
-    # 1.5. Validar e sanitizar inputs
-    is_valid, error_msg = validate_sage_input(payload.prompt, context)
-    if not is_valid:
-        raise HTTPException(status_code=400, detail=error_msg)
-    
-    # Sanitizar prompt e contexto
-    sanitized_prompt = sanitize_prompt(payload.prompt)
-    if context:
-        context = sanitize_context(context)
-    
-    # Normalização opcional
-    if payload.normalize and isinstance(context, str):
-        try:
-            context = _clean_text(context)
-        except Exception:
-            pass
-    
-    # Idioma
-    lang = (payload.output_language or "pt-BR").strip()
-    if len(lang) > 10:
-        lang = "pt-BR"
 
-    # 2. Construir Megacontexto (RAG + summaries + conceitos)
+def _build_megacontext(
+    relevant_chunks: List[dict],
+    context: Optional[str],
+    discipline: Optional[models.Discipline],
+    user_id: UUID,
+    db: Session
+) -> str:
+    """Megacontexto: RAG + summaries + conceitos fracos + conteúdo principal"""
     megacontext_parts = []
 
-    # RAG: Recuperar chunks relevantes
-    try:
-        relevant_chunks = retrieve_relevant_chunks(
-            query=sanitized_prompt,
-            user_id=str(user_id),
-            db=db,
-            top_k=3,
-            discipline_id=str(discipline.id) if discipline else None
-        )
-        
-        if relevant_chunks:
-            rag_context = "Conteúdo relacionado encontrado:\n"
-            for chunk in relevant_chunks:
-                rag_context += f"- {chunk['chunk_text'][:200]}...\n"
-            megacontext_parts.append(rag_context)
-    except Exception:
-        pass
+    if relevant_chunks:
+        rag_context = "Conteúdo relacionado encontrado:\n"
+        for chunk in relevant_chunks:
+            rag_context += f"- {chunk['chunk_text'][:200]}...\n"
+        megacontext_parts.append(rag_context)
 
     # Resumo Global do Usuário
     try:
@@ -362,9 +303,17 @@ def answer(
     
     # Limitar tamanho do contexto
     max_context_len = int(os.getenv("SAGE_MAX_CONTEXT_CHARS", "16000"))
-    final_context = final_context[:max_context_len]
+    return final_context[:max_context_len]
 
-    # 3. Verificar cache
+
+def _answer_from_cache(
+    payload: SageAnswerIn,
+    user_id: UUID,
+    sanitized_prompt: str,
+    final_context: str,
+    db: Session
+) -> Optional[SageAnswerOut]:
+    """Resposta em cache (registrando a interação) ou None"""
     cached_response = get_cached_response(sanitized_prompt, final_context, "gpt-4o-mini")
     if cached_response:
         # Registrar interação do cache
@@ -382,17 +331,24 @@ def answer(
             return SageAnswerOut(type=cached_response.get("type", "level1"), payload=cached_response.get("payload", {}))
         except Exception:
             pass
+    return None
 
-    # 4. Chamar IA com circuit breaker
-    result = _call_openai_answer(final_context, sanitized_prompt, payload.level, lang)
-    
-    # 5. Armazenar no cache
+
+def _record_answer(
+    payload: SageAnswerIn,
+    user_id: UUID,
+    note: Optional[models.Note],
+    sanitized_prompt: str,
+    final_context: str,
+    result: SageAnswerOut,
+    db: Session
+) -> None:
+    """Cache da resposta, registro da interação e força dos conceitos"""
     try:
         set_cached_response(sanitized_prompt, final_context, result.model_dump(), "gpt-4o-mini")
     except Exception:
         pass
 
-    # 6. Registrar interação
     try:
         interaction = models.Interaction(
             user_id=user_id,
@@ -409,38 +365,75 @@ def answer(
         # Atualizar força de conceitos baseado na interação
         try:
             if note and note.concepts_json:
-                for concept in note.concepts_json:
-                    update_concept_strength(concept, str(user_id), 0.1, db)
+                update_concept_strengths(user_id, [(concept, 0.1) for concept in note.concepts_json], db)
         except Exception:
             pass
-        
-        return result
     except Exception:
-        return result
-
-    # Tentar parsear JSON do modelo; se falhar, fallback simples
-    try:
-        import json
-        parsed = json.loads(content)
-        summary = parsed.get("summary") or ""
-        questions = parsed.get("questions") or []
-        if not isinstance(questions, list):
-            questions = [str(questions)]
-        if not summary:
-            summary = (text[:200] + "...") if len(text) > 200 else text
-        return SageProcessOut(summary=summary, questions=[str(q) for q in questions][:5])
-    except Exception:
-        summary = (text[:200] + "...") if len(text) > 200 else text
-        questions = ["Quais são os tópicos-chave?", "Quais exemplos suportam o conteúdo?"]
-        return SageProcessOut(summary=summary, questions=questions)
+        pass
 
 
-@router.post("/process", response_model=SageProcessOut)
-def process_note(
-    payload: SageProcessIn,
+@router.post("/answer", response_model=SageAnswerOut)
+async def answer(
+    payload: SageAnswerIn,
+    request: Request,
     db: Session = Depends(get_db),
     user_id: UUID = Depends(get_current_user_id)
 ):
+    # Rota async: chamadas ao modelo/embedding aguardam sem ocupar thread; banco roda no threadpool
+    # 1. Montar contexto principal
+    note, discipline, context = await run_in_threadpool(_load_answer_context, payload, user_id, db)
+
+    # 1.5. Validar e sanitizar inputs
+    is_valid, error_msg = validate_sage_input(payload.prompt, context)
+    if not is_valid:
+        raise HTTPException(status_code=400, detail=error_msg)
+    
+    # Sanitizar prompt e contexto
+    sanitized_prompt = sanitize_prompt(payload.prompt)
+    if context:
+        context = sanitize_context(context)
+    
+    # Normalização opcional
+    if payload.normalize and isinstance(context, str):
+        try:
+            context = _clean_text(context)
+        except Exception:
+            pass
+    
+    # Idioma
+    lang = (payload.output_language or "pt-BR").strip()
+    if len(lang) > 10:
+        lang = "pt-BR"
+
+    # 2. Construir Megacontexto (RAG + summaries + conceitos)
+    relevant_chunks: List[dict] = []
+    try:
+        relevant_chunks = await retrieve_relevant_chunks_async(
+            query=sanitized_prompt,
+            user_id=str(user_id),
+            db=db,
+            top_k=3,
+            discipline_id=str(discipline.id) if discipline else None
+        )
+    except Exception:
+        pass
+    final_context = await run_in_threadpool(_build_megacontext, relevant_chunks, context, discipline, user_id, db)
+
+    # 3. Verificar cache
+    cached = await run_in_threadpool(_answer_from_cache, payload, user_id, sanitized_prompt, final_context, db)
+    if cached:
+        return cached
+
+    # 4. Chamar IA
+    result = await _call_openai_answer(final_context, sanitized_prompt, payload.level, lang)
+
+    # 5-6. Armazenar no cache e registrar interação
+    await run_in_threadpool(_record_answer, payload, user_id, note, sanitized_prompt, final_context, result, db)
+    return result
+
+
+def _load_process_text(payload: SageProcessIn, user_id: UUID, db: Session):
+    """Texto a processar: (nota, texto)"""
     text: Optional[str] = None
     note: Optional[models.Note] = None
     if payload.note_id:
@@ -454,6 +447,23 @@ def process_note(
         text = payload.raw_content[:max_len]
     else:
         raise HTTPException(status_code=400, detail="Forneça note_id ou raw_content")
+    return note, text
+
+
+def _save_note_processing(note: models.Note, result: SageProcessOut, db: Session) -> None:
+    note.summary = result.summary
+    note.questions_json = result.questions
+    db.commit()
+    db.refresh(note)
+
+
+@router.post("/process", response_model=SageProcessOut)
+async def process_note(
+    payload: SageProcessIn,
+    db: Session = Depends(get_db),
+    user_id: UUID = Depends(get_current_user_id)
+):
+    note, text = await run_in_threadpool(_load_process_text, payload, user_id, db)
 
     # Normalização opcional antes do processamento
     if payload.normalize and isinstance(text, str):
@@ -469,14 +479,9 @@ def process_note(
     lang = (payload.output_language or "pt-BR").strip()
     if len(lang) > 10:
         lang = "pt-BR"
-    result = _call_openai_summarize_and_questions(text, output_language=lang)
+    result = await _call_openai_summarize_and_questions(text, output_language=lang)
 
     if note:
-        note.summary = result.summary
-        note.questions_json = result.questions
-        db.commit()
-        db.refresh(note)
+        await run_in_threadpool(_save_note_processing, note, result, db)
 
     return result
-
-
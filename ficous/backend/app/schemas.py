@@ -202,3 +202,13 @@ class SourceOut(BaseModel):
         from_attributes = True
 
 
+
+
+# -----------------
+# Admin
+# -----------------
+
+class BatchRetrieveIn(BaseModel):
+    queries: List[str] = Field(min_length=1, max_length=100)
+    top_k: int = Field(default=5, ge=1, le=50)
+    discipline_id: Optional[UUID] = None
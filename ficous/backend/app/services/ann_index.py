@@ -0,0 +1,286 @@
+"""
+Índice aproximado (IVF) em NumPy puro para corpora grandes por usuário.
+
+Vetores são agrupados em listas por k-means esférico; na consulta apenas as
+`nprobe` listas mais próximas da query são pontuadas. Abaixo de
+ANN_MIN_VECTORS a busca exata continua sendo usada.
+
+O índice é sincronizado (diferença de ids) uma vez por matriz de vetores:
+uma matriz nova só existe quando a versão do corpus mudou (ou o TTL do cache
+venceu). Treino e gravação em disco rodam fora do lock global; depois do
+treino o índice é gravado na hora, já sincronizações e atualizações só marcam
+o usuário como sujo e a gravação fica para `flush_user_indexes` (worker da
+fila e coleta periódica), fora das requisições.
+"""
+import os
+import weakref
+import threading
+from typing import List, Dict, Optional, Iterable, Tuple, Any
+import numpy as np
+
+# Configurações do índice ANN
+ANN_ENABLED = os.getenv("ANN_ENABLED", "true").lower() == "true"
+ANN_MIN_VECTORS = int(os.getenv("ANN_MIN_VECTORS", "20000"))  # abaixo disso: busca exata
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))  # mais listas = mais recall, mais latência
+ANN_INDEX_DIR = os.getenv("ANN_INDEX_DIR", "./ann_indexes")
+ANN_TRAIN_ITERATIONS = 8
+ANN_ASSIGN_BLOCK = 8192
+
+_lock = threading.Lock()
+_indexes: Dict[str, "IVFIndex"] = {}
+_training: set = set()  # usuários com treino em andamento
+_dirty: set = set()  # usuários com alterações ainda não gravadas em disco
+_flush_lock = threading.Lock()  # gravações em ordem: um snapshot antigo não sobrescreve um novo
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+class IVFIndex:
+    """Inverted file index: centroides + listas de ids por centroide"""
+
+    def __init__(self, centroids: np.ndarray):
+        self.centroids = centroids.astype(np.float32, copy=False)
+        self.lists: List[set] = [set() for _ in range(len(centroids))]
+        self.assignments: Dict[str, int] = {}
+        self.trained_size = 0
+        self._synced_with: Optional[weakref.ref] = None  # última matriz sincronizada
+
+    def __len__(self) -> int:
+        return len(self.assignments)
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def train(
+        cls,
+        matrix: np.ndarray,
+        ids: List[Any],
+        n_lists: Optional[int] = None,
+        seed: int = 0
+    ) -> "IVFIndex":
+        """Treina centroides (k-means esférico sobre amostra) e atribui todas as linhas"""
+        n = matrix.shape[0]
+        if n_lists is None:
+            n_lists = int(np.clip(np.sqrt(n), 16, 4096))
+        n_lists = max(1, min(n_lists, n))
+
+        rng = np.random.default_rng(seed)
+        sample_size = min(n, n_lists * 64)
+        sample = _normalize_rows(matrix[rng.choice(n, sample_size, replace=False)])
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+
+        for _ in range(ANN_TRAIN_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=n_lists)
+            empty = counts == 0
+            # Listas vazias são re-semeadas com pontos aleatórios da amostra
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+            centroids = _normalize_rows(sums)
+
+        index = cls(centroids)
+        index.add(ids, matrix)
+        index.trained_size = n
+        return index
+
+    def _assign(self, matrix: np.ndarray) -> np.ndarray:
+        labels = np.empty(matrix.shape[0], dtype=np.int64)
+        for start in range(0, matrix.shape[0], ANN_ASSIGN_BLOCK):
+            block = matrix[start:start + ANN_ASSIGN_BLOCK]
+            labels[start:start + ANN_ASSIGN_BLOCK] = np.argmax(block @ self.centroids.T, axis=1)
+        return labels
+
+    def add(self, ids: List[Any], matrix: np.ndarray) -> None:
+        """Adiciona (ou reatribui) vetores ao índice"""
+        if not len(ids):
+            return
+        labels = self._assign(np.asarray(matrix, dtype=np.float32))
+        for emb_id, label in zip(ids, labels):
+            key = str(emb_id)
+            previous = self.assignments.get(key)
+            if previous is not None:
+                self.lists[previous].discard(key)
+            self.assignments[key] = int(label)
+            self.lists[int(label)].add(key)
+
+    def remove(self, ids: Iterable[Any]) -> None:
+        for emb_id in ids:
+            key = str(emb_id)
+            label = self.assignments.pop(key, None)
+            if label is not None:
+                self.lists[label].discard(key)
+
+    def is_synced_with(self, vm: Any) -> bool:
+        return self._synced_with is not None and self._synced_with() is vm
+
+    def mark_synced(self, vm: Any) -> None:
+        self._synced_with = weakref.ref(vm)
+
+    def sync(self, ids: List[Any], matrix: np.ndarray) -> bool:
+        """Aplica a diferença entre os ids do índice e os da matriz; True se algo mudou"""
+        current = {str(i): row for row, i in enumerate(ids)}
+        stale = [k for k in self.assignments if k not in current]
+        missing = [k for k in current if k not in self.assignments]
+        self.remove(stale)
+        if missing:
+            self.add(missing, matrix[[current[k] for k in missing]])
+        return bool(stale or missing)
+
+    def needs_retrain(self) -> bool:
+        """Crescimento grande desde o treino degrada o balanceamento das listas"""
+        return len(self) > 2 * max(self.trained_size, 1)
+
+    def search(self, query: np.ndarray, nprobe: int = ANN_NPROBE) -> List[str]:
+        """Ids candidatos das `nprobe` listas mais próximas da query (normalizada)"""
+        nprobe = max(1, min(nprobe, self.n_lists))
+        scores = self.centroids @ np.asarray(query, dtype=np.float32)
+        if nprobe < self.n_lists:
+            probe = np.argpartition(-scores, nprobe - 1)[:nprobe]
+        else:
+            probe = np.arange(self.n_lists)
+        candidates: List[str] = []
+        for label in probe:
+            candidates.extend(self.lists[int(label)])
+        return candidates
+
+    def snapshot(self) -> Dict[str, np.ndarray]:
+        """Cópia dos arrays a serializar (tirada sob o lock, gravada fora dele)"""
+        keys = list(self.assignments)
+        return {
+            "centroids": self.centroids,
+            "ids": np.asarray(keys, dtype=str),
+            "labels": np.asarray([self.assignments[k] for k in keys], dtype=np.int32),
+            "trained_size": np.asarray(self.trained_size)
+        }
+
+    def save(self, path: str) -> None:
+        """Serializa centroides e atribuições em .npz"""
+        _write_snapshot(path, self.snapshot())
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        with np.load(path) as data:
+            index = cls(data["centroids"])
+            for key, label in zip(data["ids"].tolist(), data["labels"].tolist()):
+                index.assignments[key] = label
+                index.lists[label].add(key)
+            index.trained_size = int(data["trained_size"])
+        return index
+
+
+def _write_snapshot(path: str, snapshot: Dict[str, np.ndarray]) -> None:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp.npz"
+    np.savez_compressed(tmp_path, **snapshot)
+    os.replace(tmp_path, path)
+
+
+def _index_path(user_id: str) -> str:
+    return os.path.join(ANN_INDEX_DIR, f"{user_id}.npz")
+
+
+def _get_loaded_index(user_id: str) -> Optional[IVFIndex]:
+    index = _indexes.get(user_id)
+    if index is None and os.path.exists(_index_path(user_id)):
+        try:
+            index = IVFIndex.load(_index_path(user_id))
+            _indexes[user_id] = index
+        except Exception:
+            index = None
+    return index
+
+
+def get_user_index(user_id: str, vm: Any) -> Optional[IVFIndex]:
+    """
+    Índice do usuário para a matriz atual (treina ou sincroniza quando preciso).
+    Retorna None quando a busca exata deve ser usada.
+    """
+    if not ANN_ENABLED or len(vm) < ANN_MIN_VECTORS:
+        return None
+    key = str(user_id)
+    with _lock:
+        index = _get_loaded_index(key)
+        usable = index is not None and not index.needs_retrain() and index.centroids.shape[1] == vm.dim
+        if usable:
+            if index.is_synced_with(vm):
+                return index
+            # Matriz nova (corpus mudou aqui ou em outro processo): sincroniza pela diferença de ids
+            if index.sync(vm.ids, vm.matrix):
+                _dirty.add(key)
+            index.mark_synced(vm)
+        elif key in _training:
+            return None  # outra thread está treinando: busca exata até a troca
+        else:
+            _training.add(key)
+
+    if usable:
+        return index
+
+    # k-means fora do lock global: consultas de outros usuários não esperam o treino
+    try:
+        index = IVFIndex.train(vm.matrix, vm.ids)
+        index.mark_synced(vm)
+        with _lock:
+            _indexes[key] = index
+            _dirty.discard(key)
+            snapshot = index.snapshot()
+    finally:
+        with _lock:
+            _training.discard(key)
+    _save_quietly(key, snapshot)
+    return index
+
+
+def update_user_index(
+    user_id: str,
+    added: List[Tuple[Any, np.ndarray]],
+    removed_ids: List[Any]
+) -> None:
+    """Atualização incremental após indexação (só se o usuário já tiver índice); grava no flush"""
+    key = str(user_id)
+    with _lock:
+        index = _get_loaded_index(key)
+        if index is None:
+            return
+        index.remove(removed_ids)
+        if added:
+            ids = [emb_id for emb_id, _ in added]
+            index.add(ids, _normalize_rows(np.vstack([vec for _, vec in added])))
+        _dirty.add(key)
+
+
+def flush_user_indexes() -> int:
+    """Grava em disco os índices alterados desde o último flush; retorna quantos"""
+    with _flush_lock:
+        with _lock:
+            snapshots = [(key, _indexes[key].snapshot()) for key in _dirty if key in _indexes]
+            _dirty.clear()
+        for key, snapshot in snapshots:
+            _save_quietly(key, snapshot)
+    return len(snapshots)
+
+
+def drop_user_index(user_id: str) -> None:
+    key = str(user_id)
+    with _lock:
+        _indexes.pop(key, None)
+        _dirty.discard(key)
+        try:
+            os.remove(_index_path(key))
+        except OSError:
+            pass
+
+
+def _save_quietly(user_id: str, snapshot: Dict[str, np.ndarray]) -> None:
+    try:
+        _write_snapshot(_index_path(user_id), snapshot)
+    except Exception:
+        pass  # persistência é otimização; o índice em memória continua válido
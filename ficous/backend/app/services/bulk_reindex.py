@@ -0,0 +1,330 @@
+"""
+Reindexação em massa (POST /ficous/admin/index-content).
+
+Percorre notas e fontes do usuário em ordem de id com `yield_per` (sem carregar
+tudo em memória), indexa cada lote num pool limitado de workers e grava um
+checkpoint ao fim de cada lote: uma execução interrompida retoma do último
+owner concluído. O progresso (itens, chunks/s, ETA) fica em ficous_reindex_runs.
+
+A execução é reivindicada no banco (UPDATE condicional) e mantida viva por
+heartbeat em updated_at: outro processo só a retoma depois que o lease vence.
+Cada owner é reivindicado por um IndexingJob running (claim_owner): owners já
+em indexação pela fila ficam com o worker. Owners que falharam ficam em
+failed_owners e são re-tentados quando a execução é retomada.
+"""
+import os
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from .. import database, models
+from .embeddings import index_note_content, index_source_content, reembed_pending
+from .embedding_cache import maintain_embedding_cache
+from .indexing_queue import INDEXING_LEASE_SECONDS, claim_owner, lease_heartbeat, release_owner
+
+logger = logging.getLogger(__name__)
+
+REINDEX_WORKERS = int(os.getenv("REINDEX_WORKERS", "4"))
+# Owners por lote (yield_per e intervalo entre checkpoints)
+REINDEX_BATCH_SIZE = int(os.getenv("REINDEX_BATCH_SIZE", "50"))
+# Lease da execução running (heartbeat a cada terço); vencido, outro processo pode retomá-la
+REINDEX_LEASE_SECONDS = float(os.getenv("REINDEX_LEASE_SECONDS", "300"))
+
+CONTENT_TYPES = {
+    "notes": ("note",),
+    "sources": ("source",),
+    "all": ("note", "source")
+}
+_OWNER_MODELS = {"note": models.Note, "source": models.Source}
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _lease_cutoff() -> datetime:
+    return _now() - timedelta(seconds=REINDEX_LEASE_SECONDS)
+
+
+def _index_owner(owner_type: str, owner_id: Any) -> int:
+    """
+    Indexa um owner com sessão própria (roda nas threads do pool), reivindicado
+    por um IndexingJob running para não disputar o owner com um worker da fila
+    """
+    db = database.SessionLocal()
+    try:
+        owner = db.query(_OWNER_MODELS[owner_type]).filter(_OWNER_MODELS[owner_type].id == owner_id).first()
+        if owner is None:
+            return 0
+        job = claim_owner(owner.user_id, owner_type, owner_id, db)
+        if job is None:
+            return 0  # o worker da fila já está indexando este owner
+        try:
+            with lease_heartbeat(models.IndexingJob, job.id, INDEXING_LEASE_SECONDS):
+                if owner_type == "note":
+                    indexed = index_note_content(owner, db)
+                else:
+                    indexed = index_source_content(owner, db)
+        except Exception as e:
+            db.rollback()
+            release_owner(job, db, e)
+            raise
+        release_owner(job, db)
+        maintain_embedding_cache(db)
+        return indexed
+    finally:
+        db.close()
+
+
+def _iter_owner_batches(
+    db: Session,
+    user_id: Any,
+    owner_type: str,
+    after_id: Optional[Any]
+):
+    """Lotes de ids em ordem crescente, a partir do checkpoint (exclusivo)"""
+    model = _OWNER_MODELS[owner_type]
+    query = db.query(model.id).filter(model.user_id == user_id)
+    if after_id is not None:
+        query = query.filter(model.id > after_id)
+    batch: List[Any] = []
+    for (owner_id,) in query.order_by(model.id).yield_per(REINDEX_BATCH_SIZE):
+        batch.append(owner_id)
+        if len(batch) >= REINDEX_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _count_items(db: Session, user_id: Any, owner_types: Tuple[str, ...]) -> int:
+    return sum(
+        db.query(_OWNER_MODELS[t]).filter(_OWNER_MODELS[t].user_id == user_id).count()
+        for t in owner_types
+    )
+
+
+def _index_batch(
+    executor: Optional[ThreadPoolExecutor],
+    owner_type: str,
+    batch: List[Any]
+) -> Tuple[int, List[Any], Optional[str]]:
+    """Indexa um lote; retorna (chunks, owners que falharam, último erro)"""
+    if executor is None:
+        outcomes = []
+        for owner_id in batch:
+            try:
+                outcomes.append((_index_owner(owner_type, owner_id), None))
+            except Exception as e:
+                outcomes.append((0, e))
+    else:
+        futures = [executor.submit(_index_owner, owner_type, owner_id) for owner_id in batch]
+        outcomes = []
+        for future in futures:
+            try:
+                outcomes.append((future.result(), None))
+            except Exception as e:
+                outcomes.append((0, e))
+
+    chunks = sum(count for count, _ in outcomes)
+    failed = [owner_id for owner_id, (_, error) in zip(batch, outcomes) if error is not None]
+    errors = [error for _, error in outcomes if error is not None]
+    for error in errors:
+        logger.warning(f"Falha ao reindexar {owner_type}: {error}")
+    return chunks, failed, (str(errors[-1])[:1000] if errors else None)
+
+
+def _retry_failed_owners(run: models.ReindexRun, executor: Optional[ThreadPoolExecutor], db: Session) -> None:
+    """Retomada: re-tenta os owners que falharam (ficaram atrás do checkpoint)"""
+    by_type: Dict[str, List[str]] = {}
+    for owner_type, owner_id in run.failed_owners or []:
+        by_type.setdefault(owner_type, []).append(owner_id)
+    still_failed: List[List[str]] = []
+    for owner_type, owner_ids in by_type.items():
+        started = time.perf_counter()
+        chunks, failed, error = _index_batch(executor, owner_type, [uuid.UUID(i) for i in owner_ids])
+        still_failed += [[owner_type, str(owner_id)] for owner_id in failed]
+        run.indexed_chunks += chunks
+        run.elapsed_seconds += time.perf_counter() - started
+        if error:
+            run.last_error = error
+    run.failed_items = max(0, run.failed_items - (len(run.failed_owners or []) - len(still_failed)))
+    run.failed_owners = still_failed or None
+    run.updated_at = _now()
+    db.commit()
+
+
+def _execute_run(run_id: Any) -> None:
+    """Executa (ou retoma) uma reindexação até o fim, gravando checkpoint por lote"""
+    db = database.SessionLocal()
+    reader = database.SessionLocal()  # cursor do yield_per fica fora dos commits de progresso
+    executor = ThreadPoolExecutor(max_workers=REINDEX_WORKERS) if REINDEX_WORKERS > 1 else None
+    try:
+        run = db.query(models.ReindexRun).filter(models.ReindexRun.id == run_id).first()
+        owner_types = CONTENT_TYPES[run.content_type]
+        run.total_items = _count_items(db, run.user_id, owner_types)
+        db.commit()
+
+        with lease_heartbeat(models.ReindexRun, run_id, REINDEX_LEASE_SECONDS):
+            if run.failed_owners:
+                _retry_failed_owners(run, executor, db)
+            # Fases já concluídas (checkpoint em "source" implica notas prontas)
+            start_phase = owner_types.index(run.checkpoint_owner_type) if run.checkpoint_owner_type in owner_types else 0
+            for owner_type in owner_types[start_phase:]:
+                after_id = run.checkpoint_owner_id if run.checkpoint_owner_type == owner_type else None
+                for batch in _iter_owner_batches(reader, run.user_id, owner_type, after_id):
+                    started = time.perf_counter()
+                    chunks, failed, error = _index_batch(executor, owner_type, batch)
+                    run.processed_items += len(batch)
+                    run.failed_items += len(failed)
+                    if failed:
+                        run.failed_owners = (run.failed_owners or []) + [
+                            [owner_type, str(owner_id)] for owner_id in failed
+                        ]
+                    run.indexed_chunks += chunks
+                    run.elapsed_seconds += time.perf_counter() - started
+                    run.checkpoint_owner_type = owner_type
+                    run.checkpoint_owner_id = batch[-1]
+                    if error:
+                        run.last_error = error
+                    run.updated_at = _now()
+                    db.commit()
+
+            # Chunks que ficaram sem vetor (provedor indisponível) em indexações anteriores
+            reembed_pending(db, user_id=run.user_id)
+        if run.failed_owners:
+            run.status = "failed"  # a próxima chamada retoma só os owners que falharam
+        else:
+            run.status = "done"
+            run.finished_at = _now()
+        run.updated_at = _now()
+        db.commit()
+    except Exception as e:
+        logger.error(f"Reindexação {run_id} interrompida: {e}")
+        db.rollback()
+        run = db.query(models.ReindexRun).filter(models.ReindexRun.id == run_id).first()
+        if run is not None:
+            run.status = "failed"
+            run.last_error = str(e)[:1000]
+            run.updated_at = _now()
+            db.commit()
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+        reader.close()
+        db.close()
+
+
+def _is_active(run: models.ReindexRun) -> bool:
+    """Running com heartbeat dentro do lease (em qualquer processo)"""
+    if run.status != "running" or run.updated_at is None:
+        return False
+    updated_at = run.updated_at
+    if updated_at.tzinfo is None:
+        updated_at = updated_at.replace(tzinfo=timezone.utc)  # SQLite
+    return updated_at >= _lease_cutoff()
+
+
+def _claim_run(run_id: Any, db: Session) -> bool:
+    """UPDATE condicional: só um processo retoma uma execução falha ou com lease vencido"""
+    claimed = db.query(models.ReindexRun).filter(
+        models.ReindexRun.id == run_id,
+        or_(
+            models.ReindexRun.status == "failed",
+            and_(models.ReindexRun.status == "running", models.ReindexRun.updated_at < _lease_cutoff())
+        )
+    ).update({"status": "running", "last_error": None, "updated_at": _now()}, synchronize_session=False)
+    db.commit()
+    return bool(claimed)
+
+
+def start_reindex(
+    user_id: Any,
+    content_type: str,
+    db: Session,
+    wait: bool = False,
+    restart: bool = False
+) -> models.ReindexRun:
+    """
+    Inicia a reindexação em massa ou retoma a última execução inacabada do
+    mesmo tipo (a partir do checkpoint). `wait=True` roda na própria chamada.
+    """
+    if content_type not in CONTENT_TYPES:
+        raise ValueError(f"content_type inválido: {content_type}")
+
+    run = db.query(models.ReindexRun).filter(
+        models.ReindexRun.user_id == user_id,
+        models.ReindexRun.content_type == content_type,
+        models.ReindexRun.status.in_(("running", "failed"))
+    ).order_by(models.ReindexRun.started_at.desc()).first()
+    if run is not None and _is_active(run):
+        return run  # já em andamento: o cliente só acompanha
+    if run is not None and restart:
+        run.status = "cancelled"  # substituída: não é mais retomada
+        run = None
+    if run is None:
+        run = models.ReindexRun(user_id=user_id, content_type=content_type, status="running", updated_at=_now())
+        db.add(run)
+        db.commit()
+    elif not _claim_run(run.id, db):
+        db.refresh(run)
+        return run  # outro processo retomou primeiro
+    db.refresh(run)
+
+    if wait:
+        _execute_run(run.id)
+        db.refresh(run)
+        return run
+
+    thread = threading.Thread(target=_execute_run, args=(run.id,), name=f"ficous-reindex-{run.id}", daemon=True)
+    thread.start()
+    return run
+
+
+def get_reindex_status(db: Session, user_id: Any, run_id: Optional[Any] = None) -> Optional[Dict[str, Any]]:
+    """Progresso de uma execução (default: a mais recente do usuário) com throughput e ETA"""
+    query = db.query(models.ReindexRun).filter(models.ReindexRun.user_id == user_id)
+    if run_id is not None:
+        query = query.filter(models.ReindexRun.id == run_id)
+    run = query.order_by(models.ReindexRun.started_at.desc()).first()
+    if run is None:
+        return None
+    return _run_to_dict(run)
+
+
+def _run_to_dict(run: models.ReindexRun) -> Dict[str, Any]:
+    elapsed = run.elapsed_seconds or 0.0
+    items_per_second = run.processed_items / elapsed if elapsed > 0 else 0.0
+    remaining = max(0, run.total_items - run.processed_items)
+    eta = None
+    if run.status == "running" and items_per_second > 0:
+        eta = remaining / items_per_second
+    return {
+        "run_id": str(run.id),
+        "content_type": run.content_type,
+        "status": run.status,
+        "active": _is_active(run),
+        "total_items": run.total_items,
+        "processed_items": run.processed_items,
+        "failed_items": run.failed_items,
+        "indexed_chunks": run.indexed_chunks,
+        "progress": run.processed_items / run.total_items if run.total_items else 1.0,
+        "elapsed_seconds": elapsed,
+        "chunks_per_second": run.indexed_chunks / elapsed if elapsed > 0 else 0.0,
+        "items_per_second": items_per_second,
+        "eta_seconds": eta,
+        "checkpoint": {
+            "owner_type": run.checkpoint_owner_type,
+            "owner_id": str(run.checkpoint_owner_id) if run.checkpoint_owner_id else None
+        },
+        "last_error": run.last_error,
+        "started_at": run.started_at.isoformat() if run.started_at else None,
+        "finished_at": run.finished_at.isoformat() if run.finished_at else None
+    }
@@ -8,6 +8,9 @@ import time
 from typing import Optional, Any, Dict
 import redis
 from ..config import CORS_ORIGINS
+from .vector_cache import get_vector_cache_stats, clear_vector_cache
+from .lexical_index import get_lexical_index_stats, clear_lexical_index
+from .query_embedding_cache import get_query_embedding_cache_stats, clear_query_embedding_cache
 
 # Configuração Redis (opcional)
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
@@ -99,7 +102,10 @@ def get_cache_stats() -> Dict[str, Any]:
     stats = {
         "backend": "redis" if redis_client else "memory",
         "memory_entries": len(_memory_cache),
-        "ttl_seconds": CACHE_TTL
+        "ttl_seconds": CACHE_TTL,
+        "vector_cache": get_vector_cache_stats(),
+        "lexical_index": get_lexical_index_stats(),
+        "query_embedding_cache": get_query_embedding_cache_stats()
     }
     
     if redis_client:
@@ -125,3 +131,6 @@ def clear_cache() -> None:
             pass
     
     _memory_cache.clear()
+    clear_vector_cache()
+    clear_lexical_index()
+    clear_query_embedding_cache()
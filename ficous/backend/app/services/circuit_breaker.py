@@ -15,6 +15,8 @@ from tenacity import (
 )
 import logging
 
+from .openai_client import chat_completion, post_openai
+
 logger = logging.getLogger(__name__)
 
 # Configurações do circuit breaker
@@ -54,30 +56,9 @@ def call_openai_with_retry(
     # Adicionar jitter ao delay
     time.sleep(_add_jitter(0.1))
     
-    payload = {
-        "model": model,
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ],
-        "temperature": temperature
-    }
-    headers = {
-        "Authorization": f"Bearer {api_key}", 
-        "Content-Type": "application/json"
-    }
-    
-    timeout = httpx.Timeout(30.0, connect=10.0)
-    
-    with httpx.Client(timeout=timeout) as client:
-        resp = client.post(
-            "https://api.openai.com/v1/chat/completions", 
-            json=payload, 
-            headers=headers
-        )
-        resp.raise_for_status()
-        data = resp.json()
-        return data["choices"][0]["message"]["content"]
+    return chat_completion(
+        system_prompt, user_prompt, model=model, temperature=temperature, api_key=api_key
+    )
 
 
 def call_openai_embeddings_with_retry(text: str, model: str = "text-embedding-3-small") -> list[float]:
@@ -94,22 +75,8 @@ def call_openai_embeddings_with_retry(text: str, model: str = "text-embedding-3-
         "model": model,
         "input": text[:8000]  # Limite OpenAI
     }
-    headers = {
-        "Authorization": f"Bearer {api_key}", 
-        "Content-Type": "application/json"
-    }
-    
-    timeout = httpx.Timeout(30.0, connect=10.0)
-    
-    with httpx.Client(timeout=timeout) as client:
-        resp = client.post(
-            "https://api.openai.com/v1/embeddings", 
-            json=payload, 
-            headers=headers
-        )
-        resp.raise_for_status()
-        data = resp.json()
-        return data["data"][0]["embedding"]
+    data = post_openai("/embeddings", payload, api_key=api_key)
+    return data["data"][0]["embedding"]
 
 
 class CircuitBreakerState:
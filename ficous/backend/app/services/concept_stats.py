@@ -0,0 +1,105 @@
+"""
+Atualização em lote da força dos conceitos do usuário (ficous_user_concept_stats).
+
+Todos os deltas de uma interação viram um único INSERT ... ON CONFLICT
+(user_id, concept) DO UPDATE por valor de delta (normalmente só um), em vez de
+SELECT + INSERT + commit por conceito. A constraint única torna a operação
+segura com requisições concorrentes.
+"""
+import uuid
+from typing import Any, Dict, Iterable, Tuple, Union
+
+from sqlalchemy import case, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from .. import models
+
+# Força de um conceito ainda não visto
+DEFAULT_CONCEPT_STRENGTH = 0.5
+
+_UPSERT_DIALECTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def _clamp(value):
+    """min(1, max(0, value)) portátil (SQLite não tem GREATEST/LEAST)"""
+    return case((value < 0.0, 0.0), (value > 1.0, 1.0), else_=value)
+
+
+def _merge_deltas(deltas: Union[Dict[str, float], Iterable[Tuple[str, float]]]) -> Dict[str, float]:
+    items = deltas.items() if isinstance(deltas, dict) else deltas
+    merged: Dict[str, float] = {}
+    for concept, delta in items:
+        concept = (concept or "").strip()
+        if concept:
+            merged[concept] = merged.get(concept, 0.0) + float(delta)
+    return merged
+
+
+def _upsert(user_id: Any, concepts: Iterable[str], delta: float, db: Session, insert) -> None:
+    table = models.UserConceptStat.__table__
+    stmt = insert(table).values([
+        {
+            "id": uuid.uuid4(),
+            "user_id": user_id,
+            "concept": concept,
+            "strength": min(1.0, max(0.0, DEFAULT_CONCEPT_STRENGTH + delta))
+        }
+        for concept in concepts
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.concept],
+        set_={
+            "strength": _clamp(func.coalesce(table.c.strength, DEFAULT_CONCEPT_STRENGTH) + delta),
+            "last_seen_at": func.now()
+        }
+    )
+    db.execute(stmt)
+
+
+def _update_one_by_one(user_id: Any, concept: str, delta: float, db: Session) -> None:
+    """Outros bancos: SELECT + INSERT/UPDATE (ainda numa única transação)"""
+    stat = db.query(models.UserConceptStat).filter(
+        models.UserConceptStat.user_id == user_id,
+        models.UserConceptStat.concept == concept
+    ).first()
+    if stat:
+        stat.strength = max(0.0, min(1.0, (stat.strength or DEFAULT_CONCEPT_STRENGTH) + delta))
+    else:
+        db.add(models.UserConceptStat(
+            user_id=user_id,
+            concept=concept,
+            strength=max(0.0, min(1.0, DEFAULT_CONCEPT_STRENGTH + delta))
+        ))
+
+
+def update_concept_strengths(
+    user_id: Any,
+    deltas: Union[Dict[str, float], Iterable[Tuple[str, float]]],
+    db: Session,
+    commit: bool = True
+) -> int:
+    """
+    Aplica `deltas` (conceito -> variação de força) de uma vez; conceitos
+    repetidos somam. Retorna quantos conceitos foram atualizados/criados.
+    """
+    merged = _merge_deltas(deltas)
+    if not merged:
+        return 0
+    if isinstance(user_id, str):
+        user_id = uuid.UUID(user_id)
+
+    insert = _UPSERT_DIALECTS.get(db.get_bind().dialect.name)
+    if insert is None:
+        for concept, delta in merged.items():
+            _update_one_by_one(user_id, concept, delta, db)
+    else:
+        # Um statement por valor de delta (o delta entra no SET do ON CONFLICT)
+        by_delta: Dict[float, list] = {}
+        for concept, delta in merged.items():
+            by_delta.setdefault(delta, []).append(concept)
+        for delta, concepts in by_delta.items():
+            _upsert(user_id, concepts, delta, db, insert)
+    if commit:
+        db.commit()
+    return len(merged)
@@ -0,0 +1,76 @@
+"""
+Diversificação dos resultados do RAG por Maximal Marginal Relevance (MMR).
+
+Chunks vizinhos da mesma nota se sobrepõem (overlap do chunking) e tendem a
+ocupar todo o top-k com o mesmo trecho. O MMR escolhe, a partir de uma lista
+curta, o candidato que melhor equilibra relevância e novidade frente aos já
+escolhidos, com limite opcional de chunks por owner (nota/fonte).
+"""
+import os
+from typing import Optional
+import numpy as np
+
+# 1.0 = só relevância (sem MMR); 0.0 = só novidade
+RAG_MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))
+# Máximo de chunks da mesma nota/fonte no top-k (0 = sem limite)
+RAG_MMR_MAX_PER_OWNER = int(os.getenv("RAG_MMR_MAX_PER_OWNER", "0"))
+# Tamanho da lista curta diversificada por resultado final
+RAG_MMR_CANDIDATE_FACTOR = int(os.getenv("RAG_MMR_CANDIDATE_FACTOR", "4"))
+
+
+def mmr_enabled() -> bool:
+    return RAG_MMR_LAMBDA < 1.0 or RAG_MMR_MAX_PER_OWNER > 0
+
+
+def mmr_pool_size(top_k: int) -> int:
+    """Candidatos a pontuar antes do MMR (top_k quando desligado)"""
+    return top_k * max(1, RAG_MMR_CANDIDATE_FACTOR) if mmr_enabled() else top_k
+
+
+def mmr_select(
+    relevance: np.ndarray,
+    vectors: np.ndarray,
+    k: int,
+    owners: Optional[np.ndarray] = None,
+    lambda_: Optional[float] = None,
+    max_per_owner: Optional[int] = None
+) -> np.ndarray:
+    """
+    Seleção gulosa MMR sobre a lista curta: argmax de
+    λ·relevância − (1−λ)·max(similaridade com os já escolhidos).
+
+    relevance: (n,) scores finais dos candidatos (escalados pelo maior)
+    vectors: (n, dim) vetores normalizados; linhas nulas não penalizam
+    Retorna os índices escolhidos, em ordem de seleção.
+    """
+    lambda_ = RAG_MMR_LAMBDA if lambda_ is None else lambda_
+    max_per_owner = RAG_MMR_MAX_PER_OWNER if max_per_owner is None else max_per_owner
+    relevance = np.asarray(relevance, dtype=np.float64)
+    n = relevance.size
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    top = float(np.max(np.abs(relevance)))
+    relevance = relevance / top if top > 0 else relevance
+    # Matriz de similaridade par a par da lista curta (um único produto matriz-matriz)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    pairwise = vectors @ vectors.T if lambda_ < 1.0 else np.zeros((n, n), dtype=np.float32)
+
+    available = np.ones(n, dtype=bool)
+    max_similarity = np.zeros(n)
+    picked_per_owner = {}
+    selected = []
+    while len(selected) < k and available.any():
+        mmr = lambda_ * relevance - (1.0 - lambda_) * max_similarity
+        mmr[~available] = -np.inf
+        best = int(np.argmax(mmr))
+        available[best] = False
+        if owners is not None and max_per_owner > 0:
+            owner = owners[best]
+            picked_per_owner[owner] = picked_per_owner.get(owner, 0) + 1
+            if picked_per_owner[owner] >= max_per_owner:
+                available &= owners != owner
+        selected.append(best)
+        max_similarity = np.maximum(max_similarity, pairwise[best])
+    return np.asarray(selected, dtype=np.intp)
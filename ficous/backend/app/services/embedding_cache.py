@@ -0,0 +1,201 @@
+"""
+Cache persistente de embeddings endereçado por conteúdo (modelo + sha256 do chunk)
+
+A leitura não escreve nada: os acertos (hits/last_used_at) ficam acumulados
+em memória e a gravação de vetores novos roda na transação do chamador (num
+savepoint no PostgreSQL), sem commit/rollback da sessão dele. Acertos e
+evicção (que conta a tabela) são aplicados por maintain_embedding_cache numa
+transação curta própria, depois que o chamador fez commit (worker da fila,
+reindexação em massa e coleta periódica).
+"""
+import os
+import uuid
+import hashlib
+import logging
+import threading
+from collections import Counter
+from typing import List, Dict, Tuple
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.sql import func
+
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+# Limite de entradas; acima disso as menos usadas recentemente são removidas
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+# Evicção amostrada: roda a cada N gravações (0 = só na coleta periódica)
+EMBEDDING_CACHE_EVICT_EVERY = int(os.getenv("EMBEDDING_CACHE_EVICT_EVERY", "100"))
+# Acertos acumulados entre duas manutenções; acima disso os novos são descartados (amostra)
+EMBEDDING_CACHE_MAX_PENDING_TOUCHES = 50000
+
+_INSERT_DIALECTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+_lock = threading.Lock()
+_stores_since_evict = 0
+_pending_touches: "Counter[Tuple[str, str]]" = Counter()  # (modelo, hash) -> acertos
+
+
+def content_hash(text: str) -> str:
+    """Hash estável do conteúdo do chunk"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def get_cached_vectors(hashes: List[str], model: str, db: Session) -> Dict[str, bytes]:
+    """Busca vetores empacotados já calculados para os hashes informados"""
+    if not EMBEDDING_CACHE_ENABLED or not hashes:
+        return {}
+    unique = list(set(hashes))
+    rows = db.query(
+        models.EmbeddingCacheEntry.content_hash,
+        models.EmbeddingCacheEntry.vector_f32
+    ).filter(
+        models.EmbeddingCacheEntry.model == model,
+        models.EmbeddingCacheEntry.content_hash.in_(unique)
+    ).all()
+    found = {h: v for h, v in rows}
+
+    if found:
+        # Sem UPDATE aqui: travaria o banco (SQLite) ou as linhas quentes (PostgreSQL)
+        # durante toda a chamada ao provedor que vem depois
+        with _lock:
+            for h in found:
+                key = (model, h)
+                if key in _pending_touches or len(_pending_touches) < EMBEDDING_CACHE_MAX_PENDING_TOUCHES:
+                    _pending_touches[key] += 1
+    return found
+
+
+def store_cached_vectors(vectors: Dict[str, bytes], model: str, db: Session) -> int:
+    """
+    Persiste vetores recém-calculados na transação do chamador (sem commit).
+    Hashes já gravados por outro processo são ignorados um a um
+    (ON CONFLICT DO NOTHING); o restante do lote é gravado.
+    """
+    if not EMBEDDING_CACHE_ENABLED or not vectors:
+        return 0
+    rows = [
+        {"id": uuid.uuid4(), "model": model, "content_hash": h, "vector_f32": packed, "hits": 0}
+        for h, packed in vectors.items()
+    ]
+    dialect = db.get_bind().dialect.name
+    insert = _INSERT_DIALECTS.get(dialect)
+    try:
+        if insert is None:
+            _store_one_by_one(rows, db)
+        else:
+            table = models.EmbeddingCacheEntry.__table__
+            stmt = insert(table).values(rows).on_conflict_do_nothing(
+                index_elements=[table.c.model, table.c.content_hash]
+            )
+            if dialect == "postgresql":
+                # Erro aborta a transação inteira no PostgreSQL: isola no savepoint
+                with db.begin_nested():
+                    db.execute(stmt)
+            else:
+                # SQLite desfaz só o statement que falhou (e o pysqlite faria
+                # commit ao liberar um savepoint aberto fora de transação)
+                db.execute(stmt)
+    except SQLAlchemyError as e:
+        # Só o savepoint é desfeito; o cache é opcional para quem indexa
+        logger.warning(f"Falha ao gravar cache de embeddings: {e}")
+        return 0
+    _count_store()
+    return len(rows)
+
+
+def _store_one_by_one(rows: List[Dict], db: Session) -> None:
+    """Outros bancos: um savepoint por hash (conflito descarta só aquele hash)"""
+    for row in rows:
+        try:
+            with db.begin_nested():
+                db.add(models.EmbeddingCacheEntry(**row))
+        except IntegrityError:
+            pass
+
+
+def _count_store() -> None:
+    global _stores_since_evict
+    with _lock:
+        _stores_since_evict += 1
+
+
+def _flush_touches(db: Session) -> int:
+    """Aplica os acertos acumulados (um UPDATE por modelo e quantidade de acertos)"""
+    with _lock:
+        touches = dict(_pending_touches)
+        _pending_touches.clear()
+    groups: Dict[Tuple[str, int], List[str]] = {}
+    for (model, h), hits in touches.items():
+        groups.setdefault((model, hits), []).append(h)
+    for (model, hits), hashes in groups.items():
+        db.query(models.EmbeddingCacheEntry).filter(
+            models.EmbeddingCacheEntry.model == model,
+            models.EmbeddingCacheEntry.content_hash.in_(hashes)
+        ).update({
+            models.EmbeddingCacheEntry.hits: models.EmbeddingCacheEntry.hits + hits,
+            models.EmbeddingCacheEntry.last_used_at: func.now()
+        }, synchronize_session=False)
+    db.commit()
+    return len(touches)
+
+
+def maintain_embedding_cache(db: Session, force_evict: bool = False) -> int:
+    """
+    Grava os acertos pendentes e, a cada EMBEDDING_CACHE_EVICT_EVERY gravações
+    (ou `force_evict`), roda a evicção. Chamar com a sessão sem transação
+    pendente (depois do commit da indexação): faz commit próprio. Retorna as
+    entradas removidas.
+    """
+    global _stores_since_evict
+    if not EMBEDDING_CACHE_ENABLED:
+        return 0
+    with _lock:
+        evict = force_evict or (
+            EMBEDDING_CACHE_EVICT_EVERY > 0 and _stores_since_evict >= EMBEDDING_CACHE_EVICT_EVERY
+        )
+        if evict:
+            _stores_since_evict = 0
+    try:
+        _flush_touches(db)
+        return evict_embedding_cache(db) if evict else 0
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Manutenção do cache de embeddings falhou: {e}")
+        return 0
+
+
+def evict_embedding_cache(db: Session, max_entries: int = None) -> int:
+    """Remove as entradas menos usadas recentemente acima do limite"""
+    limit = EMBEDDING_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+    total = db.query(func.count(models.EmbeddingCacheEntry.id)).scalar() or 0
+    excess = total - limit
+    if excess <= 0:
+        return 0
+    stale_ids = [
+        entry_id for (entry_id,) in db.query(models.EmbeddingCacheEntry.id)
+        .order_by(models.EmbeddingCacheEntry.last_used_at.asc())
+        .limit(excess)
+        .all()
+    ]
+    db.query(models.EmbeddingCacheEntry).filter(
+        models.EmbeddingCacheEntry.id.in_(stale_ids)
+    ).delete(synchronize_session=False)
+    db.commit()
+    return len(stale_ids)
+
+
+def get_embedding_cache_stats(db: Session) -> Dict[str, int]:
+    """Estatísticas do cache persistente"""
+    total, hits = db.query(
+        func.count(models.EmbeddingCacheEntry.id),
+        func.coalesce(func.sum(models.EmbeddingCacheEntry.hits), 0)
+    ).one()
+    return {
+        "entries": int(total or 0),
+        "max_entries": EMBEDDING_CACHE_MAX_ENTRIES,
+        "total_hits": int(hits or 0)
+    }
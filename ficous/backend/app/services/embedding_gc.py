@@ -0,0 +1,318 @@
+"""
+Coleta de embeddings órfãos (GC) e compactação dos índices do RAG.
+
+ficous_embeddings.owner_id não tem FK para notas/fontes: excluir uma nota
+deixava seus chunks na tabela, varridos (e até devolvidos) por toda consulta.
+A exclusão agora limpa os chunks do owner na hora (delete_owner_embeddings);
+a varredura em lotes (collect_orphan_embeddings) remove o que sobrou de antes
+ou de caminhos que não passam pelos routers, e pode rodar periodicamente.
+
+Vetores obsoletos (embedding_model diferente do provedor ativo, que a busca
+nunca lê) também são coletados: os bytes do vetor são liberados e o chunk
+fica pendente para reembed_pending gerar o vetor com o modelo ativo.
+Referências de quase-duplicata cuja canônica sumiu (sem FK no SQLite) também
+voltam a ficar pendentes.
+"""
+import os
+import time
+import logging
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import and_, exists, func, not_, or_, text
+from sqlalchemy.orm import Session, aliased
+
+from .. import database, models
+from .vector_cache import bump_corpus_version
+from .lexical_index import update_lexical_index
+from .ann_index import update_user_index, flush_user_indexes
+from .embedding_cache import maintain_embedding_cache
+from .embeddings import release_references, released_entries, index_released_rows, LEGACY_EMBEDDING_MODEL
+from .embedding_providers import get_embedding_provider
+from .pgvector_backend import pgvector_enabled
+
+logger = logging.getLogger(__name__)
+
+# Linhas examinadas/removidas por transação
+EMBEDDING_GC_BATCH_SIZE = int(os.getenv("EMBEDDING_GC_BATCH_SIZE", "1000"))
+# Intervalo da coleta periódica em segundos (0 = só via endpoint admin)
+EMBEDDING_GC_INTERVAL = int(os.getenv("EMBEDDING_GC_INTERVAL_SECONDS", "0"))
+# PostgreSQL: VACUUM ANALYZE depois de remover linhas (devolve espaço do heap e do HNSW)
+EMBEDDING_GC_VACUUM = os.getenv("EMBEDDING_GC_VACUUM", "true").lower() == "true"
+# Libera vetores de outro modelo (ficam pendentes de re-embedding com o modelo ativo)
+EMBEDDING_GC_STALE_MODELS = os.getenv("EMBEDDING_GC_STALE_MODELS", "true").lower() == "true"
+
+_OWNER_MODELS = {"note": models.Note, "source": models.Source}
+
+_lock = threading.Lock()
+_scheduler: Optional[threading.Thread] = None
+_stop = threading.Event()
+_last_report: Optional[Dict[str, Any]] = None
+
+
+def _orphan_filter():
+    """Linhas de nota/fonte cujo owner não existe mais (outros tipos de owner não são tocados)"""
+    return or_(*[
+        and_(
+            models.Embedding.owner_type == owner_type,
+            not_(exists().where(model.id == models.Embedding.owner_id))
+        )
+        for owner_type, model in _OWNER_MODELS.items()
+    ])
+
+
+def _stale_filter(model: str):
+    """Linhas com vetor gerado por outro modelo (NULL = OpenAI legado)"""
+    column = models.Embedding.embedding_model
+    if model == LEGACY_EMBEDDING_MODEL:
+        other_model = and_(column.isnot(None), column != model)
+    else:
+        other_model = or_(column.is_(None), column != model)
+    has_vector = or_(models.Embedding.vector_f32.isnot(None), models.Embedding.vector.isnot(None))
+    return and_(other_model, has_vector)
+
+
+def _vector_bytes():
+    """Bytes dos vetores de uma linha (binário + JSON legado)"""
+    return (
+        func.coalesce(func.length(models.Embedding.vector_f32), 0)
+        + func.coalesce(func.length(models.Embedding.vector), 0)
+    )
+
+
+def _row_bytes():
+    """Bytes aproximados de uma linha (vetores + texto)"""
+    return _vector_bytes() + func.coalesce(func.length(models.Embedding.chunk_text), 0)
+
+
+def _drop_from_indexes(removed: Dict[str, List[Any]]) -> None:
+    """Nova versão do corpus e remoção incremental no ANN/BM25 por usuário afetado"""
+    for user_id, ids in removed.items():
+        bump_corpus_version(user_id)
+        update_user_index(user_id, added=[], removed_ids=ids)
+        update_lexical_index(user_id, added=[], removed_ids=ids)
+
+
+def delete_owner_embeddings(user_id: Any, owner_type: str, owner_ids: List[Any], db: Session) -> int:
+    """
+    Remove os chunks de notas/fontes excluídas (chamar na mesma requisição da
+    exclusão). Faz commit e atualiza os índices em memória; retorna as linhas removidas.
+    """
+    if not owner_ids:
+        return 0
+    owner_filter = (
+        models.Embedding.user_id == user_id,
+        models.Embedding.owner_type == owner_type,
+        models.Embedding.owner_id.in_(owner_ids)
+    )
+    ids = [emb_id for (emb_id,) in db.query(models.Embedding.id).filter(*owner_filter).all()]
+    # Quase-duplicatas de outras notas/fontes que apontavam para esses chunks ganham o vetor
+    released = released_entries(release_references(ids, db))
+    if ids:
+        db.query(models.Embedding).filter(*owner_filter).delete(synchronize_session=False)
+    # Jobs ainda não executados do owner não têm mais o que indexar
+    db.query(models.IndexingJob).filter(
+        models.IndexingJob.owner_type == owner_type,
+        models.IndexingJob.owner_id.in_(owner_ids),
+        models.IndexingJob.status == "pending"
+    ).delete(synchronize_session=False)
+    db.commit()
+    _drop_from_indexes({str(user_id): ids})
+    index_released_rows(released)
+    return len(ids)
+
+
+def collect_orphan_embeddings(
+    db: Session,
+    user_id: Optional[Any] = None,
+    dry_run: bool = False,
+    batch_size: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Varre ficous_embeddings em lotes (ordem de id) e remove as linhas sem owner.
+    Cada lote é uma transação curta; `dry_run` só conta. Retorna o relatório
+    (linhas/bytes recuperados, por tipo de owner e por usuário).
+    """
+    global _last_report
+    batch_size = batch_size or EMBEDDING_GC_BATCH_SIZE
+    started = time.time()
+    report: Dict[str, Any] = {
+        "dry_run": dry_run,
+        "deleted_rows": 0,
+        "reclaimed_bytes": 0,
+        "stale_rows": 0,
+        "batches": 0,
+        "by_owner_type": defaultdict(int),
+        "by_user": defaultdict(int)
+    }
+
+    last_id = None
+    while True:
+        query = db.query(
+            models.Embedding.id,
+            models.Embedding.user_id,
+            models.Embedding.owner_type,
+            _row_bytes()
+        ).filter(_orphan_filter())
+        if user_id is not None:
+            query = query.filter(models.Embedding.user_id == user_id)
+        if last_id is not None:
+            query = query.filter(models.Embedding.id > last_id)
+        rows = query.order_by(models.Embedding.id).limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        report["batches"] += 1
+
+        removed: Dict[str, List[Any]] = defaultdict(list)
+        for emb_id, owner_user, owner_type, nbytes in rows:
+            removed[str(owner_user)].append(emb_id)
+            report["by_owner_type"][owner_type] += 1
+            report["by_user"][str(owner_user)] += 1
+            report["reclaimed_bytes"] += int(nbytes or 0)
+        report["deleted_rows"] += len(rows)
+        if not dry_run:
+            batch_ids = [row[0] for row in rows]
+            released = released_entries(release_references(batch_ids, db))
+            db.query(models.Embedding).filter(
+                models.Embedding.id.in_(batch_ids)
+            ).delete(synchronize_session=False)
+            db.commit()
+            _drop_from_indexes(removed)
+            index_released_rows(released)
+        if len(rows) < batch_size:
+            break
+
+    if EMBEDDING_GC_STALE_MODELS:
+        _collect_stale_vectors(db, user_id, dry_run, batch_size, report)
+    report["dangling_references"] = _release_dangling_references(db, user_id, dry_run)
+
+    if (report["deleted_rows"] or report["stale_rows"]) and not dry_run:
+        _compact(db)
+    report["by_owner_type"] = dict(report["by_owner_type"])
+    report["by_user"] = dict(report["by_user"])
+    report["elapsed_seconds"] = round(time.time() - started, 3)
+    if not dry_run:
+        _last_report = {**report, "finished_at": time.time()}
+    return report
+
+
+def _collect_stale_vectors(
+    db: Session,
+    user_id: Optional[Any],
+    dry_run: bool,
+    batch_size: int,
+    report: Dict[str, Any]
+) -> None:
+    """Libera vetores de outro modelo em lotes; os chunks ficam pendentes (reembed_pending)"""
+    stale = _stale_filter(get_embedding_provider().model)
+    has_pgvector = not dry_run and pgvector_enabled(db)
+    last_id = None
+    while True:
+        query = db.query(models.Embedding.id, models.Embedding.user_id, _vector_bytes()).filter(stale)
+        if user_id is not None:
+            query = query.filter(models.Embedding.user_id == user_id)
+        if last_id is not None:
+            query = query.filter(models.Embedding.id > last_id)
+        rows = query.order_by(models.Embedding.id).limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        report["batches"] += 1
+        report["stale_rows"] += len(rows)
+        report["reclaimed_bytes"] += sum(int(nbytes or 0) for _, _, nbytes in rows)
+        if not dry_run:
+            batch_ids = [row[0] for row in rows]
+            db.query(models.Embedding).filter(models.Embedding.id.in_(batch_ids)).update(
+                {models.Embedding.vector_f32: None, models.Embedding.vector: None},
+                synchronize_session=False
+            )
+            if has_pgvector:
+                db.execute(
+                    text("UPDATE ficous_embeddings SET embedding_pgv = NULL WHERE id = ANY(:ids)"),
+                    {"ids": batch_ids}
+                )
+            db.commit()
+            removed: Dict[str, List[Any]] = defaultdict(list)
+            for emb_id, owner_user, _ in rows:
+                removed[str(owner_user)].append(emb_id)
+            for owner_user, ids in removed.items():
+                # Fora da matriz e do ANN; o BM25 continua (o texto não mudou)
+                bump_corpus_version(owner_user)
+                update_user_index(owner_user, added=[], removed_ids=ids)
+        if len(rows) < batch_size:
+            break
+
+
+def _release_dangling_references(db: Session, user_id: Optional[Any], dry_run: bool) -> int:
+    """Referências cuja canônica não existe mais viram pendentes (canonical_id NULL)"""
+    canonical = aliased(models.Embedding)
+    query = db.query(models.Embedding).filter(
+        models.Embedding.canonical_id.isnot(None),
+        ~exists().where(canonical.id == models.Embedding.canonical_id)
+    )
+    if user_id is not None:
+        query = query.filter(models.Embedding.user_id == user_id)
+    if dry_run:
+        return query.count()
+    released = query.update({models.Embedding.canonical_id: None}, synchronize_session=False)
+    db.commit()
+    return released
+
+
+def _compact(db: Session) -> None:
+    """PostgreSQL: VACUUM ANALYZE fora de transação (heap + índice HNSW)"""
+    bind = db.get_bind()
+    if not EMBEDDING_GC_VACUUM or bind.dialect.name != "postgresql":
+        return
+    try:
+        with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("VACUUM ANALYZE ficous_embeddings"))
+    except Exception as e:
+        logger.warning(f"VACUUM de ficous_embeddings falhou: {e}")
+
+
+def get_embedding_gc_status() -> Dict[str, Any]:
+    """Configuração e última coleta concluída"""
+    return {
+        "interval_seconds": EMBEDDING_GC_INTERVAL,
+        "batch_size": EMBEDDING_GC_BATCH_SIZE,
+        "scheduled": _scheduler is not None and _scheduler.is_alive(),
+        "last_run": _last_report
+    }
+
+
+def _run_scheduled() -> None:
+    while not _stop.wait(EMBEDDING_GC_INTERVAL):
+        db = database.SessionLocal()
+        try:
+            report = collect_orphan_embeddings(db)
+            if report["deleted_rows"]:
+                logger.info(f"GC de embeddings: {report['deleted_rows']} linhas órfãs removidas")
+            evicted = maintain_embedding_cache(db, force_evict=True)
+            if evicted:
+                logger.info(f"GC de embeddings: {evicted} entradas do cache removidas")
+            flush_user_indexes()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Erro no GC de embeddings: {e}")
+        finally:
+            db.close()
+
+
+def start_embedding_gc_scheduler() -> bool:
+    """Inicia a coleta periódica (uma thread por processo); False se desligada"""
+    global _scheduler
+    if EMBEDDING_GC_INTERVAL <= 0:
+        return False
+    with _lock:
+        if _scheduler is None or not _scheduler.is_alive():
+            _stop.clear()
+            _scheduler = threading.Thread(target=_run_scheduled, name="ficous-embedding-gc", daemon=True)
+            _scheduler.start()
+    return True
+
+
+def stop_embedding_gc_scheduler() -> None:
+    _stop.set()
@@ -0,0 +1,182 @@
+"""
+Provedores de embeddings plugáveis (OpenAI ou local determinístico)
+"""
+import os
+import re
+import math
+import asyncio
+import hashlib
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import Counter
+from typing import List, Optional
+import numpy as np
+
+from .openai_client import post_openai, apost_openai
+
+# openai | local | auto (openai se houver OPENAI_API_KEY, senão local)
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "auto").lower()
+EMBEDDING_DIM = 1536
+EMBEDDING_MAX_INPUT_CHARS = 8000  # limite OpenAI por input (~8k tokens)
+# Lotes: quantidade de inputs e tokens estimados por requisição
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "96"))
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "250000"))
+
+_TOKEN_RE = re.compile(r"[a-z0-9]{2,}")
+# Stopwords pt/en: sem corpus global não há IDF; descartá-las faz o papel dos termos de IDF ~0
+_STOPWORDS = frozenset("""
+    de da do das dos em no na nos nas um uma uns umas o a os as e ou que se por para com sem
+    como mais mas ao aos pela pelo pelas pelos entre sobre sua seu suas seus ele ela eles elas
+    isso isto esse essa este esta ja nao sim ser sao foi tem ter ha the of and or to in on for
+    is are was be by with as at an it this that from
+""".split())
+
+
+def _estimate_tokens(text: str) -> int:
+    """Estimativa grosseira de tokens (~4 caracteres por token)"""
+    return max(1, len(text) // 4)
+
+
+def _plan_batches(
+    texts: List[str],
+    max_inputs: int = EMBEDDING_BATCH_SIZE,
+    max_tokens: int = EMBEDDING_BATCH_MAX_TOKENS
+) -> List[List[int]]:
+    """Agrupa índices de textos em lotes respeitando limites de inputs e tokens"""
+    batches: List[List[int]] = []
+    current: List[int] = []
+    current_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = _estimate_tokens(text)
+        if current and (len(current) >= max_inputs or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+class EmbeddingProvider(ABC):
+    """Interface: `embed` devolve um vetor por texto, ou None onde falhou"""
+
+    name = "base"
+    model = "base"
+    dim = EMBEDDING_DIM
+    # Prefixos do vetor (renormalizados) preservam a semântica (treino Matryoshka)
+    supports_truncation = False
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> List[Optional[List[float]]]:
+        ...
+
+    async def aembed(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Versão async de `embed`; por padrão roda `embed` numa thread"""
+        return await asyncio.to_thread(self.embed, texts)
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """Embeddings via API OpenAI, em lotes (uma requisição por lote)"""
+
+    name = "openai"
+    model = "text-embedding-3-small"
+    supports_truncation = True
+
+    def __init__(self, timeout: float = 60.0):
+        self.timeout = timeout
+
+    def embed(self, texts: List[str]) -> List[Optional[List[float]]]:
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not texts or not api_key:
+            return results
+
+        inputs = [t[:EMBEDDING_MAX_INPUT_CHARS] for t in texts]
+        for batch in _plan_batches(inputs, EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_MAX_TOKENS):
+            payload = {
+                "model": self.model,
+                "input": [inputs[i] for i in batch]
+            }
+            try:
+                data = post_openai("/embeddings", payload, api_key=api_key, timeout=self.timeout)
+                # A API devolve "index" relativo ao lote; não confiar na ordem da lista
+                for item in data["data"]:
+                    results[batch[item["index"]]] = item["embedding"]
+            except Exception:
+                continue
+        return results
+
+    async def aembed(self, texts: List[str]) -> List[Optional[List[float]]]:
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not texts or not api_key:
+            return results
+
+        inputs = [t[:EMBEDDING_MAX_INPUT_CHARS] for t in texts]
+        batches = _plan_batches(inputs, EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_MAX_TOKENS)
+        # Lotes em paralelo pelo pool async; lote que falhar fica None, como em `embed`
+        responses = await asyncio.gather(*[
+            apost_openai(
+                "/embeddings",
+                {"model": self.model, "input": [inputs[i] for i in batch]},
+                api_key=api_key,
+                timeout=self.timeout
+            )
+            for batch in batches
+        ], return_exceptions=True)
+        for batch, data in zip(batches, responses):
+            if isinstance(data, BaseException):
+                continue
+            try:
+                for item in data["data"]:
+                    results[batch[item["index"]]] = item["embedding"]
+            except Exception:
+                continue
+        return results
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Embedding local determinístico, sem rede: hashing trick sobre unigramas e
+    bigramas (sem acentos), TF sublinear, sinal por hash e normalização L2.
+    """
+
+    name = "local"
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+        self.model = f"local-hashing-v1-{dim}"
+
+    @staticmethod
+    def _tokens(text: str) -> List[str]:
+        normalized = unicodedata.normalize("NFKD", text.lower())
+        normalized = "".join(c for c in normalized if not unicodedata.combining(c))
+        return [t for t in _TOKEN_RE.findall(normalized) if t not in _STOPWORDS]
+
+    def _embed_one(self, text: str) -> List[float]:
+        tokens = self._tokens(text)
+        features = Counter(tokens)
+        features.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, tf in features.items():
+            digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            sign = 1.0 if digest >> 63 else -1.0
+            vector[digest % self.dim] += sign * (1.0 + math.log(tf))
+
+        norm = float(np.linalg.norm(vector))
+        if norm > 0:
+            vector /= norm
+        return vector.tolist()
+
+    def embed(self, texts: List[str]) -> List[Optional[List[float]]]:
+        return [self._embed_one(t[:EMBEDDING_MAX_INPUT_CHARS]) for t in texts]
+
+
+def get_embedding_provider(timeout: Optional[float] = None) -> EmbeddingProvider:
+    """Provedor configurado (resolvido a cada chamada para respeitar o ambiente)"""
+    choice = os.getenv("EMBEDDING_PROVIDER", EMBEDDING_PROVIDER).lower()
+    if choice == "local" or (choice == "auto" and not os.getenv("OPENAI_API_KEY")):
+        return HashingEmbeddingProvider()
+    return OpenAIEmbeddingProvider(timeout=timeout or 60.0)
@@ -2,147 +2,721 @@
 Serviço de embeddings e RAG para o Ficous
 """
 import os
+import re
 import json
+import asyncio
+import uuid
+import time
 import hashlib
-from typing import List, Dict, Any, Optional, Tuple
+from collections import Counter, deque
+from itertools import islice
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Iterator
+from sqlalchemy import and_, or_
 from sqlalchemy.orm import Session
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 
 from .. import models
 from ..utils import _clean_text
+from .embedding_providers import OpenAIEmbeddingProvider, get_embedding_provider, _estimate_tokens
+from .circuit_breaker import CircuitBreakerState
+from .quantization import (
+    VECTOR_QUANTIZATION,
+    VECTOR_RERANK_FACTOR,
+    quantize,
+    dequantize,
+    score_matrix,
+    measure_recall
+)
+from .lexical_index import (
+    get_user_lexical_index,
+    update_lexical_index,
+    update_lexical_owner_discipline,
+    bump_lexical_version
+)
+from .vector_cache import get_corpus_version, bump_corpus_version, get_cached_matrix, set_cached_matrix
+from .embedding_cache import content_hash, get_cached_vectors, store_cached_vectors
+from .query_embedding_cache import get_cached_query_embedding, set_cached_query_embedding, normalize_query
+from .ann_index import ANN_NPROBE, get_user_index, update_user_index
+from .diversification import mmr_enabled, mmr_pool_size, mmr_select
+from .concept_stats import update_concept_strengths
+from .pgvector_backend import (
+    PGVECTOR_CANDIDATE_FACTOR,
+    pgvector_enabled,
+    store_vectors as store_pgvectors,
+    search as pgvector_search
+)
 
+# Vetores persistidos como float32 little-endian (decodificáveis via np.frombuffer)
+VECTOR_DTYPE = np.dtype("<f4")
 
-def _get_embedding(text: str) -> List[float]:
-    """Gera embedding via OpenAI ou fallback local"""
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        # Fallback: embedding aleatório (para desenvolvimento)
-        return np.random.rand(1536).tolist()
-    
-    import httpx
-    payload = {
-        "model": "text-embedding-3-small",
-        "input": text[:8000]  # limite OpenAI
-    }
-    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-    
-    try:
-        with httpx.Client(timeout=30) as client:
-            resp = client.post("https://api.openai.com/v1/embeddings", json=payload, headers=headers)
-            resp.raise_for_status()
-            data = resp.json()
-            return data["data"][0]["embedding"]
-    except Exception:
-        # Fallback: embedding aleatório
-        return np.random.rand(1536).tolist()
+# Linhas sem embedding_model foram geradas antes dos provedores plugáveis (OpenAI)
+LEGACY_EMBEDDING_MODEL = OpenAIEmbeddingProvider.model
 
+# Recuperação: vector | hybrid (BM25 + vetorial, opt-in) | lexical (sem embedding da query)
+RAG_RETRIEVAL_MODE = os.getenv("RAG_RETRIEVAL_MODE", "vector").lower()
+HYBRID_LEXICAL_WEIGHT = float(os.getenv("HYBRID_LEXICAL_WEIGHT", "0.3"))
+# Candidatos BM25 por resultado final no caminho só-léxico (re-ranking com PersoScore)
+LEXICAL_CANDIDATE_FACTOR = int(os.getenv("LEXICAL_CANDIDATE_FACTOR", "10"))
+# Busca em dois estágios (Matryoshka): prefixo de N dimensões para a lista curta, 0 = desligado
+RAG_PREFIX_DIMS = int(os.getenv("RAG_PREFIX_DIMS", "0"))
+# Candidatos do estágio de prefixo por resultado final (re-ranqueados com todas as dimensões)
+PREFIX_SHORTLIST_FACTOR = int(os.getenv("PREFIX_SHORTLIST_FACTOR", "20"))
+# Chunks dimensionados por tokens estimados e alinhados a fim de frase
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "256"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+# Chunks por janela na sincronização de um owner (diff por hash + embeddings + inserts)
+EMBEDDING_SYNC_WINDOW = int(os.getenv("EMBEDDING_SYNC_WINDOW", "256"))
+# Deduplicação na indexação: chunk novo com cosseno >= limiar contra um chunk de outra
+# nota/fonte do usuário (mesma disciplina) vira referência, sem vetor próprio
+EMBEDDING_DEDUP_ENABLED = os.getenv("EMBEDDING_DEDUP_ENABLED", "true").lower() == "true"
+EMBEDDING_DEDUP_THRESHOLD = float(os.getenv("EMBEDDING_DEDUP_THRESHOLD", "0.97"))
+# Meia-vida da recency do PersoScore (dias desde created_at; 0 desliga o decaimento)
+RAG_RECENCY_HALF_LIFE_DAYS = float(os.getenv("RAG_RECENCY_HALF_LIFE_DAYS", "30"))
+# Embedding da query mais lento que isso cai no caminho só-léxico
+EMBEDDING_QUERY_TIMEOUT = float(os.getenv("EMBEDDING_QUERY_TIMEOUT", "5"))
 
-def _chunk_text(text: str, chunk_size: int = 400, overlap: int = 50) -> List[str]:
-    """Divide texto em chunks com sobreposição"""
-    if len(text) <= chunk_size:
-        return [text]
-    
-    chunks = []
+# Falhas consecutivas do embedding da query abrem o circuito (evita esperar o timeout a cada pergunta)
+_query_breaker = CircuitBreakerState()
+
+
+def _get_embedding(text: str, timeout: Optional[float] = None) -> Optional[List[float]]:
+    """Embedding de um texto pelo provedor configurado; None se o provedor falhar"""
+    return get_embedding_provider(timeout=timeout).embed([text])[0]
+
+
+def _get_query_embedding(query: str) -> Optional[List[float]]:
+    """
+    Embedding da query: cache LRU (texto normalizado + modelo) e, em caso de
+    miss, provedor protegido por circuit breaker; None se o provedor estiver fora
+    """
+    model = get_embedding_provider().model
+    cached = get_cached_query_embedding(query, model)
+    if cached is not None:
+        return cached
+    if not _query_breaker.should_allow_request():
+        return None
+    embedding = _get_embedding(query, timeout=EMBEDDING_QUERY_TIMEOUT)
+    if embedding is None:
+        _query_breaker.record_failure()
+    else:
+        _query_breaker.record_success()
+        set_cached_query_embedding(query, model, embedding)
+    return embedding
+
+
+async def _get_embedding_async(text: str, timeout: Optional[float] = None) -> Optional[List[float]]:
+    """Versão async de _get_embedding"""
+    return (await get_embedding_provider(timeout=timeout).aembed([text]))[0]
+
+
+async def _get_query_embedding_async(query: str) -> Optional[List[float]]:
+    """Versão async de _get_query_embedding (mesmo cache LRU e circuit breaker)"""
+    model = get_embedding_provider().model
+    cached = get_cached_query_embedding(query, model)
+    if cached is not None:
+        return cached
+    if not _query_breaker.should_allow_request():
+        return None
+    embedding = await _get_embedding_async(query, timeout=EMBEDDING_QUERY_TIMEOUT)
+    if embedding is None:
+        _query_breaker.record_failure()
+    else:
+        _query_breaker.record_success()
+        set_cached_query_embedding(query, model, embedding)
+    return embedding
+
+
+def _embed_queries(queries: List[str]) -> List[Optional[List[float]]]:
+    """Embeddings de várias queries em uma única requisição ao provedor"""
+    return get_embedding_provider(timeout=EMBEDDING_QUERY_TIMEOUT).embed(queries)
+
+
+def _get_query_embeddings(queries: List[str]) -> List[Optional[List[float]]]:
+    """
+    Versão em lote de _get_query_embedding: cache por query e uma única
+    requisição (com circuit breaker) para as queries distintas que faltarem
+    """
+    model = get_embedding_provider().model
+    embeddings = [get_cached_query_embedding(query, model) for query in queries]
+    missing: Dict[str, List[int]] = {}
+    for i, embedding in enumerate(embeddings):
+        if embedding is None:
+            missing.setdefault(normalize_query(queries[i]), []).append(i)
+    if not missing or not _query_breaker.should_allow_request():
+        return embeddings
+
+    texts = [queries[positions[0]] for positions in missing.values()]
+    fresh = _embed_queries(texts)
+    if all(embedding is None for embedding in fresh):
+        _query_breaker.record_failure()
+        return embeddings
+    _query_breaker.record_success()
+    for text, positions, embedding in zip(texts, missing.values(), fresh):
+        if embedding is None:
+            continue
+        set_cached_query_embedding(text, model, embedding)
+        for i in positions:
+            embeddings[i] = embedding
+    return embeddings
+
+
+def _request_embeddings(texts: List[str]) -> List[Optional[List[float]]]:
+    """Embeddings em lote pelo provedor configurado; None nas posições que falharam"""
+    if not texts:
+        return []
+    return get_embedding_provider().embed(texts)
+
+
+def embed_chunks(chunks: List[str], db: Session) -> List[Optional[bytes]]:
+    """
+    Vetores empacotados para os chunks, reaproveitando o cache endereçado por
+    conteúdo: só chunks inéditos (deduplicados) vão para o provedor.
+    Chunks cujo embedding falhou ficam None (pendentes de re-embedding).
+    """
+    provider = get_embedding_provider()
+    # Provedor local é mais barato que o round-trip ao cache
+    use_cache = provider.name != "local"
+    hashes = [content_hash(chunk) for chunk in chunks]
+    packed: Dict[str, bytes] = get_cached_vectors(hashes, provider.model, db) if use_cache else {}
+
+    missing: Dict[str, str] = {}
+    for h, chunk in zip(hashes, chunks):
+        if h not in packed and h not in missing:
+            missing[h] = chunk
+
+    fresh: Dict[str, bytes] = {}
+    if missing:
+        vectors = _request_embeddings(list(missing.values()))
+        for h, vector in zip(missing, vectors):
+            if vector is not None:
+                fresh[h] = _pack_vector(vector)
+    if use_cache:
+        store_cached_vectors(fresh, provider.model, db)
+    packed.update(fresh)
+
+    return [packed.get(h) for h in hashes]
+
+
+def _model_filter(model: str):
+    """Filtro SQL das linhas geradas pelo modelo informado"""
+    condition = models.Embedding.embedding_model == model
+    if model == LEGACY_EMBEDDING_MODEL:
+        condition = or_(condition, models.Embedding.embedding_model.is_(None))
+    return condition
+
+
+def _pack_vector(vector: List[float]) -> bytes:
+    """Empacota vetor como float32 little-endian (4 bytes por dimensão)"""
+    return np.asarray(vector, dtype=VECTOR_DTYPE).tobytes()
+
+
+def _unpack_vector(data: bytes) -> np.ndarray:
+    """Decodifica vetor empacotado sem cópia (view somente-leitura sobre os bytes)"""
+    return np.frombuffer(data, dtype=VECTOR_DTYPE)
+
+
+def _decode_vector(vector_f32: Optional[bytes], vector: Optional[str]) -> Optional[np.ndarray]:
+    """Decodifica vetor, preferindo o formato binário ao JSON legado"""
+    if vector_f32:
+        return _unpack_vector(vector_f32)
+    if vector:
+        return np.asarray(json.loads(vector), dtype=VECTOR_DTYPE)
+    return None
+
+
+_SENTENCE_BOUNDARY_RE = re.compile(r"(?<=[.!?…;])\s+|\n+")
+_WORD_RE = re.compile(r"\S+\s*")
+
+
+def _iter_sentences(text: str) -> Iterator[str]:
+    """Frases do texto (fim em . ! ? … ; seguido de espaço, ou quebra de linha)"""
     start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunk = text[start:end]
-        
-        # Tentar quebrar em frase/ponto
-        if end < len(text):
-            last_period = chunk.rfind('.')
-            last_newline = chunk.rfind('\n')
-            break_point = max(last_period, last_newline)
-            if break_point > chunk_size // 2:
-                chunk = chunk[:break_point + 1]
-                end = start + break_point + 1
-        
-        chunks.append(chunk.strip())
-        start = end - overlap
-    
-    return [c for c in chunks if c]
+    for match in _SENTENCE_BOUNDARY_RE.finditer(text):
+        sentence = text[start:match.start()].strip()
+        if sentence:
+            yield sentence
+        start = match.end()
+    tail = text[start:].strip()
+    if tail:
+        yield tail
+
+
+def _split_long_sentence(sentence: str, max_chars: int) -> Iterator[str]:
+    """Quebra frase maior que um chunk em limites de palavra (só palavra gigante é cortada)"""
+    piece: List[str] = []
+    size = 0
+    for match in _WORD_RE.finditer(sentence):
+        word = match.group()
+        while len(word) > max_chars:
+            if piece:
+                yield "".join(piece).strip()
+                piece, size = [], 0
+            yield word[:max_chars]
+            word = word[max_chars:]
+        if piece and size + len(word) > max_chars:
+            yield "".join(piece).strip()
+            piece, size = [], 0
+        if word.strip():
+            piece.append(word)
+            size += len(word)
+    if piece:
+        yield "".join(piece).strip()
+
+
+def iter_chunks(
+    text: str,
+    max_tokens: int = CHUNK_MAX_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS
+) -> Iterator[str]:
+    """
+    Gera chunks sob demanda, em uma única passada: frases inteiras agrupadas até
+    `max_tokens` estimados; as últimas frases (até `overlap_tokens`) abrem o próximo chunk.
+    """
+    max_chars = max_tokens * 4
+    window: deque = deque()  # (frase, tokens)
+    window_tokens = 0
+    fresh = False  # janela tem frase ainda não emitida
+
+    for sentence in _iter_sentences(text):
+        if _estimate_tokens(sentence) <= max_tokens:
+            pieces: Iterable[str] = (sentence,)
+        else:
+            pieces = _split_long_sentence(sentence, max_chars)
+        for piece in pieces:
+            tokens = _estimate_tokens(piece)
+            if fresh and window_tokens + tokens > max_tokens:
+                yield " ".join(part for part, _ in window)
+                # Sobreposição: frases finais que cabem no orçamento de overlap
+                carried: deque = deque()
+                carried_tokens = 0
+                for part, part_tokens in reversed(window):
+                    if carried_tokens + part_tokens > overlap_tokens:
+                        break
+                    carried.appendleft((part, part_tokens))
+                    carried_tokens += part_tokens
+                if carried_tokens + tokens > max_tokens:
+                    carried, carried_tokens = deque(), 0
+                window, window_tokens = carried, carried_tokens
+            window.append((piece, tokens))
+            window_tokens += tokens
+            fresh = True
+
+    if fresh:
+        yield " ".join(part for part, _ in window)
+
+
+def _chunk_text(text: str, chunk_size: int = 400, overlap: int = 50) -> List[str]:
+    """Divide texto em chunks com sobreposição (tamanhos em caracteres; ver iter_chunks)"""
+    return list(iter_chunks(text, max_tokens=max(1, chunk_size // 4), overlap_tokens=overlap // 4))
+
+
+def _chunk_meta(chunk: str, concept_tags: List[str]) -> Dict[str, Any]:
+    return {
+        "concept_tags": concept_tags,
+        "tokens": len(chunk.split())
+    }
+
 
+def _sync_owner_chunks(
+    user_id: Any,
+    owner_type: str,
+    owner_id: Any,
+    chunks: Iterable[str],
+    concept_tags: List[str],
+    db: Session,
+    incremental: bool = True,
+    discipline_id: Optional[Any] = None
+) -> int:
+    """
+    Sincroniza os embeddings de um owner com os novos chunks (lista ou gerador).
+
+    Modo incremental: compara por hash com as linhas existentes, insere apenas
+    chunks novos e remove apenas os que saíram (em uma única transação).
+    Modo completo: remove tudo e reinsere. O gerador é consumido em janelas de
+    EMBEDDING_SYNC_WINDOW chunks: diff, embeddings e inserts por janela.
+    """
+    owner_filter = (
+        models.Embedding.user_id == user_id,
+        models.Embedding.owner_type == owner_type,
+        models.Embedding.owner_id == owner_id
+    )
+    model = get_embedding_provider().model
+
+    # Linhas existentes reaproveitáveis por hash (multiconjunto: chunks repetidos contam)
+    reusable: Dict[str, List[Tuple[Any, bool]]] = {}
+    stale_ids: List[Any] = []
+    tags_changed_ids: List[Any] = []
+    discipline_changed = False
+    released: List[models.Embedding] = []
+    if incremental:
+        existing = db.query(
+            models.Embedding.id,
+            models.Embedding.content_hash,
+            models.Embedding.chunk_text,
+            models.Embedding.meta,
+            models.Embedding.embedding_model,
+            models.Embedding.discipline_id,
+            and_(models.Embedding.vector_f32.is_(None), models.Embedding.canonical_id.is_(None)).label("pending")
+        ).filter(*owner_filter).all()
+        for emb_id, h, chunk_text, meta, emb_model, emb_discipline, pending in existing:
+            discipline_changed |= not _same_id(emb_discipline, discipline_id)
+            h = h or content_hash(chunk_text or "")
+            # Linhas pendentes ou de outro modelo são re-embedadas
+            if not pending and (emb_model or LEGACY_EMBEDDING_MODEL) == model:
+                tags_changed = (meta or {}).get("concept_tags", []) != concept_tags
+                reusable.setdefault(h, []).append((emb_id, tags_changed))
+            else:
+                stale_ids.append(emb_id)
+        if discipline_changed:
+            # Antes dos inserts: só as linhas que o owner já tinha mudam de disciplina
+            owner_ids = [emb_id for emb_id, *_ in existing]
+            released = release_references(owner_ids, db)
+            released += _materialize_references(owner_filter, discipline_id, db)
+            db.query(models.Embedding).filter(*owner_filter).update(
+                {models.Embedding.discipline_id: discipline_id}, synchronize_session=False
+            )
+    else:
+        stale_ids = [emb_id for (emb_id,) in db.query(models.Embedding.id).filter(*owner_filter).all()]
+        released = release_references(stale_ids, db)
+        db.query(models.Embedding).filter(*owner_filter).delete(synchronize_session=False)
+
+    total = inserted = 0
+    added: List[Tuple[Any, np.ndarray]] = []
+    lexical_added: List[Tuple[Any, Any, str, Optional[Any]]] = []
+    iterator = iter(chunks)
+    while True:
+        window = list(islice(iterator, EMBEDDING_SYNC_WINDOW))
+        if not window:
+            break
+        total += len(window)
+
+        # Chunks da janela sem linha reaproveitável (na ordem original)
+        to_insert: List[Tuple[str, str]] = []
+        for chunk in window:
+            h = content_hash(chunk)
+            matches = reusable.get(h)
+            if matches:
+                emb_id, tags_changed = matches.pop()
+                if tags_changed:
+                    tags_changed_ids.append(emb_id)
+            else:
+                to_insert.append((chunk, h))
+        if not to_insert:
+            continue
+
+        inserted += len(to_insert)
+        vectors = embed_chunks([chunk for chunk, _ in to_insert], db)
+        canonical_ids = _find_near_duplicates(user_id, owner_id, discipline_id, vectors, db)
+        window_added: List[Tuple[Any, np.ndarray]] = []
+        for (chunk, h), packed, canonical_id in zip(to_insert, vectors, canonical_ids):
+            emb_id = uuid.uuid4()
+            if canonical_id is not None:
+                packed = None  # quase-duplicata: o vetor fica só na linha canônica
+            db.add(models.Embedding(
+                id=emb_id,
+                user_id=user_id,
+                owner_type=owner_type,
+                owner_id=owner_id,
+                discipline_id=discipline_id,
+                chunk_text=chunk,
+                content_hash=h,
+                vector_f32=packed,
+                canonical_id=canonical_id,
+                embedding_model=model,
+                strength=PERSO_FACTOR_DEFAULTS["strength"],
+                meta=_chunk_meta(chunk, concept_tags)
+            ))
+            # Chunks sem vetor ficam pendentes (vector_f32 NULL) até reembed_pending;
+            # pendentes também entram no índice léxico (buscáveis sem embedding), referências não
+            if canonical_id is None:
+                lexical_added.append((emb_id, owner_id, chunk, discipline_id))
+                if packed is not None:
+                    window_added.append((emb_id, _unpack_vector(packed)))
+        if pgvector_enabled(db):
+            store_pgvectors(db, window_added)
+        else:
+            db.flush()
+        added.extend(window_added)
+
+    # Linhas que nenhum chunk novo reaproveitou saem
+    for matches in reusable.values():
+        stale_ids.extend(emb_id for emb_id, _ in matches)
+    if incremental:
+        if not inserted and not stale_ids and not tags_changed_ids and not discipline_changed:
+            return total  # nada mudou
+        if not discipline_changed:
+            released = release_references(stale_ids, db)
+        if stale_ids:
+            db.query(models.Embedding).filter(
+                models.Embedding.id.in_(stale_ids)
+            ).delete(synchronize_session=False)
+        for emb in db.query(models.Embedding).filter(models.Embedding.id.in_(tags_changed_ids)).all():
+            emb.meta = {**(emb.meta or {}), "concept_tags": concept_tags}
+    released_rows = released_entries(released, exclude_ids=stale_ids)
+
+    db.commit()
+    bump_corpus_version(str(user_id))
+    update_user_index(str(user_id), added=added, removed_ids=stale_ids)
+    update_lexical_index(str(user_id), added=lexical_added, removed_ids=stale_ids)
+    index_released_rows(released_rows)
+    if discipline_changed:
+        update_lexical_owner_discipline(str(user_id), owner_id, discipline_id)
+    return total
+
+
+def _same_id(a: Any, b: Any) -> bool:
+    return (a is None and b is None) or (a is not None and b is not None and str(a) == str(b))
+
+
+def _find_near_duplicates(
+    user_id: Any,
+    owner_id: Any,
+    discipline_id: Optional[Any],
+    vectors: List[Optional[bytes]],
+    db: Session
+) -> List[Optional[Any]]:
+    """
+    Para cada vetor novo, o id da linha canônica quase idêntica (cosseno >=
+    EMBEDDING_DEDUP_THRESHOLD) entre os chunks de outras notas/fontes da mesma
+    disciplina; None quando não há. Um único produto matriz-matriz contra a matriz
+    em cache do usuário.
+    """
+    canonical_ids: List[Optional[Any]] = [None] * len(vectors)
+    positions = [i for i, packed in enumerate(vectors) if packed is not None]
+    if not EMBEDDING_DEDUP_ENABLED or not positions:
+        return canonical_ids
+    vm = get_user_vector_matrix(str(user_id), db)
+    if not len(vm):
+        return canonical_ids
+    discipline = str(discipline_id) if discipline_id is not None else ""
+    rows = np.flatnonzero((vm.owner_ids != str(owner_id)) & (vm.discipline_ids == discipline))
+    if not rows.size:
+        return canonical_ids
 
-def index_note_content(note: models.Note, db: Session) -> int:
+    similarities = vm.score_many(np.stack([_unpack_vector(vectors[i]) for i in positions]), rows)
+    best = np.argmax(similarities, axis=0)
+    for col, i in enumerate(positions):
+        if similarities[best[col], col] >= EMBEDDING_DEDUP_THRESHOLD:
+            canonical_ids[i] = vm.ids[rows[best[col]]]
+
+    # A matriz em cache pode estar defasada (TTL, outro processo): só vale como
+    # canônica a linha que ainda existe e ainda é canônica nesta transação
+    candidates = {str(c): c for c in canonical_ids if c is not None}
+    if candidates:
+        alive = {
+            str(emb_id) for (emb_id,) in db.query(models.Embedding.id).filter(
+                models.Embedding.id.in_(list(candidates.values())),
+                models.Embedding.canonical_id.is_(None)
+            ).all()
+        }
+        canonical_ids = [c if c is None or str(c) in alive else None for c in canonical_ids]
+    return canonical_ids
+
+
+def _adopt_vector(row: models.Embedding, source: Optional[Tuple[Any, ...]]) -> None:
+    """Copia o vetor da linha canônica para a referência, que passa a ser canônica"""
+    vector_f32, vector, embedding_model = source or (None, None, None)
+    row.vector_f32 = vector_f32
+    row.vector = vector
+    row.embedding_model = embedding_model or row.embedding_model
+    row.canonical_id = None  # sem vetor na origem: fica pendente para reembed_pending
+
+
+def _canonical_vectors(canonical_ids: Iterable[Any], db: Session) -> Dict[str, Tuple[Any, ...]]:
+    return {
+        str(emb_id): (vector_f32, vector, embedding_model)
+        for emb_id, vector_f32, vector, embedding_model in db.query(
+            models.Embedding.id,
+            models.Embedding.vector_f32,
+            models.Embedding.vector,
+            models.Embedding.embedding_model
+        ).filter(models.Embedding.id.in_(list(canonical_ids))).all()
+    }
+
+
+def _store_released(rows: List[models.Embedding], db: Session) -> None:
+    if rows and pgvector_enabled(db):
+        db.flush()
+        store_pgvectors(db, [(row.id, _unpack_vector(row.vector_f32)) for row in rows if row.vector_f32])
+
+
+def release_references(canonical_ids: List[Any], db: Session) -> List[models.Embedding]:
+    """
+    Desfaz as referências para `canonical_ids` (linhas que vão ser removidas ou
+    mudaram de disciplina): a referência mais antiga de cada grupo recebe o vetor
+    e vira canônica; as demais passam a apontar para ela. Não faz commit: guardar
+    released_entries(retorno) e, depois do commit, chamar index_released_rows.
+    """
+    if not canonical_ids:
+        return []
+    refs = db.query(models.Embedding).filter(
+        models.Embedding.canonical_id.in_(canonical_ids),
+        ~models.Embedding.id.in_(canonical_ids)
+    ).order_by(models.Embedding.created_at, models.Embedding.id).all()
+    if not refs:
+        return []
+
+    sources = _canonical_vectors({ref.canonical_id for ref in refs}, db)
+    heads: Dict[str, models.Embedding] = {}
+    for ref in refs:
+        key = str(ref.canonical_id)
+        head = heads.get(key)
+        if head is None:
+            _adopt_vector(ref, sources.get(key))
+            heads[key] = ref
+        else:
+            ref.canonical_id = head.id
+    released = list(heads.values())
+    _store_released(released, db)
+    return released
+
+
+def _materialize_references(
+    owner_filter: Tuple[Any, ...],
+    discipline_id: Optional[Any],
+    db: Session
+) -> List[models.Embedding]:
+    """Referências do próprio owner ganham vetor próprio (o owner mudou para `discipline_id`)"""
+    refs = db.query(models.Embedding).filter(*owner_filter, models.Embedding.canonical_id.isnot(None)).all()
+    if not refs:
+        return []
+    sources = _canonical_vectors({ref.canonical_id for ref in refs}, db)
+    for ref in refs:
+        _adopt_vector(ref, sources.get(str(ref.canonical_id)))
+        ref.discipline_id = discipline_id
+    _store_released(refs, db)
+    return refs
+
+
+def released_entries(rows: List[models.Embedding], exclude_ids: Iterable[Any] = ()) -> List[Tuple[Any, ...]]:
+    """Retrato (antes do commit) das linhas que viraram canônicas, para index_released_rows"""
+    excluded = {str(emb_id) for emb_id in exclude_ids}
+    return [
+        (str(row.user_id), row.id, row.vector_f32, row.owner_id, row.chunk_text, row.discipline_id)
+        for row in rows
+        if str(row.id) not in excluded
+    ]
+
+
+def index_released_rows(entries: List[Tuple[Any, ...]]) -> None:
+    """Após o commit: linhas que viraram canônicas entram no índice ANN e no BM25"""
+    by_user: Dict[str, List[Tuple[Any, ...]]] = {}
+    for entry in entries:
+        by_user.setdefault(entry[0], []).append(entry)
+    for user_id, user_entries in by_user.items():
+        update_user_index(user_id, added=[
+            (emb_id, _unpack_vector(packed)) for _, emb_id, packed, _, _, _ in user_entries if packed
+        ], removed_ids=[])
+        update_lexical_index(user_id, added=[
+            (emb_id, owner_id, chunk_text, discipline_id)
+            for _, emb_id, _, owner_id, chunk_text, discipline_id in user_entries
+        ], removed_ids=[])
+
+
+def set_owner_discipline(
+    user_id: Any,
+    owner_type: str,
+    owner_id: Any,
+    discipline_id: Optional[Any],
+    db: Session
+) -> int:
+    """Propaga a disciplina de uma nota/fonte para os embeddings dela (ao mover de disciplina)"""
+    owner_filter = (
+        models.Embedding.user_id == user_id,
+        models.Embedding.owner_type == owner_type,
+        models.Embedding.owner_id == owner_id
+    )
+    # Referências só valem dentro da mesma disciplina
+    owner_ids = [emb_id for (emb_id,) in db.query(models.Embedding.id).filter(*owner_filter).all()]
+    released = release_references(owner_ids, db)
+    released = released_entries(released + _materialize_references(owner_filter, discipline_id, db))
+    updated = db.query(models.Embedding).filter(*owner_filter).update(
+        {models.Embedding.discipline_id: discipline_id}, synchronize_session=False
+    )
+    db.commit()
+    if updated:
+        bump_corpus_version(str(user_id))
+        update_lexical_owner_discipline(str(user_id), owner_id, discipline_id)
+        index_released_rows(released)
+    return updated
+
+
+def count_pending_embeddings(
+    db: Session,
+    user_id: Optional[Any] = None,
+    owner_id: Optional[Any] = None
+) -> int:
+    """Quantidade de chunks sem vetor (embedding falhou na indexação; referências não contam)"""
+    query = db.query(models.Embedding).filter(
+        models.Embedding.vector_f32.is_(None),
+        models.Embedding.vector.is_(None),
+        models.Embedding.canonical_id.is_(None)
+    )
+    if user_id is not None:
+        query = query.filter(models.Embedding.user_id == user_id)
+    if owner_id is not None:
+        query = query.filter(models.Embedding.owner_id == owner_id)
+    return query.count()
+
+
+def reembed_pending(db: Session, user_id: Optional[Any] = None, limit: int = 500) -> int:
+    """Gera vetores para chunks pendentes; retorna quantos foram resolvidos"""
+    query = db.query(models.Embedding).filter(
+        models.Embedding.vector_f32.is_(None),
+        models.Embedding.vector.is_(None),
+        models.Embedding.canonical_id.is_(None)
+    )
+    if user_id is not None:
+        query = query.filter(models.Embedding.user_id == user_id)
+    pending = query.limit(limit).all()
+    if not pending:
+        return 0
+
+    model = get_embedding_provider().model
+    vectors = embed_chunks([emb.chunk_text or "" for emb in pending], db)
+
+    added: Dict[str, List[Tuple[Any, np.ndarray]]] = {}
+    for emb, packed in zip(pending, vectors):
+        if packed is None:
+            continue
+        emb.vector_f32 = packed
+        emb.embedding_model = model
+        added.setdefault(str(emb.user_id), []).append((emb.id, _unpack_vector(packed)))
+
+    if pgvector_enabled(db):
+        store_pgvectors(db, [item for items in added.values() for item in items])
+    db.commit()
+    for owner_user_id, items in added.items():
+        bump_corpus_version(owner_user_id)
+        update_user_index(owner_user_id, added=items, removed_ids=[])
+        bump_lexical_version(owner_user_id)
+    return sum(len(items) for items in added.values())
+
+
+def index_note_content(note: models.Note, db: Session, incremental: bool = True) -> int:
     """Indexa conteúdo de uma nota em chunks com embeddings"""
     if not note.content:
         return 0
     
     # Limpar texto
     clean_text = _clean_text(note.content)
-    chunks = _chunk_text(clean_text)
-    
-    # Remover embeddings antigos desta nota
-    db.query(models.Embedding).filter(
-        models.Embedding.user_id == note.user_id,
-        models.Embedding.owner_type == "note",
-        models.Embedding.owner_id == note.id
-    ).delete()
-    
-    indexed = 0
-    for chunk in chunks:
-        embedding = _get_embedding(chunk)
-        meta = {
-            "concept_tags": note.concepts_json or [],
-            "strength": 0.5,  # default
-            "recency": 1.0,
-            "tokens": len(chunk.split())
-        }
-        
-        emb = models.Embedding(
-            user_id=note.user_id,
-            owner_type="note",
-            owner_id=note.id,
-            chunk_text=chunk,
-            vector=json.dumps(embedding),
-            meta=meta
-        )
-        db.add(emb)
-        indexed += 1
-    
-    db.commit()
-    return indexed
+    return _sync_owner_chunks(
+        note.user_id, "note", note.id, iter_chunks(clean_text), note.concepts_json or [], db,
+        incremental=incremental, discipline_id=note.discipline_id
+    )
 
 
-def index_source_content(source: models.Source, db: Session) -> int:
+def index_source_content(source: models.Source, db: Session, incremental: bool = True) -> int:
     """Indexa conteúdo de uma fonte (PDF) em chunks com embeddings"""
     if not source.content_excerpt:
         return 0
     
     clean_text = _clean_text(source.content_excerpt)
-    chunks = _chunk_text(clean_text)
-    
-    # Remover embeddings antigos desta fonte
-    db.query(models.Embedding).filter(
-        models.Embedding.user_id == source.user_id,
-        models.Embedding.owner_type == "source",
-        models.Embedding.owner_id == source.id
-    ).delete()
-    
-    indexed = 0
-    for chunk in chunks:
-        embedding = _get_embedding(chunk)
-        meta = {
-            "concept_tags": [],
-            "strength": 0.5,
-            "recency": 1.0,
-            "tokens": len(chunk.split())
-        }
-        
-        emb = models.Embedding(
-            user_id=source.user_id,
-            owner_type="source",
-            owner_id=source.id,
-            chunk_text=chunk,
-            vector=json.dumps(embedding),
-            meta=meta
-        )
-        db.add(emb)
-        indexed += 1
-    
-    db.commit()
-    return indexed
+    return _sync_owner_chunks(
+        source.user_id, "source", source.id, iter_chunks(clean_text), [], db,
+        incremental=incremental, discipline_id=source.discipline_id
+    )
 
 
 def calculate_advanced_perso_score(
@@ -176,6 +750,710 @@ def calculate_advanced_perso_score(
     return similarity * personalization
 
 
+PERSO_FACTOR_DEFAULTS = {
+    "strength": 0.5,
+    "recency": 1.0,
+    "success_rate": 0.5,
+    "frequency": 1,
+    "concept_affinity": 0.5,
+}
+
+# Fatores guardados em colunas tipadas de ficous_embeddings (NULL = default);
+# recency não é persistida: sai de created_at no momento da consulta
+STORED_FACTORS = ("strength", "success_rate", "frequency", "concept_affinity")
+_FACTOR_COLUMNS = STORED_FACTORS + ("created_at",)
+
+
+def _epoch(value: Optional[datetime]) -> float:
+    """Segundos desde a época (NaN se ausente); datetime sem fuso é UTC (SQLite)"""
+    if value is None:
+        return float("nan")
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def recency_scores(created_at: np.ndarray, now: Optional[float] = None) -> np.ndarray:
+    """
+    Recency vetorizada por meia-vida: 1.0 para chunks novos, 0.5 após
+    RAG_RECENCY_HALF_LIFE_DAYS dias. Sem created_at (NaN) conta como novo.
+    """
+    created_at = np.asarray(created_at, dtype=np.float64)
+    if RAG_RECENCY_HALF_LIFE_DAYS <= 0:
+        return np.ones(created_at.shape)
+    now = time.time() if now is None else now
+    age_days = np.maximum(0.0, now - np.nan_to_num(created_at, nan=now)) / 86400.0
+    return np.power(0.5, age_days / RAG_RECENCY_HALF_LIFE_DAYS)
+
+
+def calculate_perso_scores(
+    similarities: np.ndarray,
+    factors: Dict[str, np.ndarray]
+) -> np.ndarray:
+    """
+    Versão vetorizada de calculate_advanced_perso_score: calcula o PersoScore
+    de todas as linhas de uma vez a partir de arrays de fatores.
+    """
+    strength = factors["strength"]
+    recency = factors["recency"]
+    normalized_frequency = np.minimum(1.0, factors["frequency"] / 10.0)
+
+    personalization = (
+        0.3 * strength +
+        0.25 * recency +
+        0.2 * factors["success_rate"] +
+        0.15 * normalized_frequency +
+        0.1 * factors["concept_affinity"]
+    )
+
+    # Decaimento temporal se recency < 0.5
+    personalization = np.where(recency < 0.5, personalization * (0.5 + recency), personalization)
+
+    return similarities * personalization
+
+
+def _top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Índices dos k maiores scores em ordem decrescente (argpartition + sort parcial)"""
+    k = min(k, scores.size)
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if k < scores.size:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.size)
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class VectorMatrix:
+    """
+    Matriz de vetores pré-normalizados de um usuário + fatores do PersoScore.
+    A matriz pode estar quantizada (float16, ou int8 com `scales` por linha).
+    """
+
+    def __init__(
+        self,
+        ids: List[Any],
+        owner_types: np.ndarray,
+        owner_ids: np.ndarray,
+        matrix: np.ndarray,
+        norms: np.ndarray,
+        factors: Dict[str, np.ndarray],
+        discipline_ids: Optional[np.ndarray] = None,
+        scales: Optional[np.ndarray] = None,
+        created_at: Optional[np.ndarray] = None
+    ):
+        self.ids = ids
+        self.owner_types = owner_types
+        self.owner_ids = owner_ids
+        self.matrix = matrix
+        self.norms = norms
+        self.factors = factors
+        self.scales = scales
+        self.discipline_ids = (
+            discipline_ids if discipline_ids is not None else np.full(len(ids), "", dtype=str)
+        )
+        # Segundos desde a época (NaN = desconhecido); recency é derivada na consulta
+        self.created_at = created_at if created_at is not None else np.full(len(ids), np.nan)
+        self._row_by_id: Optional[Dict[str, int]] = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1] if self.matrix.ndim == 2 else 0
+
+    @property
+    def quantization(self) -> str:
+        if self.matrix.dtype == np.int8:
+            return "int8"
+        return "float16" if self.matrix.dtype == np.float16 else "none"
+
+    @property
+    def nbytes(self) -> int:
+        """Estimativa de memória ocupada (para o limite do cache)"""
+        total = self.matrix.nbytes + self.norms.nbytes + self.owner_ids.nbytes + self.discipline_ids.nbytes
+        total += self.created_at.nbytes
+        total += self.scales.nbytes if self.scales is not None else 0
+        total += sum(arr.nbytes for arr in self.factors.values())
+        total += len(self.ids) * 64  # ids (UUID) + owner_types
+        return total
+
+    def score(self, query_vector: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Similaridade de cosseno contra as linhas (um único produto matriz-vetor)"""
+        size = len(self) if rows is None else len(rows)
+        q = np.asarray(query_vector, dtype=np.float32)
+        q_norm = float(np.linalg.norm(q))
+        if q_norm == 0.0 or q.shape[0] != self.dim:
+            return np.zeros(size, dtype=np.float32)
+        matrix = self.matrix if rows is None else self.matrix[rows]
+        scales = self.scales if rows is None or self.scales is None else self.scales[rows]
+        return score_matrix(matrix, q / q_norm, scales)
+
+    def score_many(self, query_vectors: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Similaridade de cosseno de várias queries de uma vez (um produto
+        matriz-matriz): retorna (linhas, queries). Queries nulas ou de outra
+        dimensão ficam com similaridade 0.
+        """
+        size = len(self) if rows is None else len(rows)
+        q = np.asarray(query_vectors, dtype=np.float32)
+        if q.ndim != 2 or q.shape[1] != self.dim:
+            return np.zeros((size, len(q)), dtype=np.float32)
+        q_norms = np.linalg.norm(q, axis=1)
+        q = q / np.where(q_norms == 0, 1.0, q_norms)[:, None]
+        matrix = self.matrix if rows is None else self.matrix[rows]
+        scales = self.scales if rows is None or self.scales is None else self.scales[rows]
+        return score_matrix(matrix, np.ascontiguousarray(q.T), scales)
+
+    def unit_vectors(self, rows: np.ndarray) -> np.ndarray:
+        """Vetores normalizados (float32) das linhas indicadas"""
+        scales = self.scales[rows] if self.scales is not None else None
+        return dequantize(self.matrix[rows], scales)
+
+    def factors_for(self, rows: Optional[np.ndarray] = None, now: Optional[float] = None) -> Dict[str, np.ndarray]:
+        """Fatores do PersoScore das linhas (todas se None) com a recency calculada agora"""
+        if rows is None:
+            factors = dict(self.factors)
+            created_at = self.created_at
+        else:
+            factors = {name: values[rows] for name, values in self.factors.items()}
+            created_at = self.created_at[rows]
+        factors["recency"] = recency_scores(created_at, now)
+        return factors
+
+    def _lookup(self) -> Dict[str, int]:
+        if self._row_by_id is None:
+            self._row_by_id = {str(emb_id): row for row, emb_id in enumerate(self.ids)}
+        return self._row_by_id
+
+    def rows_for(self, ids: List[Any]) -> np.ndarray:
+        """Posições na matriz dos ids informados (ids ausentes são ignorados)"""
+        lookup = self._lookup()
+        rows = [lookup.get(str(emb_id)) for emb_id in ids]
+        return np.asarray(sorted(r for r in rows if r is not None), dtype=np.intp)
+
+    def dense_scores(self, scores: Dict[str, float]) -> np.ndarray:
+        """Array alinhado às linhas com os scores informados por id (0 nas demais)"""
+        dense = np.zeros(len(self), dtype=np.float32)
+        lookup = self._lookup()
+        for emb_id, value in scores.items():
+            row = lookup.get(emb_id)
+            if row is not None:
+                dense[row] = value
+        return dense
+
+    def prefix(self, dims: int) -> "VectorMatrix":
+        """
+        Matriz com as primeiras `dims` dimensões renormalizadas (mesma quantização).
+        Compartilha ids, owners e fatores com a matriz completa.
+        """
+        truncated = dequantize(self.matrix[:, :dims], self.scales)
+        norms = np.linalg.norm(truncated, axis=1) if truncated.size else np.empty(0, dtype=np.float32)
+        if truncated.size:
+            truncated /= np.where(norms == 0, 1.0, norms)[:, None]
+        matrix, scales = quantize(truncated, self.quantization)
+        return VectorMatrix(
+            ids=self.ids,
+            owner_types=self.owner_types,
+            owner_ids=self.owner_ids,
+            matrix=matrix,
+            norms=norms,
+            factors=self.factors,
+            discipline_ids=self.discipline_ids,
+            scales=scales,
+            created_at=self.created_at
+        )
+
+    def discipline_mask(self, discipline_id: Any) -> np.ndarray:
+        """Máscara booleana das linhas da disciplina (notas e fontes)"""
+        return self.discipline_ids == str(discipline_id)
+
+    def owner_mask(self, owner_ids: List[str]) -> np.ndarray:
+        """Máscara booleana das linhas pertencentes aos owners informados"""
+        if not len(self) or not owner_ids:
+            return np.zeros(len(self), dtype=bool)
+        return np.isin(self.owner_ids, np.asarray([str(o) for o in owner_ids]))
+
+
+def _append_factors(
+    factor_lists: Dict[str, List[float]],
+    created_at: List[float],
+    values: Optional[Dict[str, Any]]
+) -> None:
+    """Fatores armazenados (defaults para NULL) e created_at de uma linha para as listas"""
+    values = values or {}
+    for name in STORED_FACTORS:
+        value = values.get(name)
+        factor_lists[name].append(float(value) if value is not None else float(PERSO_FACTOR_DEFAULTS[name]))
+    created_at.append(_epoch(values.get("created_at")))
+
+
+def _row_factors(rows: Iterable[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """Arrays de fatores do PersoScore (recency a partir de created_at) para linhas avulsas"""
+    factor_lists: Dict[str, List[float]] = {name: [] for name in STORED_FACTORS}
+    created_at: List[float] = []
+    for row in rows:
+        _append_factors(factor_lists, created_at, row)
+    factors = {name: np.asarray(values, dtype=np.float64) for name, values in factor_lists.items()}
+    factors["recency"] = recency_scores(np.asarray(created_at, dtype=np.float64))
+    return factors
+
+
+def build_vector_matrix(rows: List[Tuple[Any, ...]], quantization: Optional[str] = None) -> VectorMatrix:
+    """
+    Empilha vetores em uma matriz float32 normalizada por linha (depois
+    quantizada conforme VECTOR_QUANTIZATION, se configurado).
+    rows: (id, owner_type, owner_id, discipline_id, vector_f32, vector, factors), onde
+    factors mapeia STORED_FACTORS e created_at (ausentes usam os defaults)
+    """
+    ids: List[Any] = []
+    owner_types: List[str] = []
+    owner_ids: List[str] = []
+    discipline_ids: List[str] = []
+    vectors: List[np.ndarray] = []
+    factor_lists: Dict[str, List[float]] = {name: [] for name in STORED_FACTORS}
+    created_at: List[float] = []
+    dim = None
+
+    for emb_id, owner_type, owner_id, discipline_id, vector_f32, vector, factor_values in rows:
+        try:
+            vec = _decode_vector(vector_f32, vector)
+        except Exception:
+            continue
+        if vec is None or not vec.size:
+            continue
+        if dim is None:
+            dim = vec.shape[0]
+        elif vec.shape[0] != dim:
+            continue  # dimensão incompatível (modelo diferente)
+
+        ids.append(emb_id)
+        owner_types.append(owner_type)
+        owner_ids.append(str(owner_id))
+        discipline_ids.append(str(discipline_id) if discipline_id is not None else "")
+        vectors.append(vec)
+        _append_factors(factor_lists, created_at, factor_values)
+
+    if vectors:
+        matrix = np.vstack(vectors).astype(np.float32, copy=False)
+    else:
+        matrix = np.empty((0, 0), dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1) if matrix.size else np.empty(0, dtype=np.float32)
+    if matrix.size:
+        # Pré-normaliza (linhas nulas ficam com similaridade 0)
+        matrix /= np.where(norms == 0, 1.0, norms)[:, None]
+    matrix, scales = quantize(matrix, quantization or VECTOR_QUANTIZATION)
+
+    return VectorMatrix(
+        ids=ids,
+        owner_types=np.asarray(owner_types, dtype=object),
+        owner_ids=np.asarray(owner_ids, dtype=str),
+        matrix=matrix,
+        norms=norms,
+        factors={name: np.asarray(values, dtype=np.float64) for name, values in factor_lists.items()},
+        discipline_ids=np.asarray(discipline_ids, dtype=str),
+        scales=scales,
+        created_at=np.asarray(created_at, dtype=np.float64)
+    )
+
+
+def get_user_vector_matrix(user_id: str, db: Session) -> VectorMatrix:
+    """
+    Matriz de vetores do usuário, servida do cache em memória quando a versão
+    do corpus não mudou. Carrega apenas as colunas necessárias (sem chunk_text).
+    """
+    cached = get_cached_matrix(user_id)
+    if cached is not None:
+        return cached
+
+    version = get_corpus_version(user_id)
+    vm = build_vector_matrix(_load_vector_rows(user_id, db))
+    set_cached_matrix(user_id, version, vm, vm.nbytes)
+    return vm
+
+
+def get_prefix_matrix(user_id: str, vm: VectorMatrix, dims: int) -> VectorMatrix:
+    """Matriz de prefixo do usuário, em cache separado da matriz completa"""
+    kind = f"prefix{dims}"
+    cached = get_cached_matrix(user_id, kind=kind)
+    if cached is not None and cached.ids is vm.ids:
+        return cached
+    prefix = vm.prefix(dims)
+    # Só matriz/normas/escalas são novas; o resto é compartilhado com a matriz completa
+    nbytes = prefix.matrix.nbytes + prefix.norms.nbytes
+    nbytes += prefix.scales.nbytes if prefix.scales is not None else 0
+    set_cached_matrix(user_id, get_corpus_version(user_id), prefix, nbytes, kind=kind)
+    return prefix
+
+
+def _prefix_shortlist(
+    user_id: str,
+    vm: VectorMatrix,
+    query_vector: List[float],
+    rows: Optional[np.ndarray],
+    top_k: int,
+    lexical: Optional[np.ndarray]
+) -> Optional[np.ndarray]:
+    """
+    Primeiro estágio Matryoshka: pontua todos os candidatos só no prefixo.
+    None quando desligado, não suportado pelo modelo ou sem ganho (poucos candidatos).
+    """
+    dims = RAG_PREFIX_DIMS
+    if dims <= 0 or dims >= vm.dim or not get_embedding_provider().supports_truncation:
+        return None
+    shortlist = top_k * PREFIX_SHORTLIST_FACTOR
+    if (len(vm) if rows is None else rows.size) <= shortlist:
+        return None
+    prefix_vm = get_prefix_matrix(user_id, vm, dims)
+    top_rows, _, _ = _rank_rows(prefix_vm, np.asarray(query_vector[:dims]), rows, shortlist, lexical)
+    return np.sort(top_rows)
+
+
+def _load_vector_rows(user_id: str, db: Session) -> List[Tuple[Any, ...]]:
+    """Linhas (sem chunk_text nem meta) no formato esperado por build_vector_matrix"""
+    rows = db.query(
+        models.Embedding.id,
+        models.Embedding.owner_type,
+        models.Embedding.owner_id,
+        models.Embedding.discipline_id,
+        models.Embedding.vector_f32,
+        models.Embedding.vector,
+        *(getattr(models.Embedding, name) for name in _FACTOR_COLUMNS)
+    ).filter(
+        models.Embedding.user_id == user_id,
+        # Vetores de outro provedor vivem em outro espaço (e podem ter outra dimensão)
+        _model_filter(get_embedding_provider().model)
+    ).all()
+    return [(*row[:6], dict(zip(_FACTOR_COLUMNS, row[6:]))) for row in rows]
+
+
+def benchmark_quantization(
+    user_id: str,
+    db: Session,
+    k: int = 10,
+    n_queries: int = 50,
+    seed: int = 0
+) -> Dict[str, Any]:
+    """
+    Recall@k dos modos quantizados contra a busca exata em float32 no corpus do
+    usuário. Queries sintéticas: média normalizada de dois chunks sorteados.
+    """
+    vm = build_vector_matrix(_load_vector_rows(str(user_id), db), quantization="none")
+    if len(vm) < 2:
+        return {"rows": len(vm), "modes": {}}
+    rng = np.random.default_rng(seed)
+    pairs = rng.integers(0, len(vm), size=(n_queries, 2))
+    queries = vm.matrix[pairs[:, 0]] + vm.matrix[pairs[:, 1]]
+    queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    return measure_recall(vm.matrix, queries, k=k)
+
+
+def _discipline_rows(vm: VectorMatrix, discipline_id: str) -> np.ndarray:
+    """Índices das linhas (notas e fontes) da disciplina, pela coluna desnormalizada"""
+    return np.flatnonzero(vm.discipline_mask(discipline_id))
+
+
+def _fuse_scores(similarities: np.ndarray, lexical: np.ndarray) -> np.ndarray:
+    """Fusão híbrida: combinação convexa de cosseno e BM25 normalizado"""
+    return (1.0 - HYBRID_LEXICAL_WEIGHT) * similarities + HYBRID_LEXICAL_WEIGHT * lexical
+
+
+def _normalized_lexical_scores(query: str, user_id: str, db: Session) -> Dict[str, float]:
+    """Scores BM25 por id, escalados para [0, 1] pelo maior score da query"""
+    scores = get_user_lexical_index(user_id, db).score_all(query)
+    top = max(scores.values(), default=0.0)
+    if top <= 0:
+        return {}
+    return {emb_id: score / top for emb_id, score in scores.items()}
+
+
+def _rank_rows(
+    vm: VectorMatrix,
+    query_vector: np.ndarray,
+    rows: Optional[np.ndarray],
+    top_k: int,
+    lexical: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Pontua as linhas indicadas (todas se None) com similaridade + PersoScore
+    vetorizado e devolve o top-k como (linhas, similaridades, scores).
+    Com `lexical` (BM25 normalizado por linha), o PersoScore usa a fusão híbrida.
+    """
+    if rows is None:
+        similarities = vm.score(query_vector)
+        factors = vm.factors_for()
+        rows = np.arange(len(vm))
+    else:
+        similarities = vm.score(query_vector, rows)
+        factors = vm.factors_for(rows)
+    relevance = similarities
+    if lexical is not None:
+        relevance = _fuse_scores(similarities, lexical[rows])
+    scores = calculate_perso_scores(relevance, factors)
+
+    # Top-k via argpartition
+    local = _top_k_indices(scores, top_k)
+    return rows[local], similarities[local], scores[local]
+
+
+def _rerank_full_precision(
+    vm: VectorMatrix,
+    query_vector: np.ndarray,
+    rows: np.ndarray,
+    top_k: int,
+    lexical: Optional[np.ndarray],
+    db: Session
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Re-pontua a lista curta com os vetores float32 do banco (só essas linhas)"""
+    if not rows.size:
+        return rows, np.empty(0, dtype=np.float32), np.empty(0)
+    similarities = vm.score(query_vector, rows)
+    q = np.asarray(query_vector, dtype=np.float32)
+    q = q / (float(np.linalg.norm(q)) or 1.0)
+
+    position = {str(vm.ids[row]): i for i, row in enumerate(rows)}
+    for emb_id, vector_f32, vector in db.query(
+        models.Embedding.id,
+        models.Embedding.vector_f32,
+        models.Embedding.vector
+    ).filter(models.Embedding.id.in_([vm.ids[row] for row in rows])).all():
+        vec = _decode_vector(vector_f32, vector)
+        norm = float(np.linalg.norm(vec)) if vec is not None else 0.0
+        if norm > 0 and vec.shape[0] == q.shape[0]:
+            similarities[position[str(emb_id)]] = float(vec @ q) / norm
+
+    relevance = similarities if lexical is None else _fuse_scores(similarities, lexical[rows])
+    scores = calculate_perso_scores(relevance, vm.factors_for(rows))
+    local = _top_k_indices(scores, top_k)
+    return rows[local], similarities[local], scores[local]
+
+
+def _ann_candidate_rows(user_id: str, vm: VectorMatrix, query_vector: np.ndarray) -> Optional[np.ndarray]:
+    """Linhas candidatas via índice IVF; None para busca exata (corpus pequeno)"""
+    index = get_user_index(user_id, vm)
+    if index is None:
+        return None
+    q = np.asarray(query_vector, dtype=np.float32)
+    q_norm = float(np.linalg.norm(q))
+    if q_norm == 0.0 or q.shape[0] != vm.dim:
+        return None
+    return vm.rows_for(index.search(q / q_norm, ANN_NPROBE))
+
+
+def _fetch_embeddings(ids: List[Any], db: Session) -> Dict[Any, models.Embedding]:
+    """Linhas completas (texto/meta) dos ids informados, numa única consulta"""
+    if not ids:
+        return {}
+    return {
+        emb.id: emb
+        for emb in db.query(models.Embedding).filter(models.Embedding.id.in_(ids)).all()
+    }
+
+
+def _fetch_unit_vectors(ids: List[Any], db: Session) -> np.ndarray:
+    """Vetores normalizados dos ids (linhas nulas para pendentes ou de outra dimensão)"""
+    position = {str(emb_id): i for i, emb_id in enumerate(ids)}
+    decoded: Dict[int, np.ndarray] = {}
+    for emb_id, vector_f32, vector in db.query(
+        models.Embedding.id,
+        models.Embedding.vector_f32,
+        models.Embedding.vector
+    ).filter(models.Embedding.id.in_(ids)).all():
+        vec = _decode_vector(vector_f32, vector)
+        if vec is not None:
+            decoded[position[str(emb_id)]] = vec
+    dim = Counter(vec.shape[0] for vec in decoded.values()).most_common(1)
+    vectors = np.zeros((len(ids), dim[0][0] if dim else 0), dtype=np.float32)
+    for i, vec in decoded.items():
+        norm = float(np.linalg.norm(vec))
+        if norm > 0 and vec.shape[0] == vectors.shape[1]:
+            vectors[i] = vec / norm
+    return vectors
+
+
+def _diversify_rows(
+    vm: VectorMatrix,
+    rows: np.ndarray,
+    similarities: np.ndarray,
+    scores: np.ndarray,
+    top_k: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """MMR sobre a lista curta da matriz (vetores já em memória); top-k em ordem de seleção"""
+    if not mmr_enabled() or not rows.size:
+        return rows[:top_k], similarities[:top_k], scores[:top_k]
+    local = mmr_select(scores, vm.unit_vectors(rows), top_k, owners=vm.owner_ids[rows])
+    return rows[local], similarities[local], scores[local]
+
+
+def _result_owners(canonical: List[Tuple[Any, Any, Any]], db: Session) -> Dict[str, List[Dict[str, str]]]:
+    """
+    Owners de cada resultado: o da linha canônica seguido dos owners das
+    referências (quase-duplicatas em outras notas/fontes), numa única consulta.
+    canonical: (id, owner_type, owner_id) dos resultados.
+    """
+    owners = {
+        str(emb_id): [{"owner_type": owner_type, "owner_id": str(owner_id)}]
+        for emb_id, owner_type, owner_id in canonical
+    }
+    if not owners:
+        return owners
+    for canonical_id, owner_type, owner_id in db.query(
+        models.Embedding.canonical_id,
+        models.Embedding.owner_type,
+        models.Embedding.owner_id
+    ).filter(models.Embedding.canonical_id.in_([emb_id for emb_id, _, _ in canonical])).all():
+        entry = {"owner_type": owner_type, "owner_id": str(owner_id)}
+        if entry not in owners[str(canonical_id)]:
+            owners[str(canonical_id)].append(entry)
+    return owners
+
+
+def _materialize_results(
+    vm: VectorMatrix,
+    rows: np.ndarray,
+    similarities: np.ndarray,
+    scores: np.ndarray,
+    db: Session,
+    by_id: Optional[Dict[Any, models.Embedding]] = None
+) -> List[Dict[str, Any]]:
+    """Busca texto/meta apenas das linhas do top-k e monta o resultado"""
+    if not rows.size:
+        return []
+    if by_id is None:
+        by_id = _fetch_embeddings([vm.ids[i] for i in rows], db)
+
+    row_factors = vm.factors_for(rows)
+    top = [by_id[vm.ids[row]] for row in rows if vm.ids[row] in by_id]
+    owners = _result_owners([(emb.id, emb.owner_type, emb.owner_id) for emb in top], db)
+    results = []
+    for i, (row, similarity, score) in enumerate(zip(rows, similarities, scores)):
+        emb = by_id.get(vm.ids[row])
+        if emb is None:
+            continue
+        factors = {name: float(row_factors[name][i]) for name in PERSO_FACTOR_DEFAULTS}
+        factors["frequency"] = int(factors["frequency"])
+        results.append({
+            "chunk_text": emb.chunk_text,
+            "similarity": float(similarity),
+            "perso_score": float(score),
+            "owner_type": emb.owner_type,
+            "owner_id": str(emb.owner_id),
+            "owners": owners[str(emb.id)],
+            "meta": emb.meta or {},
+            "factors": factors
+        })
+    return results
+
+
+def _rerank_candidates(
+    rows: List[Dict[str, Any]],
+    similarities: np.ndarray,
+    top_k: int,
+    db: Session,
+    relevance: Optional[np.ndarray] = None
+) -> List[Dict[str, Any]]:
+    """
+    Re-ranking vetorizado com PersoScore (sobre `relevance`, se informada) de uma
+    lista curta; cada linha traz id, fatores armazenados e created_at
+    """
+    factors = _row_factors(rows)
+    scores = calculate_perso_scores(similarities if relevance is None else relevance, factors)
+
+    selected = _top_k_indices(scores, mmr_pool_size(top_k))
+    if mmr_enabled() and selected.size:
+        # Vetores só da lista curta, para o MMR
+        vectors = _fetch_unit_vectors([rows[i]["id"] for i in selected], db)
+        owners = np.asarray([str(rows[i]["owner_id"]) for i in selected])
+        selected = selected[mmr_select(scores[selected], vectors, top_k, owners=owners)]
+
+    owners = _result_owners([(rows[i]["id"], rows[i]["owner_type"], rows[i]["owner_id"]) for i in selected], db)
+    results = []
+    for i in selected:
+        row = rows[i]
+        row_factors = {name: float(factors[name][i]) for name in PERSO_FACTOR_DEFAULTS}
+        row_factors["frequency"] = int(row_factors["frequency"])
+        results.append({
+            "chunk_text": row["chunk_text"],
+            "similarity": float(similarities[i]),
+            "perso_score": float(scores[i]),
+            "owner_type": row["owner_type"],
+            "owner_id": str(row["owner_id"]),
+            "owners": owners[str(row["id"])],
+            "meta": row.get("meta") or {},
+            "factors": row_factors
+        })
+    return results
+
+
+def _retrieve_pgvector(
+    query_embedding: List[float],
+    user_id: str,
+    db: Session,
+    top_k: int,
+    discipline_id: Optional[str],
+    lexical: Optional[Dict[str, float]] = None
+) -> List[Dict[str, Any]]:
+    """Lista curta por distância no PostgreSQL + re-ranking vetorizado com PersoScore"""
+    rows = pgvector_search(
+        db,
+        user_id,
+        np.asarray(query_embedding, dtype=np.float32),
+        limit=top_k * PGVECTOR_CANDIDATE_FACTOR,
+        discipline_id=discipline_id,
+        model=get_embedding_provider().model,
+        include_legacy=get_embedding_provider().model == LEGACY_EMBEDDING_MODEL
+    )
+    if not rows:
+        return []
+
+    similarities = np.asarray([float(row["similarity"]) for row in rows])
+    relevance = None
+    if lexical is not None:
+        relevance = _fuse_scores(similarities, np.asarray([lexical.get(str(row["id"]), 0.0) for row in rows]))
+    return _rerank_candidates(rows, similarities, top_k, db, relevance)
+
+
+def _retrieve_lexical(
+    query: str,
+    user_id: str,
+    db: Session,
+    top_k: int,
+    discipline_id: Optional[str]
+) -> List[Dict[str, Any]]:
+    """
+    Caminho só-léxico: candidatos BM25 + PersoScore, sem embedding da query.
+    `similarity` nos resultados é o BM25 normalizado pelo melhor candidato.
+    """
+    hits = get_user_lexical_index(user_id, db).search(query, top_k * LEXICAL_CANDIDATE_FACTOR, discipline_id)
+    if not hits:
+        return []
+
+    top = hits[0][1]
+    by_id = {
+        str(emb.id): emb
+        for emb in db.query(models.Embedding).filter(
+            models.Embedding.id.in_([emb_id for emb_id, _ in hits])
+        ).all()
+    }
+    rows: List[Dict[str, Any]] = []
+    similarities: List[float] = []
+    for emb_id, score in hits:
+        emb = by_id.get(emb_id)
+        if emb is None:
+            continue
+        rows.append({
+            "id": emb.id,
+            "chunk_text": emb.chunk_text,
+            "owner_type": emb.owner_type,
+            "owner_id": emb.owner_id,
+            "meta": emb.meta,
+            **{name: getattr(emb, name) for name in _FACTOR_COLUMNS}
+        })
+        similarities.append(score / top)
+    return _rerank_candidates(rows, np.asarray(similarities), top_k, db)
+
+
 def retrieve_relevant_chunks(
     query: str, 
     user_id: str, 
@@ -183,73 +1461,161 @@ def retrieve_relevant_chunks(
     top_k: int = 5,
     discipline_id: Optional[str] = None
 ) -> List[Dict[str, Any]]:
-    """Recupera chunks mais relevantes usando RAG + PersoScore Avançado"""
-    
-    # Embedding da query
-    query_embedding = _get_embedding(query)
-    
-    # Buscar embeddings do usuário
-    filters = [models.Embedding.user_id == user_id]
+    """Recupera chunks mais relevantes usando RAG (vetorial/híbrido/léxico) + PersoScore Avançado"""
+    # Embedding da query; sem ele (modo léxico ou provedor lento/fora) o BM25 responde sozinho
+    query_embedding = None if RAG_RETRIEVAL_MODE == "lexical" else _get_query_embedding(query)
+    return _retrieve_with_embedding(query, query_embedding, str(user_id), db, top_k, discipline_id)
+
+
+async def retrieve_relevant_chunks_async(
+    query: str,
+    user_id: str,
+    db: Session,
+    top_k: int = 5,
+    discipline_id: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Versão async de retrieve_relevant_chunks: o embedding da query sai pelo
+    cliente HTTP async e a busca (banco + NumPy) roda numa thread
+    """
+    query_embedding = None if RAG_RETRIEVAL_MODE == "lexical" else await _get_query_embedding_async(query)
+    return await asyncio.to_thread(
+        _retrieve_with_embedding, query, query_embedding, str(user_id), db, top_k, discipline_id
+    )
+
+
+def _retrieve_with_embedding(
+    query: str,
+    query_embedding: Optional[List[float]],
+    user_id: str,
+    db: Session,
+    top_k: int,
+    discipline_id: Optional[str]
+) -> List[Dict[str, Any]]:
+    if query_embedding is None:
+        return _retrieve_lexical(query, user_id, db, top_k, discipline_id)
+
+    lexical = _normalized_lexical_scores(query, user_id, db) if RAG_RETRIEVAL_MODE == "hybrid" else None
+
+    # PostgreSQL com pgvector: filtro e ordenação ficam no banco
+    if pgvector_enabled(db):
+        return _retrieve_pgvector(query_embedding, user_id, db, top_k, discipline_id, lexical)
+
+    vm = get_user_vector_matrix(user_id, db)
+    if not len(vm):
+        # Nenhum vetor utilizável (ex.: todos pendentes): o texto ainda é buscável
+        return _retrieve_lexical(query, user_id, db, top_k, discipline_id) if lexical else []
+    lexical_rows = vm.dense_scores(lexical) if lexical is not None else None
+
+    # Filtrar por disciplina se especificado
+    rows: Optional[np.ndarray] = None
     if discipline_id:
-        # Filtrar por disciplina se especificado
-        filters.append(models.Embedding.owner_id.in_(
-            db.query(models.Note.id).filter(models.Note.discipline_id == discipline_id)
-        ))
-    
-    embeddings = db.query(models.Embedding).filter(*filters).all()
-    
-    if not embeddings:
+        rows = _discipline_rows(vm, discipline_id)
+        if not rows.size:
+            return []
+
+    # Corpora grandes: candidatos do índice ANN (+ acertos léxicos), re-ranqueados com PersoScore
+    candidates = _ann_candidate_rows(user_id, vm, query_embedding)
+    if candidates is not None:
+        if lexical_rows is not None:
+            candidates = np.union1d(candidates, np.flatnonzero(lexical_rows))
+        narrowed = candidates if rows is None else np.intersect1d(rows, candidates)
+        if narrowed.size >= top_k:
+            rows = narrowed
+
+    # Com MMR, o ranking produz uma lista curta maior que é diversificada no fim
+    pool = mmr_pool_size(top_k)
+
+    # Corpora grandes: lista curta pelo prefixo, re-ranqueada abaixo com todas as dimensões
+    shortlist = _prefix_shortlist(user_id, vm, query_embedding, rows, pool, lexical_rows)
+    if shortlist is not None:
+        rows = shortlist
+
+    # Similaridade (um produto matriz-vetor) + BM25 opcional + PersoScore vetorizado
+    if vm.quantization != "none" and VECTOR_RERANK_FACTOR > 1:
+        # Matriz quantizada: lista curta aproximada, re-ranqueada em float32
+        shortlist, _, _ = _rank_rows(vm, query_embedding, rows, pool * VECTOR_RERANK_FACTOR, lexical_rows)
+        top_rows, similarities, scores = _rerank_full_precision(
+            vm, query_embedding, shortlist, pool, lexical_rows, db
+        )
+    else:
+        top_rows, similarities, scores = _rank_rows(vm, query_embedding, rows, pool, lexical_rows)
+    top_rows, similarities, scores = _diversify_rows(vm, top_rows, similarities, scores, top_k)
+    return _materialize_results(vm, top_rows, similarities, scores, db)
+
+
+def retrieve_relevant_chunks_batch(
+    queries: List[str],
+    user_id: str,
+    db: Session,
+    top_k: int = 5,
+    discipline_id: Optional[str] = None
+) -> List[List[Dict[str, Any]]]:
+    """
+    Recupera chunks para várias queries de uma vez: embeddings numa única
+    requisição, similaridade de todas contra a matriz do usuário num único
+    produto matriz-matriz e top-k por query (mesmo PersoScore da busca individual).
+    """
+    user_id = str(user_id)
+    if not queries:
         return []
-    
-    # Calcular similaridades e PersoScore avançado
-    results = []
-    for emb in embeddings:
-        try:
-            vector = json.loads(emb.vector) if emb.vector else []
-            if not vector:
-                continue
-                
-            similarity = cosine_similarity([query_embedding], [vector])[0][0]
-            
-            # Extrair metadados para PersoScore avançado
-            meta = emb.meta or {}
-            strength = meta.get("strength", 0.5)
-            recency = meta.get("recency", 1.0)
-            success_rate = meta.get("success_rate", 0.5)
-            frequency = meta.get("frequency", 1)
-            concept_affinity = meta.get("concept_affinity", 0.5)
-            
-            # Calcular PersoScore avançado
-            perso_score = calculate_advanced_perso_score(
-                similarity=similarity,
-                strength=strength,
-                recency=recency,
-                success_rate=success_rate,
-                frequency=frequency,
-                concept_affinity=concept_affinity
-            )
-            
-            results.append({
-                "chunk_text": emb.chunk_text,
-                "similarity": float(similarity),
-                "perso_score": float(perso_score),
-                "owner_type": emb.owner_type,
-                "owner_id": str(emb.owner_id),
-                "meta": meta,
-                "factors": {
-                    "strength": strength,
-                    "recency": recency,
-                    "success_rate": success_rate,
-                    "frequency": frequency,
-                    "concept_affinity": concept_affinity
-                }
-            })
-        except Exception:
-            continue
-    
-    # Ordenar por PersoScore e retornar top-k
-    results.sort(key=lambda x: x["perso_score"], reverse=True)
-    return results[:top_k]
+    if RAG_RETRIEVAL_MODE == "lexical":
+        return [_retrieve_lexical(query, user_id, db, top_k, discipline_id) for query in queries]
+
+    hybrid = RAG_RETRIEVAL_MODE == "hybrid"
+    query_embeddings = _get_query_embeddings(queries)
+    lexical = [_normalized_lexical_scores(query, user_id, db) if hybrid else None for query in queries]
+    results: List[Optional[List[Dict[str, Any]]]] = [None] * len(queries)
+
+    # Queries sem embedding (provedor lento/fora) seguem pelo BM25, como na busca individual
+    for i, embedding in enumerate(query_embeddings):
+        if embedding is None:
+            results[i] = _retrieve_lexical(queries[i], user_id, db, top_k, discipline_id)
+    batch = [i for i, result in enumerate(results) if result is None]
+    if not batch:
+        return results
+
+    # PostgreSQL com pgvector: a ordenação por query fica no banco (índice HNSW)
+    if pgvector_enabled(db):
+        for i in batch:
+            results[i] = _retrieve_pgvector(query_embeddings[i], user_id, db, top_k, discipline_id, lexical[i])
+        return results
+
+    vm = get_user_vector_matrix(user_id, db)
+    rows = _discipline_rows(vm, discipline_id) if discipline_id else np.arange(len(vm))
+    if not rows.size:
+        for i in batch:
+            empty_corpus = not len(vm) and lexical[i]
+            results[i] = _retrieve_lexical(queries[i], user_id, db, top_k, discipline_id) if empty_corpus else []
+        return results
+
+    # (linhas, queries): uma única multiplicação de matrizes para o lote inteiro
+    similarities = vm.score_many(np.asarray([query_embeddings[i] for i in batch], dtype=np.float32), rows)
+    lexical_dense = [vm.dense_scores(lexical[i]) for i in batch] if hybrid else None
+    relevance = similarities
+    if lexical_dense is not None:
+        relevance = _fuse_scores(similarities, np.column_stack([dense[rows] for dense in lexical_dense]))
+    # Os fatores do PersoScore não dependem da query: personalização calculada uma vez
+    scores = relevance * calculate_perso_scores(np.ones(rows.size), vm.factors_for(rows))[:, None]
+
+    quantized = vm.quantization != "none" and VECTOR_RERANK_FACTOR > 1
+    pool = mmr_pool_size(top_k)
+    selections = []
+    for col, i in enumerate(batch):
+        local = _top_k_indices(scores[:, col], pool * VECTOR_RERANK_FACTOR if quantized else pool)
+        if quantized:
+            # Matriz quantizada: lista curta aproximada, re-ranqueada em float32
+            lexical_rows = lexical_dense[col] if lexical_dense is not None else None
+            selection = _rerank_full_precision(vm, query_embeddings[i], rows[local], pool, lexical_rows, db)
+        else:
+            selection = (rows[local], similarities[local, col], scores[local, col])
+        selections.append(_diversify_rows(vm, *selection, top_k))
+
+    # Texto/meta de todos os top-k numa única consulta
+    by_id = _fetch_embeddings([vm.ids[row] for top_rows, _, _ in selections for row in top_rows], db)
+    for i, (top_rows, top_similarities, top_scores) in zip(batch, selections):
+        results[i] = _materialize_results(vm, top_rows, top_similarities, top_scores, db, by_id)
+    return results
 
 
 def update_concept_strength(
@@ -258,22 +1624,5 @@ def update_concept_strength(
     strength_delta: float, 
     db: Session
 ) -> None:
-    """Atualiza força de um conceito baseado em interação"""
-    stat = db.query(models.UserConceptStat).filter(
-        models.UserConceptStat.user_id == user_id,
-        models.UserConceptStat.concept == concept
-    ).first()
-    
-    if stat:
-        current_strength = stat.strength or 0.5
-        new_strength = max(0.0, min(1.0, current_strength + strength_delta))
-        stat.strength = new_strength
-    else:
-        stat = models.UserConceptStat(
-            user_id=user_id,
-            concept=concept,
-            strength=max(0.0, min(1.0, 0.5 + strength_delta))
-        )
-        db.add(stat)
-    
-    db.commit()
+    """Atualiza força de um conceito baseado em interação (vários: update_concept_strengths)"""
+    update_concept_strengths(user_id, {concept: strength_delta}, db)
@@ -9,6 +9,7 @@ import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity
 
 from .embeddings import _get_embedding
+from .embedding_providers import get_embedding_provider
 from .openai_client import call_openai_api_simple
 from ..utils import _clean_text
 
@@ -182,7 +183,9 @@ def postprocess_open_questions(
         q["answer_json"] = {
             "model_answer": model_answer,
             "key_concepts": key_concepts,
-            "reference_embedding": json.dumps(embedding),
+            # Sem provedor disponível a referência é gerada na avaliação
+            "reference_embedding": json.dumps(embedding) if embedding is not None else None,
+            "embedding_model": get_embedding_provider().model,
             "similarity_threshold": thresholds.get(difficulty, 0.70),
             "meta": {
                 "difficulty": difficulty,
@@ -206,6 +209,8 @@ def evaluate_open_answer_semantic(
     """
     # Gerar embedding da resposta do aluno
     student_embedding = _get_embedding(student_answer)
+    if student_embedding is None:
+        raise RuntimeError("Provedor de embeddings indisponível")
     
     # Calcular similaridade
     similarity = float(cosine_similarity(
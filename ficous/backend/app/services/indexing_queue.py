@@ -0,0 +1,349 @@
+"""
+Fila de indexação em background (embeddings do RAG).
+
+Salvar uma nota só grava um job em ficous_indexing_jobs; um pool de workers
+em processo consome os jobs com sessão própria. Jobs repetidos do mesmo owner
+são coalescidos e falhas são re-tentadas com backoff exponencial.
+"""
+import os
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, Optional
+
+from sqlalchemy import and_, exists
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, aliased
+
+from .. import database, models
+from .embeddings import index_note_content, index_source_content, count_pending_embeddings
+from .embedding_cache import maintain_embedding_cache
+from .ann_index import flush_user_indexes
+
+logger = logging.getLogger(__name__)
+
+# background = pool de workers; inline = processa na própria requisição (scripts/testes)
+INDEXING_MODE = os.getenv("INDEXING_MODE", "background").lower()
+# 0 = sem pool em processo: jobs ficam na fila até process_indexing_jobs ser chamado
+INDEXING_WORKERS = int(os.getenv("INDEXING_WORKERS", "2"))
+INDEXING_MAX_ATTEMPTS = int(os.getenv("INDEXING_MAX_ATTEMPTS", "5"))
+# Backoff: base * 2^(tentativa-1), limitado ao máximo (segundos)
+INDEXING_RETRY_BASE_DELAY = float(os.getenv("INDEXING_RETRY_BASE_DELAY", "5"))
+INDEXING_RETRY_MAX_DELAY = float(os.getenv("INDEXING_RETRY_MAX_DELAY", "300"))
+# Lease de um job running: o worker renova updated_at (heartbeat) a cada terço do
+# lease; só jobs sem heartbeat há mais que isso (processo caiu) voltam para pending
+INDEXING_LEASE_SECONDS = float(os.getenv("INDEXING_LEASE_SECONDS", "300"))
+
+JOB_STATUSES = ("pending", "running", "done", "failed")
+
+_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _retry_delay(attempts: int) -> float:
+    return min(INDEXING_RETRY_MAX_DELAY, INDEXING_RETRY_BASE_DELAY * 2 ** max(0, attempts - 1))
+
+
+def enqueue_indexing(user_id: Any, owner_type: str, owner_id: Any, db: Session) -> models.IndexingJob:
+    """
+    Agenda a (re)indexação de uma nota/fonte. Se já houver job pendente para o
+    mesmo owner ele é reaproveitado (e antecipado), em vez de duplicado.
+    """
+    job = db.query(models.IndexingJob).filter(
+        models.IndexingJob.owner_type == owner_type,
+        models.IndexingJob.owner_id == owner_id,
+        models.IndexingJob.status == "pending"
+    ).first()
+    if job is not None:
+        job.attempts = 0
+        job.next_run_at = _now()
+    else:
+        job = models.IndexingJob(
+            user_id=user_id,
+            owner_type=owner_type,
+            owner_id=owner_id,
+            status="pending",
+            attempts=0,
+            next_run_at=_now()
+        )
+        db.add(job)
+    db.commit()
+    db.refresh(job)
+
+    if INDEXING_MODE == "inline":
+        # Só o job desta requisição; o resto da fila (outros usuários) fica para os workers
+        process_indexing_jobs(db, job_id=job.id)
+    else:
+        _kick()
+    return job
+
+
+def _claim_next_job(db: Session, job_id: Optional[Any] = None) -> Optional[models.IndexingJob]:
+    """
+    Marca como running o próximo job vencido (um owner nunca roda em dois
+    workers); com `job_id`, só tenta aquele job
+    """
+    running = aliased(models.IndexingJob)
+    owner_busy = exists().where(and_(
+        running.owner_type == models.IndexingJob.owner_type,
+        running.owner_id == models.IndexingJob.owner_id,
+        running.status == "running"
+    ))
+    query = db.query(models.IndexingJob.id).filter(
+        models.IndexingJob.status == "pending",
+        models.IndexingJob.next_run_at <= _now(),
+        ~owner_busy
+    )
+    if job_id is not None:
+        query = query.filter(models.IndexingJob.id == job_id)
+    candidates = query.order_by(models.IndexingJob.next_run_at).limit(INDEXING_WORKERS + 1).all()
+
+    for (candidate_id,) in candidates:
+        # UPDATE condicional: só um worker vence a disputa pelo mesmo job; o índice
+        # único de running por owner barra outro job (ou a reindexação em massa) do mesmo owner
+        try:
+            claimed = db.query(models.IndexingJob).filter(
+                models.IndexingJob.id == candidate_id,
+                models.IndexingJob.status == "pending"
+            ).update({"status": "running", "updated_at": _now()}, synchronize_session=False)
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            continue
+        if claimed:
+            return db.query(models.IndexingJob).filter(models.IndexingJob.id == candidate_id).first()
+    return None
+
+
+def claim_owner(user_id: Any, owner_type: str, owner_id: Any, db: Session) -> Optional[models.IndexingJob]:
+    """
+    Reivindica o owner para indexação fora da fila (reindexação em massa) com
+    um job running; None se um worker já está indexando o mesmo owner
+    """
+    job = models.IndexingJob(
+        user_id=user_id,
+        owner_type=owner_type,
+        owner_id=owner_id,
+        status="running",
+        attempts=0,
+        next_run_at=_now(),
+        updated_at=_now()
+    )
+    db.add(job)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return None
+    return job
+
+
+def release_owner(job: models.IndexingJob, db: Session, error: Optional[Exception] = None) -> None:
+    """Encerra o job de claim_owner (done/failed); jobs pending do owner seguem na fila"""
+    job.attempts = (job.attempts or 0) + 1
+    job.status = "done" if error is None else "failed"
+    job.last_error = None if error is None else str(error)[:1000]
+    job.updated_at = _now()
+    if error is None:
+        _prune_history(job, db)
+    db.commit()
+
+
+def _prune_history(job: models.IndexingJob, db: Session) -> None:
+    """Histórico: só o último job concluído/falho de cada owner"""
+    db.query(models.IndexingJob).filter(
+        models.IndexingJob.owner_type == job.owner_type,
+        models.IndexingJob.owner_id == job.owner_id,
+        models.IndexingJob.status.in_(("done", "failed")),
+        models.IndexingJob.id != job.id
+    ).delete(synchronize_session=False)
+
+
+@contextmanager
+def lease_heartbeat(model: Any, row_id: Any, lease_seconds: float) -> Iterator[None]:
+    """
+    Renova updated_at da linha (status running) numa thread com sessão própria
+    enquanto o bloco roda, para a recuperação não tomar um trabalho ainda vivo
+    """
+    stop = threading.Event()
+
+    def beat() -> None:
+        while not stop.wait(lease_seconds / 3):
+            db = database.SessionLocal()
+            try:
+                db.query(model).filter(
+                    model.id == row_id,
+                    model.status == "running"
+                ).update({"updated_at": _now()}, synchronize_session=False)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                logger.warning(f"Heartbeat de {model.__tablename__} {row_id} falhou: {e}")
+            finally:
+                db.close()
+
+    thread = threading.Thread(target=beat, name="ficous-lease", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _run_job(job: models.IndexingJob, db: Session) -> int:
+    """Indexa o owner do job; chunks sem vetor contam como falha (provedor indisponível)"""
+    if job.owner_type == "note":
+        owner = db.query(models.Note).filter(models.Note.id == job.owner_id).first()
+        indexer = index_note_content
+    elif job.owner_type == "source":
+        owner = db.query(models.Source).filter(models.Source.id == job.owner_id).first()
+        indexer = index_source_content
+    else:
+        raise ValueError(f"Tipo de owner não indexável: {job.owner_type}")
+    if owner is None:
+        return 0  # excluído antes da indexação: nada a fazer
+
+    indexed = indexer(owner, db)
+    pending = count_pending_embeddings(db, user_id=job.user_id, owner_id=job.owner_id)
+    if pending:
+        raise RuntimeError(f"{pending} chunks sem embedding")
+    return indexed
+
+
+def _finish_job(job: models.IndexingJob, db: Session, error: Optional[Exception]) -> None:
+    job.attempts = (job.attempts or 0) + 1
+    if error is None:
+        job.status = "done"
+        job.last_error = None
+        _prune_history(job, db)
+    elif job.attempts >= INDEXING_MAX_ATTEMPTS:
+        job.status = "failed"
+        job.last_error = str(error)[:1000]
+    else:
+        delay = _retry_delay(job.attempts)
+        job.status = "pending"
+        job.last_error = str(error)[:1000]
+        job.next_run_at = _now() + timedelta(seconds=delay)
+        if INDEXING_MODE != "inline":
+            timer = threading.Timer(delay, _kick)
+            timer.daemon = True
+            timer.start()
+    job.updated_at = _now()
+    db.commit()
+
+
+def process_indexing_jobs(db: Session, limit: Optional[int] = None, job_id: Optional[Any] = None) -> int:
+    """
+    Consome jobs vencidos até a fila esvaziar (ou `limit`); com `job_id`, só
+    aquele job. Retorna quantos rodaram
+    """
+    if job_id is not None:
+        limit = 1
+    else:
+        _release_expired_jobs(db)
+    processed = 0
+    while limit is None or processed < limit:
+        job = _claim_next_job(db, job_id)
+        if job is None:
+            break
+        error: Optional[Exception] = None
+        try:
+            with lease_heartbeat(models.IndexingJob, job.id, INDEXING_LEASE_SECONDS):
+                _run_job(job, db)
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"Falha ao indexar {job.owner_type} {job.owner_id}: {e}")
+            error = e
+        _finish_job(job, db, error)
+        # Acertos/evicção do cache de embeddings depois do commit, fora da indexação
+        maintain_embedding_cache(db)
+        processed += 1
+    if processed:
+        # Snapshots dos índices ANN alterados pela indexação (fora das requisições)
+        flush_user_indexes()
+    return processed
+
+
+def _worker() -> None:
+    db = database.SessionLocal()
+    try:
+        process_indexing_jobs(db)
+    except Exception as e:
+        logger.error(f"Erro no worker de indexação: {e}")
+    finally:
+        db.close()
+
+
+def _kick() -> None:
+    """Acorda um worker do pool (cria o pool na primeira chamada)"""
+    global _executor
+    if INDEXING_WORKERS <= 0:
+        return
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=INDEXING_WORKERS,
+                thread_name_prefix="ficous-indexing"
+            )
+        _executor.submit(_worker)
+
+
+def _release_expired_jobs(db: Session) -> int:
+    """Jobs running cujo lease expirou (worker/processo caiu) voltam para pending"""
+    expired = db.query(models.IndexingJob).filter(
+        models.IndexingJob.status == "running",
+        models.IndexingJob.updated_at < _now() - timedelta(seconds=INDEXING_LEASE_SECONDS)
+    ).update({"status": "pending", "next_run_at": _now()}, synchronize_session=False)
+    db.commit()
+    return expired
+
+
+def recover_indexing_jobs(db: Session) -> int:
+    """
+    Na subida do processo: jobs running com lease expirado (processo caiu no
+    meio) voltam para pending e a fila é retomada. Jobs com heartbeat recente
+    pertencem a outro processo vivo e ficam como estão.
+    """
+    recovered = _release_expired_jobs(db)
+    has_pending = db.query(models.IndexingJob.id).filter(models.IndexingJob.status == "pending").first()
+    if has_pending is not None and INDEXING_MODE != "inline":
+        _kick()
+    return recovered
+
+
+def get_indexing_status(db: Session, user_id: Any) -> Dict[str, Any]:
+    """Contagem de jobs por status, no total e por owner"""
+    jobs = db.query(models.IndexingJob).filter(
+        models.IndexingJob.user_id == user_id
+    ).order_by(models.IndexingJob.created_at).all()
+
+    totals = {status: 0 for status in JOB_STATUSES}
+    owners: Dict[str, Dict[str, Any]] = {}
+    for job in jobs:
+        totals[job.status] = totals.get(job.status, 0) + 1
+        key = f"{job.owner_type}:{job.owner_id}"
+        entry = owners.get(key)
+        if entry is None:
+            entry = owners[key] = {
+                "owner_type": job.owner_type,
+                "owner_id": str(job.owner_id),
+                **{status: 0 for status in JOB_STATUSES},
+                "attempts": 0,
+                "last_error": None,
+                "next_run_at": None,
+                "updated_at": None
+            }
+        entry[job.status] = entry.get(job.status, 0) + 1
+        entry["attempts"] = job.attempts
+        entry["last_error"] = job.last_error
+        entry["next_run_at"] = job.next_run_at.isoformat() if job.status == "pending" and job.next_run_at else None
+        entry["updated_at"] = job.updated_at.isoformat() if job.updated_at else None
+
+    return {"totals": totals, "owners": list(owners.values())}
@@ -0,0 +1,247 @@
+"""
+Índice invertido BM25 (em memória, por usuário) sobre os chunks indexados.
+
+Gera candidatos sem chamar o provedor de embeddings: é a base do modo
+híbrido (fusão léxico + vetorial) e do caminho só-léxico usado quando o
+embedding da query está lento ou indisponível.
+"""
+import os
+import re
+import math
+import time
+import heapq
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import List, Dict, Optional, Iterable, Tuple, Any
+from sqlalchemy.orm import Session
+
+from .. import models
+from .embedding_providers import _STOPWORDS
+from .vector_cache import get_corpus_version
+
+# Parâmetros clássicos do BM25
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+LEXICAL_INDEX_MAX_USERS = int(os.getenv("LEXICAL_INDEX_MAX_USERS", "64"))
+# Reconstrução periódica do índice (rede de segurança contra deriva das atualizações incrementais)
+LEXICAL_INDEX_TTL_SECONDS = int(os.getenv("LEXICAL_INDEX_TTL_SECONDS", "3600"))
+
+# Mesma classe de caracteres de extract_key_topics (letras acentuadas fazem parte da palavra)
+_WORD_RE = re.compile(r"[0-9A-Za-zÀ-ÖØ-öø-ÿ]{2,}")
+
+_lock = threading.Lock()
+_indexes: "OrderedDict[str, BM25Index]" = OrderedDict()
+_stats = {"builds": 0, "hits": 0, "incremental_updates": 0}
+
+
+def _fold(word: str) -> str:
+    """Minúsculas sem acentos ("Fotossíntese" -> "fotossintese")"""
+    decomposed = unicodedata.normalize("NFKD", word.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(text: str) -> List[str]:
+    """Termos indexáveis: palavras sem acento, minúsculas e sem stopwords"""
+    terms = (_fold(word) for word in _WORD_RE.findall(text or ""))
+    return [term for term in terms if term not in _STOPWORDS]
+
+
+class BM25Index:
+    """
+    Listas invertidas termo -> {doc_id: tf} com comprimentos por documento.
+    Leitura e escrita passam pelo lock do índice: a indexação atualiza o
+    índice em threads de worker enquanto requisições pontuam sobre ele.
+    """
+
+    def __init__(self, version: int = 0):
+        self._lock = threading.RLock()
+        self.version = version
+        self.built_at = time.time()
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.doc_lengths: Dict[str, int] = {}
+        self.doc_terms: Dict[str, Tuple[str, ...]] = {}
+        self.doc_owners: Dict[str, str] = {}
+        self.doc_disciplines: Dict[str, str] = {}
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self.doc_lengths)
+
+    def term_count(self) -> int:
+        with self._lock:
+            return len(self.postings)
+
+    def add(self, doc_id: Any, owner_id: Any, text: str, discipline_id: Optional[Any] = None) -> None:
+        """Indexa (ou reindexa) um chunk"""
+        key = str(doc_id)
+        counts = Counter(tokenize(text))
+        length = sum(counts.values())
+        with self._lock:
+            if key in self.doc_lengths:
+                self.remove([key])
+            for term, tf in counts.items():
+                self.postings.setdefault(term, {})[key] = tf
+            self.doc_lengths[key] = length
+            self.doc_terms[key] = tuple(counts)
+            self.doc_owners[key] = str(owner_id)
+            self.doc_disciplines[key] = str(discipline_id) if discipline_id is not None else ""
+            self.total_length += length
+
+    def remove(self, doc_ids: Iterable[Any]) -> None:
+        with self._lock:
+            for doc_id in doc_ids:
+                key = str(doc_id)
+                length = self.doc_lengths.pop(key, None)
+                if length is None:
+                    continue
+                self.total_length -= length
+                self.doc_owners.pop(key, None)
+                self.doc_disciplines.pop(key, None)
+                for term in self.doc_terms.pop(key, ()):
+                    docs = self.postings.get(term)
+                    if docs is not None:
+                        docs.pop(key, None)
+                        if not docs:
+                            del self.postings[term]
+
+    def set_owner_discipline(self, owner_id: Any, discipline_id: Optional[Any]) -> None:
+        owner = str(owner_id)
+        value = str(discipline_id) if discipline_id is not None else ""
+        with self._lock:
+            for key, doc_owner in self.doc_owners.items():
+                if doc_owner == owner:
+                    self.doc_disciplines[key] = value
+
+    def score_all(self, query: str) -> Dict[str, float]:
+        """Score BM25 de cada documento que contém algum termo da query"""
+        terms = set(tokenize(query))
+        with self._lock:
+            n_docs = len(self.doc_lengths)
+            if not n_docs:
+                return {}
+            avg_length = self.total_length / n_docs or 1.0
+            scores: Dict[str, float] = {}
+            for term in terms:
+                docs = self.postings.get(term)
+                if not docs:
+                    continue
+                idf = math.log(1.0 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                for key, tf in docs.items():
+                    norm = BM25_K1 * (1.0 - BM25_B + BM25_B * self.doc_lengths[key] / avg_length)
+                    scores[key] = scores.get(key, 0.0) + idf * tf * (BM25_K1 + 1.0) / (tf + norm)
+            return scores
+
+    def search(
+        self,
+        query: str,
+        limit: int,
+        discipline_id: Optional[Any] = None
+    ) -> List[Tuple[str, float]]:
+        """Top-`limit` (doc_id, score), opcionalmente restrito a uma disciplina"""
+        with self._lock:
+            scores = self.score_all(query)
+            if discipline_id is not None:
+                wanted = str(discipline_id)
+                scores = {k: s for k, s in scores.items() if self.doc_disciplines.get(k) == wanted}
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+
+def _build_index(user_id: str, version: int, db: Session) -> BM25Index:
+    index = BM25Index(version)
+    rows = db.query(
+        models.Embedding.id,
+        models.Embedding.owner_id,
+        models.Embedding.chunk_text,
+        models.Embedding.discipline_id
+    ).filter(
+        models.Embedding.user_id == user_id,
+        models.Embedding.canonical_id.is_(None)  # quase-duplicatas respondem pela linha canônica
+    ).all()
+    for emb_id, owner_id, chunk_text, discipline_id in rows:
+        index.add(emb_id, owner_id, chunk_text or "", discipline_id)
+    return index
+
+
+def get_user_lexical_index(user_id: str, db: Session) -> BM25Index:
+    """Índice do usuário, reconstruído quando a versão do corpus mudou ou o TTL venceu"""
+    key = str(user_id)
+    version = get_corpus_version(key)
+    with _lock:
+        index = _indexes.get(key)
+        if (
+            index is not None
+            and index.version == version
+            and time.time() - index.built_at < LEXICAL_INDEX_TTL_SECONDS
+        ):
+            _indexes.move_to_end(key)
+            _stats["hits"] += 1
+            return index
+
+    index = _build_index(key, version, db)
+    with _lock:
+        _indexes[key] = index
+        _indexes.move_to_end(key)
+        _stats["builds"] += 1
+        while len(_indexes) > LEXICAL_INDEX_MAX_USERS:
+            _indexes.popitem(last=False)
+    return index
+
+
+def update_lexical_index(
+    user_id: str,
+    added: List[Tuple[Any, Any, str, Optional[Any]]],
+    removed_ids: List[Any]
+) -> None:
+    """
+    Atualização incremental após indexação (só se o usuário já tiver índice).
+    Chamar depois de bump_corpus_version: o índice passa a valer para a nova versão.
+    """
+    key = str(user_id)
+    with _lock:
+        index = _indexes.get(key)
+        if index is None:
+            return
+        index.remove(removed_ids)
+        for doc_id, owner_id, text, discipline_id in added:
+            index.add(doc_id, owner_id, text, discipline_id)
+        index.version = get_corpus_version(key)
+        _stats["incremental_updates"] += 1
+
+
+def bump_lexical_version(user_id: str) -> None:
+    """Acompanha uma nova versão do corpus em que o texto não mudou (ex.: só vetores regravados)"""
+    key = str(user_id)
+    with _lock:
+        index = _indexes.get(key)
+        if index is not None:
+            index.version = get_corpus_version(key)
+
+
+def update_lexical_owner_discipline(user_id: str, owner_id: Any, discipline_id: Optional[Any]) -> None:
+    """Acompanha a mudança de disciplina de uma nota/fonte sem reconstruir o índice"""
+    key = str(user_id)
+    with _lock:
+        index = _indexes.get(key)
+        if index is None:
+            return
+        index.set_owner_discipline(owner_id, discipline_id)
+        index.version = get_corpus_version(key)
+
+
+def get_lexical_index_stats() -> Dict[str, Any]:
+    """Estatísticas dos índices léxicos em memória"""
+    with _lock:
+        return {
+            "users": len(_indexes),
+            "documents": sum(len(index) for index in _indexes.values()),
+            "terms": sum(index.term_count() for index in _indexes.values()),
+            **_stats
+        }
+
+
+def clear_lexical_index() -> None:
+    """Descarta todos os índices léxicos"""
+    with _lock:
+        _indexes.clear()
@@ -1,32 +1,183 @@
 """
-Cliente OpenAI para chamadas simples
+Cliente OpenAI: pool HTTP compartilhado pelo processo e chamadas simples.
+
+Todas as chamadas à API (Sage, summaries, exercises, circuit breaker,
+embeddings) passam pelo mesmo httpx.Client, que mantém as conexões vivas
+(keep-alive e HTTP/2 opcional) em vez de pagar DNS + TCP + TLS a cada chamada.
+As rotas async usam o httpx.AsyncClient equivalente (mesmos limites), sem
+ocupar uma thread do threadpool enquanto esperam a resposta.
 """
 import os
+import asyncio
+import weakref
+import threading
 import httpx
-from typing import Optional
+from typing import Any, Dict, Optional
 
+OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1").rstrip("/")
+# Timeouts padrão em segundos (cada chamada pode passar o seu total)
+OPENAI_HTTP_TIMEOUT = float(os.getenv("OPENAI_HTTP_TIMEOUT", "30"))
+OPENAI_HTTP_CONNECT_TIMEOUT = float(os.getenv("OPENAI_HTTP_CONNECT_TIMEOUT", "10"))
+# Limites do pool: conexões simultâneas e conexões ociosas mantidas vivas
+OPENAI_HTTP_MAX_CONNECTIONS = int(os.getenv("OPENAI_HTTP_MAX_CONNECTIONS", "100"))
+OPENAI_HTTP_MAX_KEEPALIVE = int(os.getenv("OPENAI_HTTP_MAX_KEEPALIVE", "20"))
+OPENAI_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_HTTP_KEEPALIVE_EXPIRY", "30"))
+# HTTP/2 (multiplexa requisições numa conexão); exige o pacote h2
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "false").lower() == "true"
 
-def call_openai_api_simple(system_prompt: str, user_prompt: str, model: str = "gpt-4o-mini") -> str:
-    """Função helper para chamadas simples da OpenAI API"""
-    api_key = os.getenv("OPENAI_API_KEY")
+_lock = threading.Lock()
+_client: Optional[httpx.Client] = None
+# AsyncClient fica preso ao event loop em que foi criado: um por loop, liberado
+# junto com o loop (sem sobrescrever o cliente de outro loop ainda vivo)
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _timeout(total: Optional[float] = None) -> httpx.Timeout:
+    return httpx.Timeout(total or OPENAI_HTTP_TIMEOUT, connect=OPENAI_HTTP_CONNECT_TIMEOUT)
+
+
+def _pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=OPENAI_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=OPENAI_HTTP_KEEPALIVE_EXPIRY
+    )
+
+
+def get_http_client() -> httpx.Client:
+    """Cliente compartilhado (criado na primeira chamada; thread-safe)"""
+    global _client
+    if _client is None or _client.is_closed:
+        with _lock:
+            if _client is None or _client.is_closed:
+                _client = httpx.Client(
+                    timeout=_timeout(),
+                    limits=_pool_limits(),
+                    http2=OPENAI_HTTP2 and _http2_available()
+                )
+    return _client
+
+
+def close_http_client() -> None:
+    """Fecha o pool (shutdown da aplicação)"""
+    global _client
+    with _lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """AsyncClient compartilhado do event loop atual (um por loop)"""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_clients.get(loop)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                timeout=_timeout(),
+                limits=_pool_limits(),
+                http2=OPENAI_HTTP2 and _http2_available()
+            )
+            _async_clients[loop] = client
+    return client
+
+
+async def aclose_async_http_client() -> None:
+    """Fecha o pool async do loop atual (shutdown da aplicação)"""
+    with _lock:
+        client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def _request_args(path: str, payload: Dict[str, Any], api_key: Optional[str], timeout: Optional[float]):
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
     if not api_key:
-        return "API key não configurada"
-    
-    payload = {
+        raise ValueError("OPENAI_API_KEY não configurada")
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+    return f"{OPENAI_API_BASE}{path}", {"json": payload, "headers": headers, "timeout": _timeout(timeout)}
+
+
+def _chat_payload(system_prompt: str, user_prompt: str, model: str, temperature: float) -> Dict[str, Any]:
+    return {
         "model": model,
         "messages": [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
         ],
-        "temperature": 0.2
+        "temperature": temperature
     }
-    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
-    
+
+
+def post_openai(
+    path: str,
+    payload: Dict[str, Any],
+    api_key: Optional[str] = None,
+    timeout: Optional[float] = None
+) -> Dict[str, Any]:
+    """POST na API OpenAI pelo pool; levanta httpx.HTTPError/ValueError em falha"""
+    url, kwargs = _request_args(path, payload, api_key, timeout)
+    resp = get_http_client().post(url, **kwargs)
+    resp.raise_for_status()
+    return resp.json()
+
+
+async def apost_openai(
+    path: str,
+    payload: Dict[str, Any],
+    api_key: Optional[str] = None,
+    timeout: Optional[float] = None
+) -> Dict[str, Any]:
+    """Versão async de post_openai"""
+    url, kwargs = _request_args(path, payload, api_key, timeout)
+    resp = await get_async_http_client().post(url, **kwargs)
+    resp.raise_for_status()
+    return resp.json()
+
+
+def chat_completion(
+    system_prompt: str,
+    user_prompt: str,
+    model: str = "gpt-4o-mini",
+    temperature: float = 0.2,
+    timeout: Optional[float] = None,
+    api_key: Optional[str] = None
+) -> str:
+    """Conteúdo da primeira escolha de /chat/completions"""
+    payload = _chat_payload(system_prompt, user_prompt, model, temperature)
+    data = post_openai("/chat/completions", payload, api_key=api_key, timeout=timeout)
+    return data["choices"][0]["message"]["content"]
+
+
+async def achat_completion(
+    system_prompt: str,
+    user_prompt: str,
+    model: str = "gpt-4o-mini",
+    temperature: float = 0.2,
+    timeout: Optional[float] = None,
+    api_key: Optional[str] = None
+) -> str:
+    """Versão async de chat_completion"""
+    payload = _chat_payload(system_prompt, user_prompt, model, temperature)
+    data = await apost_openai("/chat/completions", payload, api_key=api_key, timeout=timeout)
+    return data["choices"][0]["message"]["content"]
+
+
+def call_openai_api_simple(system_prompt: str, user_prompt: str, model: str = "gpt-4o-mini") -> str:
+    """Função helper para chamadas simples da OpenAI API"""
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        return "API key não configurada"
+
     try:
-        with httpx.Client(timeout=30) as client:
-            resp = client.post("https://api.openai.com/v1/chat/completions", json=payload, headers=headers)
-            resp.raise_for_status()
-            data = resp.json()
-            return data["choices"][0]["message"]["content"]
+        return chat_completion(system_prompt, user_prompt, model=model, api_key=api_key)
     except Exception as e:
         return f"Erro na API OpenAI: {e}"
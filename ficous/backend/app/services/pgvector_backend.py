@@ -0,0 +1,139 @@
+"""
+Backend de recuperação via pgvector (somente PostgreSQL).
+
+Quando a extensão `vector` e a coluna `ficous_embeddings.embedding_pgv`
+existem (ver migration 006), filtro e ordenação por distância de cosseno
+rodam no banco com índice HNSW; o PersoScore re-ranqueia a lista curta.
+Em SQLite (ou sem a extensão) o caminho NumPy continua sendo usado.
+
+O índice HNSW é único para todos os usuários e o filtro (usuário/disciplina)
+é aplicado depois da varredura: só os `ef_search` vizinhos globais passam por
+ele. Com pgvector >= 0.8 a varredura iterativa continua até completar o
+limite; em versões antigas, se a varredura devolveu menos linhas do que uma
+contagem limitada do escopo prova existir, a busca é refeita exata.
+"""
+import os
+import re
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+# auto: usa pgvector se disponível | numpy: nunca usa | pgvector: sempre (se disponível)
+RAG_BACKEND = os.getenv("RAG_BACKEND", "auto").lower()
+# Candidatos buscados no banco por resultado final (para o re-ranking com PersoScore)
+PGVECTOR_CANDIDATE_FACTOR = int(os.getenv("PGVECTOR_CANDIDATE_FACTOR", "10"))
+PGVECTOR_EF_SEARCH = int(os.getenv("PGVECTOR_EF_SEARCH", "100"))
+
+_availability: Dict[str, bool] = {}
+_iterative_scan: Dict[str, bool] = {}
+
+
+def _engine_key(db: Session) -> str:
+    return str(db.get_bind().url)
+
+
+def pgvector_enabled(db: Session) -> bool:
+    """True se o banco é PostgreSQL com a extensão e a coluna pgvector prontas"""
+    if RAG_BACKEND == "numpy":
+        return False
+    bind = db.get_bind()
+    if bind.dialect.name != "postgresql":
+        return False
+    key = _engine_key(db)
+    if key not in _availability:
+        try:
+            has_column = db.execute(text(
+                "SELECT 1 FROM information_schema.columns "
+                "WHERE table_name = 'ficous_embeddings' AND column_name = 'embedding_pgv'"
+            )).first() is not None
+            has_extension = db.execute(text(
+                "SELECT 1 FROM pg_extension WHERE extname = 'vector'"
+            )).first() is not None
+            _availability[key] = has_column and has_extension
+        except Exception:
+            db.rollback()
+            _availability[key] = False
+    return _availability[key]
+
+
+def _supports_iterative_scan(db: Session) -> bool:
+    """pgvector >= 0.8 (hnsw.iterative_scan)"""
+    key = _engine_key(db)
+    if key not in _iterative_scan:
+        try:
+            row = db.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).first()
+            version = tuple(int(part) for part in re.findall(r"\d+", row[0])[:2]) if row else (0, 0)
+            _iterative_scan[key] = version >= (0, 8)
+        except Exception:
+            _iterative_scan[key] = False
+    return _iterative_scan[key]
+
+
+def to_vector_literal(vector: np.ndarray) -> str:
+    """Formato textual aceito por `CAST(... AS vector)`"""
+    return "[" + ",".join(f"{float(x):.7g}" for x in vector) + "]"
+
+
+def store_vectors(db: Session, vectors: List[Tuple[Any, np.ndarray]]) -> None:
+    """Grava a coluna pgvector das linhas recém-inseridas (mesma transação do chamador)"""
+    if not vectors:
+        return
+    db.flush()
+    db.execute(
+        text("UPDATE ficous_embeddings SET embedding_pgv = CAST(:vec AS vector) WHERE id = :id"),
+        [{"id": emb_id, "vec": to_vector_literal(vec)} for emb_id, vec in vectors]
+    )
+
+
+def search(
+    db: Session,
+    user_id: str,
+    query_vector: np.ndarray,
+    limit: int,
+    discipline_id: Optional[str] = None,
+    model: Optional[str] = None,
+    include_legacy: bool = True
+) -> List[Dict[str, Any]]:
+    """Top-`limit` por distância de cosseno, filtrado por usuário/disciplina/modelo no SQL"""
+    where = "WHERE user_id = :user_id AND embedding_pgv IS NOT NULL "
+    params: Dict[str, Any] = {
+        "q": to_vector_literal(query_vector),
+        "user_id": str(user_id),
+        "limit": int(limit)
+    }
+    if model:
+        where += "AND (embedding_model = :model" + (" OR embedding_model IS NULL) " if include_legacy else ") ")
+        params["model"] = model
+    if discipline_id:
+        where += "AND discipline_id = :discipline_id "
+        params["discipline_id"] = str(discipline_id)
+    sql = (
+        "SELECT id, owner_type, owner_id, chunk_text, meta, "
+        "strength, success_rate, frequency, concept_affinity, created_at, "
+        "1 - (embedding_pgv <=> CAST(:q AS vector)) AS similarity "
+        "FROM ficous_embeddings " + where +
+        "ORDER BY embedding_pgv <=> CAST(:q AS vector) LIMIT :limit"
+    )
+
+    # Recall do HNSW por consulta (escopo da transação)
+    db.execute(text(f"SET LOCAL hnsw.ef_search = {max(int(limit), PGVECTOR_EF_SEARCH)}"))
+    if _supports_iterative_scan(db):
+        # Segue varrendo o grafo até `limit` linhas passarem no filtro
+        db.execute(text("SET LOCAL hnsw.iterative_scan = relaxed_order"))
+    rows = db.execute(text(sql), params).mappings().all()
+    if len(rows) < limit and _count_scoped(db, where, params) > len(rows):
+        # Usuário minoritário: os vizinhos globais eram de outros usuários. Sem index
+        # scan o HNSW sai do plano (ele não faz bitmap scan) e sobra o bitmap scan
+        # no btree de user_id + ordenação exata das linhas do usuário
+        db.execute(text("SET LOCAL enable_indexscan = off"))
+        rows = db.execute(text(sql), params).mappings().all()
+        db.execute(text("SET LOCAL enable_indexscan = on"))
+    # relaxed_order pode devolver fora de ordem
+    return sorted((dict(row) for row in rows), key=lambda row: row["similarity"], reverse=True)
+
+
+def _count_scoped(db: Session, where: str, params: Dict[str, Any]) -> int:
+    """Linhas do escopo da busca, contadas até `limit` (barato: btree de user_id)"""
+    count_sql = f"SELECT count(*) FROM (SELECT 1 FROM ficous_embeddings {where}LIMIT :limit) AS scoped"
+    return int(db.execute(text(count_sql), params).scalar() or 0)
@@ -0,0 +1,109 @@
+"""
+Quantização das matrizes de vetores do RAG (float16 ou int8 com escala por vetor).
+
+A primeira etapa pontua sobre a matriz quantizada (2x/4x menos memória que
+float32); os melhores candidatos podem ser re-ranqueados em precisão total.
+"""
+import os
+import time
+from typing import Dict, Any, Optional, Tuple
+import numpy as np
+
+# none | float16 | int8
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none").lower()
+# Candidatos re-ranqueados em float32 por resultado final (1 = sem re-ranking)
+VECTOR_RERANK_FACTOR = int(os.getenv("VECTOR_RERANK_FACTOR", "4"))
+# Linhas convertidas para float32 por vez ao pontuar (limita memória temporária)
+QUANTIZED_SCORE_BLOCK = 16384
+
+QUANTIZATION_MODES = ("none", "float16", "int8")
+
+
+def quantize(matrix: np.ndarray, mode: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Quantiza uma matriz float32 (linhas normalizadas).
+    Retorna (matriz, escalas); escalas só existem no int8 (valor real = int8 * escala).
+    """
+    if mode == "float16":
+        return matrix.astype(np.float16), None
+    if mode == "int8":
+        if not matrix.size:
+            return matrix.astype(np.int8), np.empty(0, dtype=np.float32)
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales = np.where(scales == 0, 1.0, scales).astype(np.float32)
+        quantized = np.rint(matrix / scales[:, None]).astype(np.int8)
+        return quantized, scales
+    return matrix, None
+
+
+def dequantize(matrix: np.ndarray, scales: Optional[np.ndarray]) -> np.ndarray:
+    """Volta para float32 (aproximado no float16/int8)"""
+    dense = matrix.astype(np.float32)
+    if scales is not None:
+        dense *= scales[:, None]
+    return dense
+
+
+def score_matrix(
+    matrix: np.ndarray,
+    query: np.ndarray,
+    scales: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Produto matriz-vetor (query 1-D) ou matriz-matriz (query (dim, n), uma
+    coluna por query) sobre matriz float32/float16/int8, convertendo em blocos
+    """
+    if matrix.dtype == np.float32:
+        return matrix @ query
+    out = np.empty((matrix.shape[0],) + query.shape[1:], dtype=np.float32)
+    for start in range(0, matrix.shape[0], QUANTIZED_SCORE_BLOCK):
+        block = matrix[start:start + QUANTIZED_SCORE_BLOCK].astype(np.float32)
+        out[start:start + QUANTIZED_SCORE_BLOCK] = block @ query
+    if scales is not None:
+        out *= scales.reshape((-1,) + (1,) * (query.ndim - 1))
+    return out
+
+
+def measure_recall(
+    matrix: np.ndarray,
+    queries: np.ndarray,
+    k: int = 10,
+    modes: Tuple[str, ...] = ("float16", "int8"),
+    rerank_factor: int = VECTOR_RERANK_FACTOR
+) -> Dict[str, Any]:
+    """
+    Benchmark: recall@k de cada modo contra a busca exata em float32, com e sem
+    re-ranking dos `k * rerank_factor` melhores candidatos. Linhas e queries
+    devem estar normalizadas.
+    """
+    k = max(1, min(k, matrix.shape[0]))
+    baseline = [set(np.argsort(-(matrix @ q))[:k].tolist()) for q in queries]
+    report: Dict[str, Any] = {
+        "rows": int(matrix.shape[0]),
+        "dim": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+        "queries": int(len(queries)),
+        "k": k,
+        "rerank_factor": rerank_factor,
+        "modes": {}
+    }
+    for mode in modes:
+        quantized, scales = quantize(matrix, mode)
+        shortlist = min(matrix.shape[0], k * max(1, rerank_factor))
+        hits = hits_reranked = 0
+        started = time.perf_counter()
+        for q, expected in zip(queries, baseline):
+            approx = score_matrix(quantized, q.astype(np.float32), scales)
+            top = np.argsort(-approx)[:shortlist]
+            hits += len(expected & set(top[:k].tolist()))
+            exact = matrix[top] @ q
+            hits_reranked += len(expected & set(top[np.argsort(-exact)[:k]].tolist()))
+        elapsed = time.perf_counter() - started
+        total = k * max(1, len(queries))
+        report["modes"][mode] = {
+            "bytes": int(quantized.nbytes + (scales.nbytes if scales is not None else 0)),
+            "recall": hits / total,
+            "recall_reranked": hits_reranked / total,
+            "ms_per_query": 1000 * elapsed / max(1, len(queries))
+        }
+    report["float32_bytes"] = int(matrix.astype(np.float32).nbytes)
+    return report
@@ -0,0 +1,126 @@
+"""
+Cache LRU + TTL dos embeddings de query do RAG (texto normalizado + modelo).
+
+Perguntas repetidas no /sage/answer e no /admin/dry-run não voltam ao
+provedor. O cache em memória é por processo; com
+QUERY_EMBEDDING_CACHE_BACKEND=redis os vetores também são compartilhados entre
+workers via Redis (float32 empacotado).
+"""
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, List, Dict, Any, Tuple
+import numpy as np
+import redis
+
+QUERY_EMBEDDING_CACHE_ENABLED = os.getenv("QUERY_EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+QUERY_EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_EMBEDDING_CACHE_MAX_ENTRIES", "2048"))
+QUERY_EMBEDDING_CACHE_TTL = int(os.getenv("QUERY_EMBEDDING_CACHE_TTL_SECONDS", "3600"))
+# memory | redis (Redis como segundo nível, compartilhado entre workers)
+QUERY_EMBEDDING_CACHE_BACKEND = os.getenv("QUERY_EMBEDDING_CACHE_BACKEND", "memory").lower()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+_VECTOR_DTYPE = np.dtype("<f4")
+
+_lock = threading.Lock()
+# chave -> (vetor float32 empacotado, timestamp) em ordem LRU
+_entries: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+_stats = {"hits": 0, "misses": 0, "redis_hits": 0, "evictions": 0}
+
+
+def normalize_query(query: str) -> str:
+    """Caixa e espaços não mudam a pergunta ("  O que é  POO?" == "o que é poo?")"""
+    return " ".join((query or "").split()).lower()
+
+
+def _cache_key(query: str, model: str) -> str:
+    return hashlib.sha256(f"{model}|{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+
+def _get_redis_client() -> Optional[redis.Redis]:
+    if QUERY_EMBEDDING_CACHE_BACKEND != "redis":
+        return None
+    try:
+        return redis.from_url(REDIS_URL)  # binário: vetores empacotados
+    except Exception:
+        return None
+
+
+def _store_local(key: str, packed: bytes) -> None:
+    with _lock:
+        _entries.pop(key, None)
+        _entries[key] = (packed, time.time())
+        while len(_entries) > QUERY_EMBEDDING_CACHE_MAX_ENTRIES:
+            _entries.popitem(last=False)
+            _stats["evictions"] += 1
+
+
+def get_cached_query_embedding(query: str, model: str) -> Optional[List[float]]:
+    """Embedding em cache para a query normalizada no modelo informado"""
+    if not QUERY_EMBEDDING_CACHE_ENABLED:
+        return None
+    key = _cache_key(query, model)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            if time.time() - entry[1] < QUERY_EMBEDDING_CACHE_TTL:
+                _entries.move_to_end(key)
+                _stats["hits"] += 1
+                return np.frombuffer(entry[0], dtype=_VECTOR_DTYPE).tolist()
+            del _entries[key]
+
+    redis_client = _get_redis_client()
+    if redis_client:
+        try:
+            packed = redis_client.get(f"query_embedding:{key}")
+            if packed:
+                _store_local(key, packed)
+                with _lock:
+                    _stats["hits"] += 1
+                    _stats["redis_hits"] += 1
+                return np.frombuffer(packed, dtype=_VECTOR_DTYPE).tolist()
+        except Exception:
+            pass
+
+    with _lock:
+        _stats["misses"] += 1
+    return None
+
+
+def set_cached_query_embedding(query: str, model: str, embedding: List[float]) -> None:
+    """Guarda o embedding da query (memória e, se configurado, Redis)"""
+    if not QUERY_EMBEDDING_CACHE_ENABLED or not embedding:
+        return
+    key = _cache_key(query, model)
+    packed = np.asarray(embedding, dtype=_VECTOR_DTYPE).tobytes()
+    _store_local(key, packed)
+
+    redis_client = _get_redis_client()
+    if redis_client:
+        try:
+            redis_client.setex(f"query_embedding:{key}", QUERY_EMBEDDING_CACHE_TTL, packed)
+        except Exception:
+            pass
+
+
+def get_query_embedding_cache_stats() -> Dict[str, Any]:
+    """Estatísticas do cache de embeddings de query"""
+    with _lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return {
+            "enabled": QUERY_EMBEDDING_CACHE_ENABLED,
+            "backend": QUERY_EMBEDDING_CACHE_BACKEND,
+            "entries": len(_entries),
+            "max_entries": QUERY_EMBEDDING_CACHE_MAX_ENTRIES,
+            "ttl_seconds": QUERY_EMBEDDING_CACHE_TTL,
+            "hit_rate": (_stats["hits"] / lookups) if lookups else 0.0,
+            **_stats
+        }
+
+
+def clear_query_embedding_cache() -> None:
+    """Limpa o cache de embeddings de query (memória)"""
+    with _lock:
+        _entries.clear()
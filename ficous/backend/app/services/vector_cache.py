@@ -0,0 +1,117 @@
+"""
+Cache em memória (por processo) das matrizes de vetores por usuário para o RAG
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional, Any, Dict, Tuple
+
+# Configurações do cache de matrizes (matriz completa e prefixo contam como entradas separadas)
+VECTOR_CACHE_MAX_USERS = int(os.getenv("VECTOR_CACHE_MAX_USERS", "64"))
+VECTOR_CACHE_MAX_MB = int(os.getenv("VECTOR_CACHE_MAX_MB", "256"))
+# Outros workers não enxergam o bump de versão; o TTL limita a defasagem entre processos
+VECTOR_CACHE_TTL = int(os.getenv("VECTOR_CACHE_TTL_SECONDS", "120"))
+
+_lock = threading.Lock()
+# (user_id, kind) -> {"version", "value", "nbytes", "timestamp"} em ordem LRU
+# kind: "matrix" (matriz completa) ou variantes derivadas, ex. "prefix256"
+_entries: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+_versions: Dict[str, int] = {}
+_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+_total_bytes = 0
+
+
+def _max_bytes() -> int:
+    return VECTOR_CACHE_MAX_MB * 1024 * 1024
+
+
+def _drop(key: Tuple[str, str]) -> None:
+    global _total_bytes
+    entry = _entries.pop(key, None)
+    if entry is not None:
+        _total_bytes -= entry["nbytes"]
+
+
+def get_corpus_version(user_id: str) -> int:
+    """Versão atual do corpus de embeddings do usuário"""
+    with _lock:
+        return _versions.get(str(user_id), 0)
+
+
+def bump_corpus_version(user_id: str) -> int:
+    """Invalida a matriz em cache do usuário (chamar após indexar/remover conteúdo)"""
+    key = str(user_id)
+    with _lock:
+        version = _versions.get(key, 0) + 1
+        _versions[key] = version
+        for entry_key in [k for k in _entries if k[0] == key]:
+            _drop(entry_key)
+            _stats["invalidations"] += 1
+        return version
+
+
+def get_cached_matrix(user_id: str, kind: str = "matrix") -> Optional[Any]:
+    """Retorna a matriz em cache se a versão e o TTL ainda forem válidos"""
+    key = (str(user_id), kind)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            _stats["misses"] += 1
+            return None
+        expired = time.time() - entry["timestamp"] >= VECTOR_CACHE_TTL
+        if expired or entry["version"] != _versions.get(key[0], 0):
+            _drop(key)
+            _stats["misses"] += 1
+            return None
+        _entries.move_to_end(key)
+        _stats["hits"] += 1
+        return entry["value"]
+
+
+def set_cached_matrix(user_id: str, version: int, value: Any, nbytes: int, kind: str = "matrix") -> None:
+    """Armazena a matriz construída na versão informada, respeitando limites de memória"""
+    global _total_bytes
+    key = (str(user_id), kind)
+    with _lock:
+        if version != _versions.get(key[0], 0):
+            return  # corpus mudou durante a construção
+        if nbytes > _max_bytes():
+            return  # maior que o cache inteiro: não vale a pena guardar
+        _drop(key)
+        _entries[key] = {
+            "version": version,
+            "value": value,
+            "nbytes": nbytes,
+            "timestamp": time.time()
+        }
+        _total_bytes += nbytes
+
+        # Evicção LRU por quantidade e por memória
+        while _entries and (len(_entries) > VECTOR_CACHE_MAX_USERS or _total_bytes > _max_bytes()):
+            oldest = next(iter(_entries))
+            _drop(oldest)
+            _stats["evictions"] += 1
+
+
+def get_vector_cache_stats() -> Dict[str, Any]:
+    """Retorna estatísticas do cache de matrizes"""
+    with _lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return {
+            "entries": len(_entries),
+            "max_entries": VECTOR_CACHE_MAX_USERS,
+            "memory_bytes": _total_bytes,
+            "max_memory_bytes": _max_bytes(),
+            "ttl_seconds": VECTOR_CACHE_TTL,
+            "hit_rate": (_stats["hits"] / lookups) if lookups else 0.0,
+            **_stats
+        }
+
+
+def clear_vector_cache() -> None:
+    """Limpa o cache de matrizes"""
+    global _total_bytes
+    with _lock:
+        _entries.clear()
+        _total_bytes = 0
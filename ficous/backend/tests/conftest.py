@@ -15,6 +15,7 @@ os.environ["SAGE_AUTO_PROCESS"] = "false"  # Desabilitar para testes unitários
 os.environ["ADMIN_ENABLED"] = "true"
 os.environ["OPENAI_API_KEY"] = "test-key"
 os.environ["DATABASE_URL"] = "sqlite:///:memory:"  # Forçar SQLite
+os.environ["INDEXING_WORKERS"] = "0"  # Sem threads de indexação na conexão SQLite compartilhada
 
 # Database de teste em memória (SQLite)
 SQLALCHEMY_TEST_DATABASE_URL = "sqlite:///:memory:"
@@ -34,12 +35,20 @@ db_module.SessionLocal = TestingSessionLocal
 from ficous.backend.app.main import app
 from ficous.backend.app.database import Base, get_db
 from ficous.backend.app import models
+from ficous.backend.app.services.vector_cache import clear_vector_cache
+from ficous.backend.app.services.lexical_index import clear_lexical_index
+from ficous.backend.app.services.query_embedding_cache import clear_query_embedding_cache
+from ficous.backend.app.services.embeddings import _query_breaker
 
 
 @pytest.fixture(scope="function")
 def db_session():
     """Cria uma sessão de banco para cada teste"""
     Base.metadata.create_all(bind=engine)
+    clear_vector_cache()  # matrizes em cache não sobrevivem ao drop do banco
+    clear_lexical_index()
+    clear_query_embedding_cache()
+    _query_breaker.record_success()  # circuito do embedding da query começa fechado
     db = TestingSessionLocal()
     try:
         yield db
@@ -129,9 +138,11 @@ def sample_embedding(db_session, default_user_id, sample_note):
         user_id=default_user_id,
         owner_type="note",
         owner_id=sample_note.id,
+        discipline_id=sample_note.discipline_id,
         chunk_text="Polimorfismo permite que objetos sejam tratados de forma uniforme.",
         vector=json.dumps(np.random.rand(1536).tolist()),
-        meta={"concept_tags": ["polimorfismo"], "strength": 0.5, "recency": 1.0}
+        strength=0.5,
+        meta={"concept_tags": ["polimorfismo"]}
     )
     db_session.add(embedding)
     db_session.commit()
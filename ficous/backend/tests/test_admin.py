@@ -47,10 +47,10 @@ def test_recompute_stats(client, sample_note, db_session):
 
 def test_index_content_notes(client, sample_note):
     """Testa indexação de notas"""
-    with patch("ficous.backend.app.routers.admin.index_note_content") as mock:
+    with patch("ficous.backend.app.services.bulk_reindex.index_note_content") as mock:
         mock.return_value = 3  # 3 chunks
         
-        response = client.post("/ficous/admin/index-content?content_type=notes")
+        response = client.post("/ficous/admin/index-content?content_type=notes&wait=true")
         
         assert response.status_code == 200
         data = response.json()
@@ -71,12 +71,12 @@ def test_index_content_all(client, sample_note, db_session):
     db_session.add(source)
     db_session.commit()
     
-    with patch("ficous.backend.app.routers.admin.index_note_content") as mock_note:
+    with patch("ficous.backend.app.services.bulk_reindex.index_note_content") as mock_note:
         mock_note.return_value = 2
-        with patch("ficous.backend.app.routers.admin.index_source_content") as mock_source:
+        with patch("ficous.backend.app.services.bulk_reindex.index_source_content") as mock_source:
             mock_source.return_value = 1
             
-            response = client.post("/ficous/admin/index-content?content_type=all")
+            response = client.post("/ficous/admin/index-content?content_type=all&wait=true")
             
             assert response.status_code == 200
             data = response.json()
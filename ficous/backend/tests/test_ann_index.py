@@ -0,0 +1,165 @@
+"""
+Testes para o índice ANN (IVF) do RAG
+"""
+import pytest
+import numpy as np
+from unittest.mock import patch
+from ficous.backend.app import models
+from ficous.backend.app.services import ann_index
+from ficous.backend.app.services.ann_index import IVFIndex, drop_user_index
+from ficous.backend.app.services.embeddings import _pack_vector, retrieve_relevant_chunks
+
+
+def _clustered_vectors(n=2000, dim=32, clusters=20, seed=1):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    labels = rng.integers(0, clusters, n)
+    vectors = centers[labels] + 0.3 * rng.normal(size=(n, dim))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32)
+
+
+def test_ivf_recall_against_exact():
+    """Testa recall@10 do IVF contra a busca exata"""
+    vectors = _clustered_vectors()
+    ids = [str(i) for i in range(len(vectors))]
+    index = IVFIndex.train(vectors, ids, n_lists=32)
+
+    rng = np.random.default_rng(2)
+    recalls = []
+    for q in vectors[rng.choice(len(vectors), 20, replace=False)]:
+        exact = set(np.argsort(-(vectors @ q))[:10].tolist())
+        candidates = [int(c) for c in index.search(q, nprobe=4)]
+        found = set(np.asarray(candidates)[np.argsort(-(vectors[candidates] @ q))[:10]].tolist())
+        recalls.append(len(exact & found) / 10)
+
+    assert np.mean(recalls) >= 0.9
+    # nprobe menor que o total de listas reduz o trabalho
+    assert len(index.search(vectors[0], nprobe=4)) < len(vectors)
+
+
+def test_ivf_add_remove_and_roundtrip(tmp_path):
+    """Testa atualização incremental e serialização em disco"""
+    vectors = _clustered_vectors(n=300)
+    ids = [f"id-{i}" for i in range(300)]
+    index = IVFIndex.train(vectors[:200], ids[:200], n_lists=8)
+
+    index.add(ids[200:], vectors[200:])
+    index.remove(ids[:50])
+    assert len(index) == 250
+
+    path = str(tmp_path / "user.npz")
+    index.save(path)
+    loaded = IVFIndex.load(path)
+
+    assert len(loaded) == 250
+    assert "id-0" not in loaded.assignments
+    assert np.allclose(loaded.centroids, index.centroids)
+    assert sorted(loaded.search(vectors[250], nprobe=8)) == sorted(index.search(vectors[250], nprobe=8))
+
+
+def test_retrieve_uses_ann_above_threshold(db_session, default_user_id, sample_note, tmp_path, monkeypatch):
+    """Testa que a busca usa o índice acima do limiar e mantém o re-ranking"""
+    monkeypatch.setattr(ann_index, "ANN_MIN_VECTORS", 50)
+    monkeypatch.setattr(ann_index, "ANN_INDEX_DIR", str(tmp_path))
+
+    vectors = _clustered_vectors(n=200, dim=1536, clusters=8)
+    for i, vec in enumerate(vectors):
+        db_session.add(models.Embedding(
+            user_id=default_user_id,
+            owner_type="note",
+            owner_id=sample_note.id,
+            chunk_text=f"chunk {i}",
+            vector_f32=_pack_vector(vec.tolist()),
+            strength=0.5,
+            meta={}
+        ))
+    db_session.commit()
+
+    try:
+        with patch("ficous.backend.app.services.embeddings._get_embedding") as mock_emb:
+            mock_emb.return_value = vectors[7].tolist()
+            chunks = retrieve_relevant_chunks("consulta", str(default_user_id), db_session, top_k=3)
+
+        assert chunks[0]["chunk_text"] == "chunk 7"
+        assert (tmp_path / f"{default_user_id}.npz").exists()
+    finally:
+        drop_user_index(str(default_user_id))
+
+
+class _Matrix:
+    """VectorMatrix mínima (ids + matriz normalizada)"""
+
+    def __init__(self, ids, matrix):
+        self.ids = ids
+        self.matrix = matrix
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def dim(self):
+        return self.matrix.shape[1]
+
+
+def test_user_index_syncs_same_size_corpus_change(tmp_path, monkeypatch):
+    """Testa que trocar um chunk por outro (mesmo tamanho) sincroniza o índice"""
+    monkeypatch.setattr(ann_index, "ANN_MIN_VECTORS", 10)
+    monkeypatch.setattr(ann_index, "ANN_INDEX_DIR", str(tmp_path))
+    vectors = _clustered_vectors(n=301)
+    ids = [f"id-{i}" for i in range(301)]
+    try:
+        first = ann_index.get_user_index("u1", _Matrix(ids[:300], vectors[:300]))
+        replaced = _Matrix(ids[1:], vectors[1:])
+        index = ann_index.get_user_index("u1", replaced)
+
+        assert index is first
+        assert "id-0" not in index.assignments
+        assert "id-300" in index.assignments
+        assert ann_index.get_user_index("u1", replaced) is index
+    finally:
+        drop_user_index("u1")
+
+
+def test_user_index_trains_outside_global_lock(tmp_path, monkeypatch):
+    """Testa que o k-means roda sem segurar o lock global"""
+    monkeypatch.setattr(ann_index, "ANN_MIN_VECTORS", 10)
+    monkeypatch.setattr(ann_index, "ANN_INDEX_DIR", str(tmp_path))
+    original = IVFIndex.train.__func__
+    held = []
+
+    def train(cls, matrix, ids, *args, **kwargs):
+        held.append(ann_index._lock.locked())
+        return original(cls, matrix, ids, *args, **kwargs)
+
+    vectors = _clustered_vectors(n=300)
+    try:
+        with patch.object(IVFIndex, "train", classmethod(train)):
+            index = ann_index.get_user_index("u2", _Matrix([str(i) for i in range(300)], vectors))
+    finally:
+        drop_user_index("u2")
+
+    assert held == [False]
+    assert len(index) == 300
+
+
+def test_update_user_index_defers_snapshot_to_flush(tmp_path, monkeypatch):
+    """Testa que a atualização incremental não grava em disco até o flush"""
+    monkeypatch.setattr(ann_index, "ANN_MIN_VECTORS", 10)
+    monkeypatch.setattr(ann_index, "ANN_INDEX_DIR", str(tmp_path))
+    vectors = _clustered_vectors(n=301)
+    path = tmp_path / "u3.npz"
+    try:
+        ann_index.get_user_index("u3", _Matrix([f"id-{i}" for i in range(300)], vectors[:300]))
+        written = path.stat().st_mtime_ns
+
+        ann_index.update_user_index("u3", added=[("id-300", vectors[300])], removed_ids=["id-0"])
+
+        assert path.stat().st_mtime_ns == written
+        assert ann_index.flush_user_indexes() == 1
+        loaded = IVFIndex.load(str(path))
+        assert "id-300" in loaded.assignments
+        assert "id-0" not in loaded.assignments
+        assert ann_index.flush_user_indexes() == 0
+    finally:
+        drop_user_index("u3")
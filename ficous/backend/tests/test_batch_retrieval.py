@@ -0,0 +1,135 @@
+"""
+Testes para a recuperação em lote (várias queries, um produto matriz-matriz)
+"""
+import uuid
+import numpy as np
+import pytest
+from unittest.mock import patch
+
+from ficous.backend.app import models
+from ficous.backend.app.services import embeddings, diversification
+from ficous.backend.app.services.vector_cache import clear_vector_cache
+
+
+TOPICS = ["polimorfismo", "herança", "encapsulamento", "abstração", "interfaces", "recursão"]
+
+
+@pytest.fixture
+def seeded_vectors(db_session, default_user_id, sample_note):
+    rng = np.random.default_rng(3)
+    vectors = rng.standard_normal((60, 1536)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    for i, vec in enumerate(vectors):
+        db_session.add(models.Embedding(
+            id=uuid.uuid4(),
+            user_id=default_user_id,
+            owner_type="note",
+            owner_id=sample_note.id,
+            discipline_id=sample_note.discipline_id,
+            chunk_text=f"chunk {i} sobre {TOPICS[i % len(TOPICS)]}",
+            vector_f32=embeddings._pack_vector(vec),
+            strength=0.2 + (i % 5) / 10,
+            meta={}
+        ))
+    db_session.commit()
+    return vectors
+
+
+def _query_vectors(vectors):
+    return {
+        "polimorfismo": (vectors[4] + 0.3 * vectors[9]).tolist(),
+        "herança": (vectors[21] + 0.2 * vectors[2]).tolist(),
+        "recursão": vectors[35].tolist()
+    }
+
+
+def _individual(queries, user_id, db_session, by_query):
+    with patch("ficous.backend.app.services.embeddings._get_embedding") as mock_query:
+        mock_query.side_effect = lambda text, timeout=None: by_query[text]
+        return [embeddings.retrieve_relevant_chunks(q, user_id, db_session, top_k=4) for q in queries]
+
+
+@pytest.mark.parametrize("mode", ["vector", "hybrid"])
+def test_batch_matches_individual_retrieval(db_session, default_user_id, seeded_vectors, monkeypatch, mode):
+    """Testa que o lote devolve o mesmo top-k e scores da busca query a query"""
+    monkeypatch.setattr(embeddings, "RAG_RETRIEVAL_MODE", mode)
+    by_query = _query_vectors(seeded_vectors)
+    queries = list(by_query)
+    user = str(default_user_id)
+
+    expected = _individual(queries, user, db_session, by_query)
+    with patch("ficous.backend.app.services.embeddings._embed_queries") as mock_batch:
+        mock_batch.side_effect = lambda texts: [by_query[t] for t in texts]
+        batch = embeddings.retrieve_relevant_chunks_batch(queries, user, db_session, top_k=4)
+
+    assert [[c["chunk_text"] for c in r] for r in batch] == [[c["chunk_text"] for c in r] for r in expected]
+    for got, want in zip(batch, expected):
+        assert [c["perso_score"] for c in got] == pytest.approx([c["perso_score"] for c in want], abs=1e-6)
+
+
+def test_batch_embeds_distinct_queries_in_one_request(db_session, default_user_id, seeded_vectors):
+    """Testa uma única chamada ao provedor, sem repetir queries equivalentes"""
+    by_query = _query_vectors(seeded_vectors)
+    queries = ["polimorfismo", "herança", "  Polimorfismo "]
+
+    with patch("ficous.backend.app.services.embeddings._embed_queries") as mock_batch:
+        mock_batch.side_effect = lambda texts: [by_query[t.strip().lower()] for t in texts]
+        results = embeddings.retrieve_relevant_chunks_batch(queries, str(default_user_id), db_session, top_k=2)
+
+    assert mock_batch.call_count == 1
+    assert mock_batch.call_args[0][0] == ["polimorfismo", "herança"]
+    assert [c["chunk_text"] for c in results[2]] == [c["chunk_text"] for c in results[0]]
+
+
+def test_batch_falls_back_to_lexical_per_query(db_session, default_user_id, seeded_vectors):
+    """Testa que uma query sem embedding segue pelo BM25 sem derrubar o lote"""
+    by_query = _query_vectors(seeded_vectors)
+
+    with patch("ficous.backend.app.services.embeddings._embed_queries") as mock_batch:
+        mock_batch.side_effect = lambda texts: [None if t == "encapsulamento" else by_query[t] for t in texts]
+        results = embeddings.retrieve_relevant_chunks_batch(
+            ["herança", "encapsulamento"], str(default_user_id), db_session, top_k=3
+        )
+
+    assert len(results[0]) == 3
+    assert results[1]
+    assert all("encapsulamento" in c["chunk_text"] for c in results[1])
+
+
+def test_batch_with_int8_matrix_reranks_in_full_precision(db_session, default_user_id, seeded_vectors, monkeypatch):
+    """Testa o lote sobre matriz quantizada: mesmo top-k e similaridade exata"""
+    monkeypatch.setattr(embeddings, "RAG_RETRIEVAL_MODE", "vector")
+    monkeypatch.setattr(diversification, "RAG_MMR_LAMBDA", 1.0)  # compara só o ranking por relevância
+    by_query = _query_vectors(seeded_vectors)
+    queries = list(by_query)
+    user = str(default_user_id)
+    expected = _individual(queries, user, db_session, by_query)
+
+    clear_vector_cache()
+    monkeypatch.setattr(embeddings, "VECTOR_QUANTIZATION", "int8")
+    with patch("ficous.backend.app.services.embeddings._embed_queries") as mock_batch:
+        mock_batch.side_effect = lambda texts: [by_query[t] for t in texts]
+        batch = embeddings.retrieve_relevant_chunks_batch(queries, user, db_session, top_k=4)
+
+    assert [[c["chunk_text"] for c in r] for r in batch] == [[c["chunk_text"] for c in r] for r in expected]
+    for got, want in zip(batch, expected):
+        assert [c["similarity"] for c in got] == pytest.approx([c["similarity"] for c in want], abs=1e-5)
+
+
+def test_batch_retrieve_endpoint(client, default_user_id, seeded_vectors, monkeypatch):
+    """Testa o endpoint admin de RAG em lote"""
+    from ficous.backend.app.routers import admin
+    monkeypatch.setattr(admin, "ADMIN_ENABLED", True)  # test_admin recarrega o módulo desabilitado
+    by_query = _query_vectors(seeded_vectors)
+
+    with patch("ficous.backend.app.services.embeddings._embed_queries") as mock_batch:
+        mock_batch.side_effect = lambda texts: [by_query[t] for t in texts]
+        response = client.post("/ficous/admin/batch-retrieve", json={
+            "queries": ["polimorfismo", "recursão"],
+            "top_k": 2
+        })
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [r["query"] for r in results] == ["polimorfismo", "recursão"]
+    assert all(r["chunks_found"] == 2 for r in results)
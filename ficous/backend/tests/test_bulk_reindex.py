@@ -0,0 +1,218 @@
+"""
+Testes para a reindexação em massa retomável (/admin/index-content)
+"""
+import uuid
+from datetime import datetime, timedelta, timezone
+import pytest
+from unittest.mock import patch
+
+from ficous.backend.app import models
+from ficous.backend.app.services import bulk_reindex
+from ficous.backend.app.services.bulk_reindex import start_reindex, get_reindex_status
+
+
+@pytest.fixture
+def many_notes(db_session, default_user_id, sample_discipline):
+    notes = [
+        models.Note(
+            id=uuid.uuid4(),
+            user_id=default_user_id,
+            discipline_id=sample_discipline.id,
+            title=f"Nota {i}",
+            content=f"Conteúdo da nota {i}."
+        )
+        for i in range(5)
+    ]
+    db_session.add_all(notes)
+    db_session.commit()
+    return notes
+
+
+@pytest.fixture
+def small_batches(monkeypatch):
+    monkeypatch.setattr(bulk_reindex, "REINDEX_BATCH_SIZE", 2)
+    monkeypatch.setattr(bulk_reindex, "REINDEX_WORKERS", 1)  # SQLite em memória: uma conexão só
+
+
+def test_reindex_counts_chunks_and_finishes(db_session, default_user_id, many_notes, small_batches):
+    """Testa que todos os owners são processados em lotes e o progresso chega a 100%"""
+    with patch("ficous.backend.app.services.bulk_reindex.index_note_content") as mock:
+        mock.return_value = 3
+        run = start_reindex(default_user_id, "notes", db_session, wait=True)
+
+    status = get_reindex_status(db_session, default_user_id, run_id=run.id)
+    assert status["status"] == "done"
+    assert status["processed_items"] == 5
+    assert status["indexed_chunks"] == 15
+    assert status["progress"] == 1.0
+    assert status["chunks_per_second"] > 0
+    assert status["eta_seconds"] is None
+
+
+def test_interrupted_run_resumes_from_checkpoint(db_session, default_user_id, many_notes, small_batches):
+    """Testa que uma execução interrompida retoma após o último lote concluído"""
+    original = bulk_reindex._index_batch
+    calls = {"n": 0}
+
+    def flaky(executor, owner_type, batch):
+        calls["n"] += 1
+        if calls["n"] == 2:
+            raise RuntimeError("conexão perdida")
+        return original(executor, owner_type, batch)
+
+    with patch("ficous.backend.app.services.bulk_reindex.index_note_content") as mock:
+        mock.return_value = 1
+        with patch.object(bulk_reindex, "_index_batch", flaky):
+            run = start_reindex(default_user_id, "notes", db_session, wait=True)
+        assert run.status == "failed"
+        assert run.processed_items == 2
+        assert "conexão perdida" in run.last_error
+
+        resumed = start_reindex(default_user_id, "notes", db_session, wait=True)
+
+    assert resumed.id == run.id
+    assert resumed.status == "done"
+    assert resumed.processed_items == 5
+    assert mock.call_count == 5  # nenhuma nota indexada duas vezes
+
+
+def test_restart_cancels_unfinished_run(db_session, default_user_id, many_notes, small_batches):
+    """Testa que restart=True abandona o checkpoint e começa uma nova execução"""
+    failed = models.ReindexRun(user_id=default_user_id, content_type="notes", status="failed", processed_items=2)
+    db_session.add(failed)
+    db_session.commit()
+
+    with patch("ficous.backend.app.services.bulk_reindex.index_note_content") as mock:
+        mock.return_value = 1
+        run = start_reindex(default_user_id, "notes", db_session, wait=True, restart=True)
+
+    db_session.refresh(failed)
+    assert run.id != failed.id
+    assert failed.status == "cancelled"
+    assert run.processed_items == 5
+
+
+def test_index_content_status_endpoint(client, sample_note, small_batches, monkeypatch):
+    """Testa o polling de progresso da reindexação"""
+    from ficous.backend.app.routers import admin
+    monkeypatch.setattr(admin, "ADMIN_ENABLED", True)  # test_admin recarrega o módulo desabilitado
+
+    assert client.get("/ficous/admin/index-content/status").status_code == 404
+
+    with patch("ficous.backend.app.services.bulk_reindex.index_note_content") as mock:
+        mock.return_value = 2
+        started = client.post("/ficous/admin/index-content?content_type=notes&wait=true").json()
+
+    response = client.get("/ficous/admin/index-content/status", params={"run_id": started["run"]["run_id"]})
+
+    assert response.status_code == 200
+    run = response.json()["run"]
+    assert run["status"] == "done"
+    assert run["indexed_chunks"] == 2
+    assert {"chunks_per_second", "eta_seconds", "checkpoint"} <= set(run)
+    assert client.post("/ficous/admin/index-content?content_type=invalid").status_code == 400
+
+
+def test_run_with_live_lease_is_not_taken_over(db_session, default_user_id, many_notes, small_batches):
+    """Testa que uma execução com heartbeat recente (outro processo) não é retomada"""
+    now = datetime.now(timezone.utc)
+    live = models.ReindexRun(user_id=default_user_id, content_type="notes", status="running", updated_at=now)
+    db_session.add(live)
+    db_session.commit()
+
+    with patch("ficous.backend.app.services.bulk_reindex.index_note_content") as mock:
+        run = start_reindex(default_user_id, "notes", db_session, wait=True)
+
+    assert run.id == live.id
+    assert mock.call_count == 0
+    assert get_reindex_status(db_session, default_user_id, run_id=run.id)["active"] is True
+
+
+def test_run_with_expired_lease_is_resumed(db_session, default_user_id, many_notes, small_batches):
+    """Testa que uma execução sem heartbeat além do lease (processo caiu) é retomada"""
+    stale_at = datetime.now(timezone.utc) - timedelta(seconds=bulk_reindex.REINDEX_LEASE_SECONDS + 60)
+    stale = models.ReindexRun(user_id=default_user_id, content_type="notes", status="running", updated_at=stale_at)
+    db_session.add(stale)
+    db_session.commit()
+
+    with patch("ficous.backend.app.services.bulk_reindex.index_note_content") as mock:
+        mock.return_value = 1
+        run = start_reindex(default_user_id, "notes", db_session, wait=True)
+
+    assert run.id == stale.id
+    assert run.status == "done"
+    assert mock.call_count == 5
+
+
+def test_reindex_skips_owners_with_running_indexing_job(db_session, default_user_id, many_notes, small_batches):
+    """Testa que owners já em indexação pela fila não são indexados de novo"""
+    busy = many_notes[0]
+    db_session.add(models.IndexingJob(
+        user_id=default_user_id, owner_type="note", owner_id=busy.id, status="running", attempts=0
+    ))
+    db_session.commit()
+
+    indexed = []
+    with patch("ficous.backend.app.services.bulk_reindex.index_note_content") as mock:
+        mock.side_effect = lambda owner, db: indexed.append(owner.id) or 1
+        run = start_reindex(default_user_id, "notes", db_session, wait=True)
+
+    assert run.status == "done"
+    assert run.processed_items == 5
+    assert len(indexed) == 4
+    assert busy.id not in indexed
+
+
+def test_failed_owners_are_retried_on_resume(db_session, default_user_id, many_notes, small_batches):
+    """Testa que owners que falharam (atrás do checkpoint) são re-tentados ao retomar"""
+    broken = many_notes[1].id
+
+    indexed = []
+
+    def index(owner, db):
+        indexed.append(owner.id)
+        if owner.id == broken:
+            raise RuntimeError("provedor fora")
+        return 1
+
+    with patch("ficous.backend.app.services.bulk_reindex.index_note_content") as mock:
+        mock.side_effect = index
+        run = start_reindex(default_user_id, "notes", db_session, wait=True)
+        assert run.status == "failed"
+        assert run.failed_items == 1
+        assert run.failed_owners == [["note", str(broken)]]
+
+        broken = None  # provedor voltou
+        resumed = start_reindex(default_user_id, "notes", db_session, wait=True)
+
+    assert resumed.id == run.id
+    assert resumed.status == "done"
+    assert resumed.failed_items == 0
+    assert resumed.failed_owners is None
+    assert len(indexed) == 6  # só o owner que falhou foi indexado de novo
+    assert indexed[-1] == many_notes[1].id
+
+
+def test_reindex_claims_owner_against_queue_worker(db_session, default_user_id, many_notes, small_batches):
+    """Testa que o owner em indexação pela reindexação em massa não é reivindicado pela fila"""
+    from ficous.backend.app.services import indexing_queue
+    note = many_notes[0]
+    pending = models.IndexingJob(
+        user_id=default_user_id, owner_type="note", owner_id=note.id, status="pending", attempts=0
+    )
+    db_session.add(pending)
+    db_session.commit()
+    claimed_during_index = []
+
+    def index(owner, db):
+        if owner.id == note.id:
+            claimed_during_index.append(indexing_queue._claim_next_job(db_session))
+        return 1
+
+    with patch("ficous.backend.app.services.bulk_reindex.index_note_content") as mock:
+        mock.side_effect = index
+        start_reindex(default_user_id, "notes", db_session, wait=True)
+
+    assert claimed_during_index == [None]
+    db_session.refresh(pending)
+    assert pending.status == "pending"  # segue na fila para depois
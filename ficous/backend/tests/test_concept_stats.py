@@ -0,0 +1,56 @@
+"""
+Testes para a atualização em lote da força dos conceitos
+"""
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from ficous.backend.app import models
+from ficous.backend.app.services.concept_stats import update_concept_strengths
+
+
+def _strengths(db_session, user_id):
+    stats = db_session.query(models.UserConceptStat).filter(
+        models.UserConceptStat.user_id == user_id
+    ).all()
+    return {s.concept: round(s.strength, 6) for s in stats}
+
+
+def test_bulk_update_creates_and_updates(db_session, default_user_id):
+    """Testa conceitos novos e existentes (com limites) numa única chamada"""
+    db_session.add_all([
+        models.UserConceptStat(user_id=default_user_id, concept="herança", strength=0.5),
+        models.UserConceptStat(user_id=default_user_id, concept="OOP", strength=0.95),
+        models.UserConceptStat(user_id=default_user_id, concept="vazio", strength=None)
+    ])
+    db_session.commit()
+
+    updated = update_concept_strengths(
+        str(default_user_id), {"herança": 0.1, "OOP": 0.1, "vazio": 0.1, "polimorfismo": 0.1}, db_session
+    )
+
+    assert updated == 4
+    db_session.expire_all()
+    assert _strengths(db_session, default_user_id) == {
+        "herança": 0.6, "OOP": 1.0, "vazio": 0.6, "polimorfismo": 0.6
+    }
+
+
+def test_bulk_update_sums_repeated_concepts(db_session, default_user_id):
+    """Testa que conceitos repetidos somam e deltas diferentes convivem na mesma chamada"""
+    update_concept_strengths(
+        default_user_id, [("OOP", 0.1), ("OOP", 0.1), ("herança", -0.2), ("", 0.3)], db_session
+    )
+
+    assert _strengths(db_session, default_user_id) == {"OOP": 0.7, "herança": 0.3}
+    assert update_concept_strengths(default_user_id, {}, db_session) == 0
+
+
+def test_concept_stat_is_unique_per_user(db_session, default_user_id):
+    """Testa a constraint única (user_id, concept) que sustenta o upsert"""
+    db_session.add(models.UserConceptStat(user_id=default_user_id, concept="OOP", strength=0.5))
+    db_session.commit()
+    db_session.add(models.UserConceptStat(user_id=default_user_id, concept="OOP", strength=0.5))
+
+    with pytest.raises(IntegrityError):
+        db_session.commit()
+    db_session.rollback()
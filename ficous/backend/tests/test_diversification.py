@@ -0,0 +1,95 @@
+"""
+Testes para a diversificação MMR dos resultados do RAG
+"""
+import uuid
+import numpy as np
+from unittest.mock import patch
+
+from ficous.backend.app import models
+from ficous.backend.app.services import embeddings, diversification
+from ficous.backend.app.services.diversification import mmr_select
+
+
+def _unit(*values):
+    vec = np.zeros(8, dtype=np.float32)
+    vec[:len(values)] = values
+    return vec / np.linalg.norm(vec)
+
+
+def test_mmr_skips_near_duplicates():
+    """Testa que um quase-duplicado do primeiro escolhido perde para conteúdo novo"""
+    vectors = np.stack([_unit(1, 0), _unit(1, 0.05), _unit(0, 1)])
+    relevance = np.array([1.0, 0.99, 0.8])
+
+    assert mmr_select(relevance, vectors, 2, lambda_=0.5).tolist() == [0, 2]
+    assert mmr_select(relevance, vectors, 2, lambda_=1.0).tolist() == [0, 1]
+
+
+def test_mmr_per_owner_cap():
+    """Testa o limite de chunks por nota/fonte"""
+    vectors = np.stack([_unit(1, 0), _unit(0, 1), _unit(0, 0, 1), _unit(0, 0, 0, 1)])
+    owners = np.array(["a", "a", "a", "b"])
+
+    selected = mmr_select(np.array([1.0, 0.9, 0.8, 0.1]), vectors, 3, owners=owners, lambda_=1.0, max_per_owner=2)
+
+    assert selected.tolist() == [0, 1, 3]
+
+
+def _seed(db_session, user_id, note_a, note_b):
+    """Três chunks sobrepostos da nota A e um chunk distinto da nota B"""
+    base = np.zeros(1536, dtype=np.float32)
+    rows = [("a1", note_a, 0, 0.0), ("a2", note_a, 0, 0.05), ("a3", note_a, 0, 0.1), ("b1", note_b, 1, 0.0)]
+    for text, owner, axis, noise in rows:
+        vec = base.copy()
+        vec[axis] = 1.0
+        vec[2] = noise
+        db_session.add(models.Embedding(
+            id=uuid.uuid4(),
+            user_id=user_id,
+            owner_type="note",
+            owner_id=owner,
+            chunk_text=text,
+            vector_f32=embeddings._pack_vector(vec),
+            meta={}
+        ))
+    db_session.commit()
+    query = base.copy()
+    query[0], query[1] = 1.0, 0.6
+    return query.tolist()
+
+
+def test_retrieve_diversifies_overlapping_chunks(db_session, default_user_id, sample_note, monkeypatch):
+    """Testa que o top-k troca chunks sobrepostos da mesma nota por conteúdo distinto"""
+    monkeypatch.setattr(embeddings, "RAG_RETRIEVAL_MODE", "vector")
+    query = _seed(db_session, default_user_id, sample_note.id, uuid.uuid4())
+
+    with patch("ficous.backend.app.services.embeddings._get_embedding", return_value=query):
+        monkeypatch.setattr(diversification, "RAG_MMR_LAMBDA", 1.0)
+        plain = embeddings.retrieve_relevant_chunks("q", str(default_user_id), db_session, top_k=2)
+        monkeypatch.setattr(diversification, "RAG_MMR_LAMBDA", 0.5)
+        diverse = embeddings.retrieve_relevant_chunks("q", str(default_user_id), db_session, top_k=2)
+
+    assert [c["chunk_text"] for c in plain] == ["a1", "a2"]
+    assert [c["chunk_text"] for c in diverse] == ["a1", "b1"]
+
+
+def test_lexical_path_respects_owner_cap(db_session, default_user_id, sample_note, monkeypatch):
+    """Testa o limite por owner também no caminho só-léxico (vetores buscados do banco)"""
+    monkeypatch.setattr(embeddings, "RAG_RETRIEVAL_MODE", "lexical")
+    monkeypatch.setattr(diversification, "RAG_MMR_LAMBDA", 1.0)
+    monkeypatch.setattr(diversification, "RAG_MMR_MAX_PER_OWNER", 1)
+    other = uuid.uuid4()
+    for text, owner in [("herança múltipla", sample_note.id), ("herança simples", sample_note.id),
+                        ("herança em python", other)]:
+        db_session.add(models.Embedding(
+            user_id=default_user_id,
+            owner_type="note",
+            owner_id=owner,
+            chunk_text=text,
+            meta={}
+        ))
+    db_session.commit()
+
+    chunks = embeddings.retrieve_relevant_chunks("herança", str(default_user_id), db_session, top_k=3)
+
+    assert sorted(c["owner_id"] for c in chunks) == sorted([str(sample_note.id), str(other)])
@@ -0,0 +1,159 @@
+"""
+Testes para o cache de embeddings endereçado por conteúdo
+"""
+import pytest
+from unittest.mock import patch
+from ficous.backend.app import models
+from ficous.backend.app.services import embedding_cache
+from ficous.backend.app.services.embedding_cache import (
+    content_hash,
+    evict_embedding_cache,
+    get_cached_vectors,
+    get_embedding_cache_stats,
+    maintain_embedding_cache,
+    store_cached_vectors
+)
+from ficous.backend.app.services.embeddings import (
+    embed_chunks,
+    index_note_content,
+    index_source_content
+)
+
+
+def _fake_vectors(texts):
+    return [[float(len(t))] * 1536 for t in texts]
+
+
+@pytest.fixture(autouse=True)
+def reset_pending_touches(monkeypatch):
+    """Isola os acertos pendentes e o contador de gravações entre testes"""
+    monkeypatch.setattr(embedding_cache, "_pending_touches", embedding_cache.Counter())
+    monkeypatch.setattr(embedding_cache, "_stores_since_evict", 0)
+
+
+def test_content_hash_stable():
+    """Testa que o hash depende apenas do conteúdo"""
+    assert content_hash("texto") == content_hash("texto")
+    assert content_hash("texto") != content_hash("texto!")
+    assert len(content_hash("texto")) == 64
+
+
+def test_reindex_unchanged_note_skips_api(db_session, sample_note):
+    """Testa que reindexar nota sem mudanças não chama a API"""
+    with patch("ficous.backend.app.services.embeddings._request_embeddings") as mock_emb:
+        mock_emb.side_effect = _fake_vectors
+        first = index_note_content(sample_note, db_session)
+        second = index_note_content(sample_note, db_session)
+
+    assert first == second
+    assert mock_emb.call_count == 1
+
+
+def test_identical_chunks_deduped_across_owners(db_session, sample_note):
+    """Testa que o mesmo texto em nota e fonte é embedado uma vez só"""
+    source = models.Source(
+        user_id=sample_note.user_id,
+        filename="aula.pdf",
+        content_excerpt=sample_note.content
+    )
+    db_session.add(source)
+    db_session.commit()
+
+    with patch("ficous.backend.app.services.embeddings._request_embeddings") as mock_emb:
+        mock_emb.side_effect = _fake_vectors
+        index_note_content(sample_note, db_session)
+        index_source_content(source, db_session)
+
+    assert mock_emb.call_count == 1
+    maintain_embedding_cache(db_session)
+    assert get_embedding_cache_stats(db_session)["total_hits"] >= 1
+
+
+def test_lookup_does_not_write(db_session):
+    """Testa que a consulta ao cache não escreve na transação do chamador"""
+    store_cached_vectors({content_hash("a"): b"\x00" * 4}, "m", db_session)
+    db_session.commit()
+
+    found = get_cached_vectors([content_hash("a")], "m", db_session)
+
+    assert list(found) == [content_hash("a")]
+    assert not db_session.dirty and not db_session.new
+    assert get_embedding_cache_stats(db_session)["total_hits"] == 0
+
+    maintain_embedding_cache(db_session)
+
+    assert get_embedding_cache_stats(db_session)["total_hits"] == 1
+
+
+def test_maintenance_evicts_after_threshold(db_session, monkeypatch):
+    """Testa que a evicção roda na manutenção ao atingir EMBEDDING_CACHE_EVICT_EVERY"""
+    monkeypatch.setattr(embedding_cache, "EMBEDDING_CACHE_EVICT_EVERY", 2)
+    monkeypatch.setattr(embedding_cache, "EMBEDDING_CACHE_MAX_ENTRIES", 1)
+    store_cached_vectors({content_hash("a"): b"\x00" * 4}, "m", db_session)
+    db_session.commit()
+
+    assert maintain_embedding_cache(db_session) == 0
+
+    store_cached_vectors({content_hash("b"): b"\x00" * 4}, "m", db_session)
+    db_session.commit()
+
+    assert maintain_embedding_cache(db_session) == 1
+    assert get_embedding_cache_stats(db_session)["entries"] == 1
+
+
+def test_embed_chunks_dedupes_within_request(db_session):
+    """Testa que chunks repetidos na mesma chamada viram um único input"""
+    with patch("ficous.backend.app.services.embeddings._request_embeddings") as mock_emb:
+        mock_emb.side_effect = _fake_vectors
+        vectors = embed_chunks(["a", "b", "a"], db_session)
+
+    assert mock_emb.call_args[0][0] == ["a", "b"]
+    assert vectors[0] == vectors[2]
+
+
+def test_failed_embeddings_not_cached(db_session):
+    """Testa que falhas do provedor não são persistidas no cache"""
+    with patch("ficous.backend.app.services.embeddings._request_embeddings") as mock_emb:
+        mock_emb.side_effect = lambda texts: [None for _ in texts]
+        vectors = embed_chunks(["falhou"], db_session)
+
+    assert vectors == [None]
+    assert get_embedding_cache_stats(db_session)["entries"] == 0
+
+
+def test_evict_embedding_cache(db_session):
+    """Testa evicção das entradas acima do limite"""
+    with patch("ficous.backend.app.services.embeddings._request_embeddings") as mock_emb:
+        mock_emb.side_effect = _fake_vectors
+        embed_chunks(["um", "dois", "tres"], db_session)
+
+    removed = evict_embedding_cache(db_session, max_entries=1)
+
+    assert removed == 2
+    assert get_embedding_cache_stats(db_session)["entries"] == 1
+
+
+def test_store_skips_only_conflicting_hash(db_session, sample_note):
+    """Testa que um hash já gravado não descarta o lote nem a transação do chamador"""
+    store_cached_vectors({content_hash("a"): b"\x00" * 4}, "m", db_session)
+    db_session.commit()
+    sample_note.title = "pendente"
+    db_session.flush()
+
+    stored = store_cached_vectors({content_hash("a"): b"\x01" * 4, content_hash("b"): b"\x02" * 4}, "m", db_session)
+    db_session.rollback()
+
+    assert stored == 2
+    assert get_embedding_cache_stats(db_session)["entries"] == 1
+    db_session.refresh(sample_note)
+    assert sample_note.title != "pendente"
+
+
+def test_store_does_not_commit_caller_session(db_session):
+    """Testa que a gravação no cache entra na transação do chamador"""
+    store_cached_vectors({content_hash("a"): b"\x00" * 4, content_hash("b"): b"\x00" * 4}, "m", db_session)
+    assert get_embedding_cache_stats(db_session)["entries"] == 2
+
+    db_session.rollback()
+
+    assert get_embedding_cache_stats(db_session)["entries"] == 0
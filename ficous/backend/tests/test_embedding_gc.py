@@ -0,0 +1,132 @@
+"""
+Testes para a coleta de embeddings órfãos e a limpeza na exclusão
+"""
+import uuid
+from unittest.mock import patch
+
+from ficous.backend.app import models
+from ficous.backend.app.services import embeddings
+from ficous.backend.app.services.embedding_gc import collect_orphan_embeddings
+from ficous.backend.app.services.lexical_index import get_user_lexical_index
+
+
+def _index(note, db_session):
+    with patch("ficous.backend.app.services.embeddings._request_embeddings") as mock_emb:
+        mock_emb.side_effect = lambda texts: [[0.1] * 1536 for _ in texts]
+        return embeddings.index_note_content(note, db_session)
+
+
+def _orphans(db_session, user_id, n):
+    for i in range(n):
+        db_session.add(models.Embedding(
+            user_id=user_id,
+            owner_type="note",
+            owner_id=uuid.uuid4(),
+            chunk_text=f"órfão {i}",
+            vector_f32=embeddings._pack_vector([0.1] * 1536),
+            meta={}
+        ))
+    db_session.commit()
+
+
+def test_delete_note_removes_its_embeddings(client, db_session, sample_note, default_user_id):
+    """Testa que excluir a nota apaga os chunks e tira o texto do RAG"""
+    assert _index(sample_note, db_session) > 0
+    assert get_user_lexical_index(str(default_user_id), db_session).search("polimorfismo", 5)
+
+    response = client.delete(f"/ficous/notes/{sample_note.id}")
+
+    assert response.status_code == 204
+    assert db_session.query(models.Embedding).count() == 0
+    assert get_user_lexical_index(str(default_user_id), db_session).search("polimorfismo", 5) == []
+
+
+def test_delete_discipline_removes_cascaded_note_embeddings(client, db_session, sample_note):
+    """Testa que as notas excluídas em cascata com a disciplina não deixam chunks"""
+    _index(sample_note, db_session)
+
+    response = client.delete(f"/ficous/disciplines/{sample_note.discipline_id}")
+
+    assert response.status_code == 204
+    assert db_session.query(models.Embedding).count() == 0
+
+
+def test_collect_orphans_in_batches(db_session, sample_note, default_user_id):
+    """Testa dry-run, remoção em lotes e relatório de linhas/bytes, preservando chunks vivos"""
+    live = _index(sample_note, db_session)
+    _orphans(db_session, default_user_id, 5)
+
+    preview = collect_orphan_embeddings(db_session, dry_run=True, batch_size=2)
+    assert preview["deleted_rows"] == 5
+    assert db_session.query(models.Embedding).count() == live + 5
+
+    report = collect_orphan_embeddings(db_session, batch_size=2)
+
+    assert report["deleted_rows"] == 5
+    assert report["batches"] == 3
+    assert report["by_owner_type"] == {"note": 5}
+    assert report["reclaimed_bytes"] >= 5 * 1536 * 4
+    assert db_session.query(models.Embedding).count() == live
+    assert collect_orphan_embeddings(db_session)["deleted_rows"] == 0
+
+
+def test_embedding_gc_endpoint(client, db_session, default_user_id, monkeypatch):
+    """Testa o endpoint admin da coleta e o status com a última execução"""
+    from ficous.backend.app.routers import admin
+    monkeypatch.setattr(admin, "ADMIN_ENABLED", True)  # test_admin recarrega o módulo desabilitado
+    _orphans(db_session, default_user_id, 3)
+
+    response = client.post("/ficous/admin/embedding-gc")
+
+    assert response.status_code == 200
+    assert response.json()["report"]["deleted_rows"] == 3
+    status = client.get("/ficous/admin/embedding-gc/status").json()
+    assert status["last_run"]["deleted_rows"] == 3
+
+
+def test_collect_keeps_rows_of_other_owner_types(db_session, default_user_id):
+    """Testa que owner_type fora de nota/fonte (summary, concept) não é tratado como órfão"""
+    for owner_type in ("summary", "concept"):
+        db_session.add(models.Embedding(
+            user_id=default_user_id,
+            owner_type=owner_type,
+            owner_id=uuid.uuid4(),
+            chunk_text=owner_type,
+            vector_f32=embeddings._pack_vector([0.1] * 1536),
+            meta={}
+        ))
+    db_session.commit()
+
+    report = collect_orphan_embeddings(db_session)
+
+    assert report["deleted_rows"] == 0
+    assert db_session.query(models.Embedding).count() == 2
+
+
+def test_collect_releases_vectors_of_other_model(db_session, sample_note, default_user_id):
+    """Testa que vetores de outro modelo viram pendentes (bytes liberados, chunk mantido)"""
+    live = _index(sample_note, db_session)
+    stale = models.Embedding(
+        user_id=default_user_id,
+        owner_type="note",
+        owner_id=sample_note.id,
+        chunk_text="gerado por outro modelo",
+        vector_f32=embeddings._pack_vector([0.1] * 384),
+        embedding_model="local-hash-384",
+        meta={}
+    )
+    db_session.add(stale)
+    db_session.commit()
+
+    preview = collect_orphan_embeddings(db_session, dry_run=True)
+    assert preview["stale_rows"] == 1
+    report = collect_orphan_embeddings(db_session)
+
+    assert report["deleted_rows"] == 0
+    assert report["stale_rows"] == 1
+    assert report["reclaimed_bytes"] == 384 * 4
+    db_session.refresh(stale)
+    assert stale.vector_f32 is None
+    assert embeddings.count_pending_embeddings(db_session, user_id=default_user_id) == 1
+    assert db_session.query(models.Embedding).count() == live + 1
+    assert collect_orphan_embeddings(db_session)["stale_rows"] == 0
@@ -0,0 +1,115 @@
+"""
+Testes para provedores de embeddings e re-embedding de chunks pendentes
+"""
+import numpy as np
+import pytest
+from unittest.mock import patch
+
+from ficous.backend.app import models
+from ficous.backend.app.services.embedding_providers import (
+    EmbeddingProvider,
+    HashingEmbeddingProvider,
+    OpenAIEmbeddingProvider,
+    get_embedding_provider
+)
+from ficous.backend.app.services.embeddings import (
+    index_note_content,
+    retrieve_relevant_chunks,
+    reembed_pending,
+    count_pending_embeddings
+)
+
+
+def _cos(a, b):
+    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+def test_hashing_provider_is_deterministic():
+    """Testa que o mesmo texto gera sempre o mesmo vetor normalizado"""
+    provider = HashingEmbeddingProvider()
+    first, second = provider.embed(["fotossíntese nas plantas", "fotossíntese nas plantas"])
+
+    assert first == second
+    assert len(first) == 1536
+    assert abs(np.linalg.norm(first) - 1.0) < 1e-5
+
+
+def test_hashing_provider_ignores_accents_and_case():
+    """Testa que acentos e caixa não mudam o vetor"""
+    provider = HashingEmbeddingProvider()
+    a, b = provider.embed(["Fotossíntese e Clorofila", "fotossintese e clorofila"])
+
+    assert a == b
+
+
+def test_hashing_provider_similarity_sanity():
+    """Testa que textos com vocabulário em comum ficam mais próximos"""
+    provider = HashingEmbeddingProvider()
+    query, related, unrelated = provider.embed([
+        "fotossíntese converte luz em energia química",
+        "a fotossíntese usa luz solar para produzir energia química",
+        "revolução francesa e queda da monarquia"
+    ])
+
+    assert _cos(query, related) > _cos(query, unrelated)
+
+
+def test_provider_interface_requires_embed():
+    """Testa que um provedor sem `embed` não pode ser instanciado"""
+    class Incompleto(EmbeddingProvider):
+        pass
+
+    with pytest.raises(TypeError):
+        Incompleto()
+
+
+def test_get_embedding_provider_selection(monkeypatch):
+    """Testa a escolha do provedor por configuração"""
+    monkeypatch.setenv("EMBEDDING_PROVIDER", "local")
+    assert isinstance(get_embedding_provider(), HashingEmbeddingProvider)
+
+    monkeypatch.setenv("EMBEDDING_PROVIDER", "auto")
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    assert isinstance(get_embedding_provider(), HashingEmbeddingProvider)
+
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    assert isinstance(get_embedding_provider(), OpenAIEmbeddingProvider)
+
+
+def test_failed_embeddings_are_pending_and_reembedded(db_session, sample_note, default_user_id):
+    """Testa que falhas viram linhas pendentes (fora do ranking) e são re-embedadas depois"""
+    with patch("ficous.backend.app.services.embeddings._request_embeddings") as mock_emb:
+        mock_emb.side_effect = lambda texts: [None for _ in texts]
+        count = index_note_content(sample_note, db_session)
+
+    assert count > 0
+    assert count_pending_embeddings(db_session, user_id=default_user_id) == count
+
+    with patch("ficous.backend.app.services.embeddings._get_embedding") as mock_query:
+        mock_query.return_value = [0.1] * 1536
+        assert retrieve_relevant_chunks("teste", str(default_user_id), db_session) == []
+
+    with patch("ficous.backend.app.services.embeddings._request_embeddings") as mock_emb:
+        mock_emb.side_effect = lambda texts: [[0.1] * 1536 for _ in texts]
+        assert reembed_pending(db_session, user_id=default_user_id) == count
+
+    assert count_pending_embeddings(db_session, user_id=default_user_id) == 0
+    with patch("ficous.backend.app.services.embeddings._get_embedding") as mock_query:
+        mock_query.return_value = [0.1] * 1536
+        assert len(retrieve_relevant_chunks("teste", str(default_user_id), db_session)) > 0
+
+
+def test_retrieval_skips_other_provider_vectors(db_session, sample_note, default_user_id, monkeypatch):
+    """Testa que vetores de outro modelo não entram no ranking e são reindexados"""
+    with patch("ficous.backend.app.services.embeddings._request_embeddings") as mock_emb:
+        mock_emb.side_effect = lambda texts: [[0.1] * 1536 for _ in texts]
+        index_note_content(sample_note, db_session)
+
+    monkeypatch.setenv("EMBEDDING_PROVIDER", "local")
+    assert retrieve_relevant_chunks("teste", str(default_user_id), db_session) == []
+
+    # Reindexação incremental troca as linhas do modelo antigo
+    index_note_content(sample_note, db_session)
+    rows = db_session.query(models.Embedding).filter(models.Embedding.owner_id == sample_note.id).all()
+    assert rows and all(row.embedding_model == HashingEmbeddingProvider().model for row in rows)
+    assert len(retrieve_relevant_chunks("teste", str(default_user_id), db_session)) > 0
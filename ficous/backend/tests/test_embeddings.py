@@ -3,13 +3,29 @@ Testes para sistema de Embeddings e RAG
 """
 import pytest
 import json
+import asyncio
+import uuid
 from unittest.mock import patch
+from ficous.backend.app import models
 from ficous.backend.app.services.embeddings import (
     _chunk_text,
+    _pack_vector,
+    _unpack_vector,
+    iter_chunks,
     index_note_content,
+    index_source_content,
+    set_owner_discipline,
     retrieve_relevant_chunks,
-    update_concept_strength
+    retrieve_relevant_chunks_async,
+    update_concept_strength,
+    calculate_advanced_perso_score,
+    calculate_perso_scores,
+    recency_scores,
+    _top_k_indices
 )
+from ficous.backend.app.services import embeddings
+from ficous.backend.app.services.embedding_providers import _plan_batches
+from ficous.backend.app.services.query_embedding_cache import clear_query_embedding_cache
 
 
 def test_chunk_text_simple():
@@ -31,6 +47,43 @@ def test_chunk_text_with_sentences():
     assert any(c.strip().endswith('.') for c in chunks)
 
 
+def test_iter_chunks_is_lazy_and_sentence_aligned():
+    """Testa que o chunker é um gerador e só corta em fim de frase"""
+    import types
+    sentences = [f"A frase número {i} fala de herança e polimorfismo." for i in range(200)]
+    chunks = iter_chunks(" ".join(sentences), max_tokens=64, overlap_tokens=16)
+
+    assert isinstance(chunks, types.GeneratorType)
+    first = next(chunks)
+    assert first.startswith("A frase número 0 ")
+    rest = list(chunks)
+    for chunk in [first] + rest:
+        assert chunk.endswith(".")
+        assert len(chunk) // 4 <= 64 + 8  # orçamento de tokens (+ espaços de junção)
+    # Sobreposição: o próximo chunk começa com a última frase do anterior
+    assert rest[0].startswith(first.rsplit(". ", 1)[-1])
+
+
+def test_iter_chunks_long_sentence_splits_on_words():
+    """Testa que frases maiores que o chunk são quebradas sem cortar palavras"""
+    words = [f"palavra{i}" for i in range(500)]
+    chunks = list(iter_chunks(" ".join(words), max_tokens=50, overlap_tokens=0))
+
+    assert len(chunks) > 1
+    assert [w for chunk in chunks for w in chunk.split()] == words
+
+
+def test_iter_chunks_large_document_single_pass():
+    """Testa PDF grande (20k+ caracteres): menos chunks que o corte por caracteres"""
+    text = " ".join(f"Sentença {i} sobre estruturas de dados e algoritmos." for i in range(4000))
+    assert len(text) > 200_000
+
+    chunks = list(iter_chunks(text))
+
+    assert len(chunks) < len(text) // 350  # corte antigo: janela de 400 com overlap de 50
+    assert all(chunk.endswith(".") for chunk in chunks)
+
+
 def test_chunk_text_short():
     """Testa que texto curto não é chunkado"""
     text = "Texto curto"
@@ -42,8 +95,8 @@ def test_chunk_text_short():
 
 def test_index_note_content(db_session, sample_note):
     """Testa indexação de nota"""
-    with patch("ficous.backend.app.services.embeddings._get_embedding") as mock_emb:
-        mock_emb.return_value = [0.1] * 1536
+    with patch("ficous.backend.app.services.embeddings._request_embeddings") as mock_emb:
+        mock_emb.side_effect = lambda texts: [[0.1] * 1536 for _ in texts]
         
         count = index_note_content(sample_note, db_session)
         
@@ -51,6 +104,109 @@ def test_index_note_content(db_session, sample_note):
         mock_emb.assert_called()
 
 
+def test_plan_batches_respects_limits():
+    """Testa agrupamento por quantidade de inputs e por tokens estimados"""
+    texts = ["a" * 40] * 10  # ~10 tokens cada
+
+    assert _plan_batches(texts, max_inputs=4, max_tokens=1000) == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+    assert _plan_batches(texts, max_inputs=100, max_tokens=25) == [[0, 1], [2, 3], [4, 5], [6, 7], [8, 9]]
+    # Texto maior que o limite vai sozinho no lote
+    assert _plan_batches(["a" * 400, "b"], max_inputs=10, max_tokens=50) == [[0], [1]]
+
+
+def test_openai_provider_batch_preserves_order(monkeypatch):
+    """Testa que os vetores voltam na ordem dos inputs, um request por lote"""
+    from ficous.backend.app.services import embedding_providers, openai_client
+
+    requests = []
+
+    class FakeResponse:
+        def __init__(self, inputs):
+            self.inputs = inputs
+
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            # Resposta propositalmente fora de ordem
+            return {"data": [
+                {"index": i, "embedding": [float(len(text))]}
+                for i, text in reversed(list(enumerate(self.inputs)))
+            ]}
+
+    class FakeClient:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            return False
+
+        def post(self, url, json=None, headers=None, timeout=None):
+            requests.append(json["input"])
+            return FakeResponse(json["input"])
+
+    monkeypatch.setattr(openai_client, "get_http_client", FakeClient)
+    monkeypatch.setattr(embedding_providers, "EMBEDDING_BATCH_SIZE", 2)
+
+    texts = ["a", "bb", "ccc", "dddd", "eeeee"]
+    vectors = embedding_providers.OpenAIEmbeddingProvider().embed(texts)
+
+    assert vectors == [[1.0], [2.0], [3.0], [4.0], [5.0]]
+    assert len(requests) == 3
+
+
+def test_openai_provider_aembed_preserves_order(monkeypatch):
+    """Testa que a versão async também remonta a ordem dos inputs, um request por lote"""
+    from ficous.backend.app.services import embedding_providers
+
+    requests = []
+
+    async def fake_post(path, payload, api_key=None, timeout=None):
+        requests.append(payload["input"])
+        return {"data": [
+            {"index": i, "embedding": [float(len(text))]}
+            for i, text in reversed(list(enumerate(payload["input"])))
+        ]}
+
+    monkeypatch.setattr(embedding_providers, "apost_openai", fake_post)
+    monkeypatch.setattr(embedding_providers, "EMBEDDING_BATCH_SIZE", 2)
+
+    vectors = asyncio.run(embedding_providers.OpenAIEmbeddingProvider().aembed(["a", "bb", "ccc", "dddd", "eeeee"]))
+
+    assert vectors == [[1.0], [2.0], [3.0], [4.0], [5.0]]
+    assert len(requests) == 3
+
+
+def test_pack_vector_roundtrip():
+    """Testa empacotamento float32 (4 bytes/dim) e decodificação sem cópia"""
+    vector = [0.25, -1.5, 3.0] * 512
+    packed = _pack_vector(vector)
+
+    assert len(packed) == 1536 * 4
+    decoded = _unpack_vector(packed)
+    assert decoded.dtype.itemsize == 4
+    assert not decoded.flags.owndata  # view sobre os bytes
+    assert decoded.tolist() == vector
+
+
+def test_index_note_stores_packed_vectors(db_session, sample_note):
+    """Testa que a indexação grava vetores binários em vez de JSON"""
+    from ficous.backend.app import models
+
+    with patch("ficous.backend.app.services.embeddings._request_embeddings") as mock_emb:
+        mock_emb.side_effect = lambda texts: [[0.1] * 1536 for _ in texts]
+        index_note_content(sample_note, db_session)
+
+    emb = db_session.query(models.Embedding).filter(
+        models.Embedding.owner_id == sample_note.id
+    ).first()
+    assert emb.vector is None
+    assert len(emb.vector_f32) == 1536 * 4
+
+
 def test_index_note_removes_old_embeddings(db_session, sample_note, sample_embedding):
     """Testa que embeddings antigos são removidos ao reindexar"""
     from ficous.backend.app import models
@@ -59,8 +215,8 @@ def test_index_note_removes_old_embeddings(db_session, sample_note, sample_embed
         models.Embedding.owner_id == sample_note.id
     ).count()
     
-    with patch("ficous.backend.app.services.embeddings._get_embedding") as mock_emb:
-        mock_emb.return_value = [0.1] * 1536
+    with patch("ficous.backend.app.services.embeddings._request_embeddings") as mock_emb:
+        mock_emb.side_effect = lambda texts: [[0.1] * 1536 for _ in texts]
         
         index_note_content(sample_note, db_session)
         
@@ -90,6 +246,24 @@ def test_retrieve_relevant_chunks(db_session, default_user_id, sample_embedding)
         assert "perso_score" in chunks[0]
 
 
+def test_retrieve_relevant_chunks_async_matches_sync(db_session, default_user_id, sample_embedding):
+    """Testa que a versão async (embedding pelo cliente async) devolve o mesmo resultado"""
+    vector = json.loads(sample_embedding.vector)
+
+    async def embed(text, timeout=None):
+        return vector
+
+    with patch("ficous.backend.app.services.embeddings._get_embedding", return_value=vector):
+        expected = retrieve_relevant_chunks("polimorfismo", str(default_user_id), db_session, top_k=3)
+    clear_query_embedding_cache()
+    with patch("ficous.backend.app.services.embeddings._get_embedding_async", side_effect=embed) as mock_emb:
+        chunks = asyncio.run(retrieve_relevant_chunks_async("polimorfismo", str(default_user_id), db_session, top_k=3))
+
+    mock_emb.assert_called_once()
+    assert [c["chunk_text"] for c in chunks] == [c["chunk_text"] for c in expected]
+    assert [c["similarity"] for c in chunks] == pytest.approx([c["similarity"] for c in expected])
+
+
 def test_retrieve_relevant_chunks_with_discipline_filter(db_session, default_user_id, sample_embedding, sample_discipline):
     """Testa recuperação filtrada por disciplina"""
     with patch("ficous.backend.app.services.embeddings._get_embedding") as mock_emb:
@@ -107,6 +281,68 @@ def test_retrieve_relevant_chunks_with_discipline_filter(db_session, default_use
         assert len(chunks) >= 0
 
 
+def test_discipline_filter_includes_sources(db_session, default_user_id, sample_note, sample_discipline, monkeypatch):
+    """Testa que o filtro por disciplina usa a coluna desnormalizada (notas e fontes)"""
+    from ficous.backend.app.services import embeddings
+    monkeypatch.setattr(embeddings, "EMBEDDING_DEDUP_ENABLED", False)  # vetores mockados são idênticos
+    other = models.Discipline(id=uuid.uuid4(), user_id=default_user_id, name="História")
+    source = models.Source(
+        id=uuid.uuid4(),
+        user_id=default_user_id,
+        discipline_id=sample_discipline.id,
+        filename="poo.pdf",
+        content_excerpt="Herança e polimorfismo em linguagens orientadas a objetos."
+    )
+    other_note = models.Note(
+        id=uuid.uuid4(),
+        user_id=default_user_id,
+        discipline_id=other.id,
+        title="Revolução",
+        content="A revolução francesa começou em 1789."
+    )
+    db_session.add_all([other, source, other_note])
+    db_session.commit()
+
+    with patch("ficous.backend.app.services.embeddings._request_embeddings") as mock_emb:
+        mock_emb.side_effect = lambda texts: [[0.1] * 1536 for _ in texts]
+        index_note_content(sample_note, db_session)
+        index_source_content(source, db_session)
+        index_note_content(other_note, db_session)
+
+    with patch("ficous.backend.app.services.embeddings._get_embedding") as mock_emb:
+        mock_emb.return_value = [0.1] * 1536
+        chunks = retrieve_relevant_chunks(
+            "polimorfismo", str(default_user_id), db_session, top_k=10,
+            discipline_id=str(sample_discipline.id)
+        )
+
+    assert {c["owner_type"] for c in chunks} == {"note", "source"}
+    assert all(c["owner_id"] != str(other_note.id) for c in chunks)
+
+
+def test_set_owner_discipline_moves_embeddings(db_session, default_user_id, sample_note, sample_discipline):
+    """Testa que mover a nota de disciplina atualiza os embeddings e o filtro do RAG"""
+    with patch("ficous.backend.app.services.embeddings._request_embeddings") as mock_emb:
+        mock_emb.side_effect = lambda texts: [[0.1] * 1536 for _ in texts]
+        count = index_note_content(sample_note, db_session)
+
+    other = models.Discipline(id=uuid.uuid4(), user_id=default_user_id, name="História")
+    db_session.add(other)
+    db_session.commit()
+
+    assert set_owner_discipline(default_user_id, "note", sample_note.id, other.id, db_session) == count
+
+    with patch("ficous.backend.app.services.embeddings._get_embedding") as mock_emb:
+        mock_emb.return_value = [0.1] * 1536
+        old = retrieve_relevant_chunks("polimorfismo", str(default_user_id), db_session,
+                                       discipline_id=str(sample_discipline.id))
+        new = retrieve_relevant_chunks("polimorfismo", str(default_user_id), db_session,
+                                       discipline_id=str(other.id))
+
+    assert old == []
+    assert len(new) == count
+
+
 def test_retrieve_relevant_chunks_empty_database(db_session, default_user_id):
     """Testa recuperação quando não há embeddings"""
     chunks = retrieve_relevant_chunks(
@@ -201,4 +437,198 @@ def test_perso_score_calculation(db_session, default_user_id, sample_embedding):
         # Com embedding idêntico, similarity ≈ 1.0
         # strength = 0.5, recency = 1.0
         # PersoScore ≈ 1.0 × 0.5 × 1.0 = 0.5
-        assert chunks[0]["perso_score"] > 0
\ No newline at end of file
+        assert chunks[0]["perso_score"] > 0
+
+def test_vectorized_perso_score_matches_scalar():
+    """Testa que o PersoScore vetorizado equivale ao cálculo por linha"""
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    n = 50
+    similarities = rng.random(n)
+    factors = {
+        "strength": rng.random(n),
+        "recency": rng.random(n),
+        "success_rate": rng.random(n),
+        "frequency": rng.integers(0, 20, n).astype(float),
+        "concept_affinity": rng.random(n),
+    }
+
+    scores = calculate_perso_scores(similarities, factors)
+
+    for i in range(n):
+        expected = calculate_advanced_perso_score(
+            similarity=similarities[i],
+            strength=factors["strength"][i],
+            recency=factors["recency"][i],
+            success_rate=factors["success_rate"][i],
+            frequency=factors["frequency"][i],
+            concept_affinity=factors["concept_affinity"][i]
+        )
+        assert scores[i] == pytest.approx(expected)
+
+
+def test_top_k_indices_sorted():
+    """Testa top-k via argpartition em ordem decrescente"""
+    import numpy as np
+
+    scores = np.array([0.1, 0.9, 0.5, 0.7, 0.3])
+    assert _top_k_indices(scores, 3).tolist() == [1, 3, 2]
+    assert _top_k_indices(scores, 10).tolist() == [1, 3, 2, 4, 0]
+    assert _top_k_indices(scores, 0).size == 0
+
+
+def test_retrieve_ranks_most_similar_first(db_session, default_user_id, sample_note):
+    """Testa que a busca em lote ordena pelo vetor mais próximo da query"""
+    import numpy as np
+    from ficous.backend.app import models
+    from ficous.backend.app.services.embeddings import _pack_vector
+
+    base = np.zeros(1536)
+    for i, text in enumerate(["alfa", "beta", "gama"]):
+        vec = base.copy()
+        vec[i] = 1.0
+        db_session.add(models.Embedding(
+            user_id=default_user_id,
+            owner_type="note",
+            owner_id=sample_note.id,
+            chunk_text=text,
+            vector_f32=_pack_vector(vec.tolist()),
+            strength=0.5,
+            meta={}
+        ))
+    db_session.commit()
+
+    query = base.copy()
+    query[1] = 1.0
+    query[2] = 0.5
+    with patch("ficous.backend.app.services.embeddings._get_embedding") as mock_emb:
+        mock_emb.return_value = query.tolist()
+        chunks = retrieve_relevant_chunks("beta", str(default_user_id), db_session, top_k=2)
+
+    assert [c["chunk_text"] for c in chunks] == ["beta", "gama"]
+    assert chunks[0]["similarity"] > chunks[1]["similarity"]
+
+
+def test_recency_scores_half_life(monkeypatch):
+    """Testa o decaimento por meia-vida calculado sobre todo o vetor de created_at"""
+    import numpy as np
+    from ficous.backend.app.services import embeddings
+
+    monkeypatch.setattr(embeddings, "RAG_RECENCY_HALF_LIFE_DAYS", 10.0)
+    now = 1_000_000_000.0
+    created = np.array([now, now - 10 * 86400, now - 20 * 86400, np.nan, now + 3600])
+
+    assert recency_scores(created, now).tolist() == pytest.approx([1.0, 0.5, 0.25, 1.0, 1.0])
+
+    monkeypatch.setattr(embeddings, "RAG_RECENCY_HALF_LIFE_DAYS", 0.0)
+    assert recency_scores(created, now).tolist() == [1.0] * 5
+
+
+def test_retrieve_uses_typed_factors_and_recency(db_session, default_user_id, sample_note):
+    """Testa que strength vem da coluna e que chunks antigos perdem para os recentes"""
+    import numpy as np
+    from datetime import datetime, timedelta
+    from ficous.backend.app.services.embeddings import _pack_vector
+
+    vec = np.zeros(1536)
+    vec[0] = 1.0
+    now = datetime.utcnow()
+    for text, strength, age_days in [("antigo", 0.9, 120), ("recente", 0.9, 0), ("fraco", 0.1, 0)]:
+        db_session.add(models.Embedding(
+            user_id=default_user_id,
+            owner_type="note",
+            owner_id=sample_note.id,
+            chunk_text=text,
+            vector_f32=_pack_vector(vec.tolist()),
+            strength=strength,
+            created_at=now - timedelta(days=age_days),
+            meta={}
+        ))
+    db_session.commit()
+
+    with patch("ficous.backend.app.services.embeddings._get_embedding") as mock_emb:
+        mock_emb.return_value = vec.tolist()
+        chunks = retrieve_relevant_chunks("consulta", str(default_user_id), db_session, top_k=3)
+
+    assert chunks[0]["chunk_text"] == "recente"
+    by_text = {c["chunk_text"]: c for c in chunks}
+    assert by_text["recente"]["factors"]["strength"] == pytest.approx(0.9)
+    assert by_text["antigo"]["factors"]["recency"] < 0.1
+    assert by_text["recente"]["factors"]["recency"] == pytest.approx(1.0, abs=1e-3)
+
+
+def test_incremental_reindex_only_touches_changed_chunks(db_session, sample_note):
+    """Testa que a reindexação incremental preserva chunks inalterados"""
+    from ficous.backend.app import models
+
+    paragraphs = [f"Parágrafo {i} sobre polimorfismo e herança em POO. " * 20 for i in range(4)]
+    sample_note.content = "\n".join(paragraphs)
+    db_session.commit()
+
+    with patch("ficous.backend.app.services.embeddings._request_embeddings") as mock_emb:
+        mock_emb.side_effect = lambda texts: [[0.1] * 1536 for _ in texts]
+        index_note_content(sample_note, db_session)
+        before = {
+            e.content_hash: e.id for e in
+            db_session.query(models.Embedding).filter(models.Embedding.owner_id == sample_note.id)
+        }
+
+        # Edita apenas o último parágrafo
+        paragraphs[-1] = "Conteúdo totalmente novo sobre interfaces. " * 20
+        sample_note.content = "\n".join(paragraphs)
+        db_session.commit()
+        mock_emb.reset_mock()
+        index_note_content(sample_note, db_session)
+
+    after = {
+        e.content_hash: e.id for e in
+        db_session.query(models.Embedding).filter(models.Embedding.owner_id == sample_note.id)
+    }
+    kept = set(before) & set(after)
+    assert kept  # chunks iguais mantêm a mesma linha
+    assert all(before[h] == after[h] for h in kept)
+    embedded = mock_emb.call_args[0][0]
+    assert len(embedded) == len(set(after) - kept)
+
+
+def test_full_reindex_replaces_all_rows(db_session, sample_note):
+    """Testa o modo completo (delete + reinsert)"""
+    from ficous.backend.app import models
+
+    with patch("ficous.backend.app.services.embeddings._request_embeddings") as mock_emb:
+        mock_emb.side_effect = lambda texts: [[0.1] * 1536 for _ in texts]
+        index_note_content(sample_note, db_session)
+        ids_before = {e.id for e in db_session.query(models.Embedding)}
+        index_note_content(sample_note, db_session, incremental=False)
+        ids_after = {e.id for e in db_session.query(models.Embedding)}
+
+    assert ids_before and ids_after
+    assert not ids_before & ids_after
+
+
+def test_sync_owner_chunks_streams_in_windows(db_session, sample_note, monkeypatch):
+    """Testa que o gerador de chunks é consumido em janelas, com um lote de embeddings por janela"""
+    from ficous.backend.app import models
+
+    monkeypatch.setattr(embeddings, "EMBEDDING_SYNC_WINDOW", 2)
+    sample_note.content = "\n".join(f"Frase número {i} sobre herança." for i in range(5))
+    db_session.commit()
+    chunks = (chunk for chunk in ["um", "dois", "um", "tres", "quatro"])
+
+    with patch("ficous.backend.app.services.embeddings._request_embeddings") as mock_emb:
+        mock_emb.side_effect = lambda texts: [[0.1] * 1536 for _ in texts]
+        count = embeddings._sync_owner_chunks(
+            sample_note.user_id, "note", sample_note.id, chunks, [], db_session
+        )
+        batches = [call[0][0] for call in mock_emb.call_args_list]
+        mock_emb.reset_mock()
+        again = embeddings._sync_owner_chunks(
+            sample_note.user_id, "note", sample_note.id, iter(["um", "dois", "um", "tres", "quatro"]), [], db_session
+        )
+
+    assert count == again == 5
+    assert batches == [["um", "dois"], ["tres"], ["quatro"]]
+    assert mock_emb.call_count == 0
+    rows = db_session.query(models.Embedding).filter(models.Embedding.owner_id == sample_note.id).count()
+    assert rows == 5
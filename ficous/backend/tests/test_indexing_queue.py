@@ -0,0 +1,161 @@
+"""
+Testes para a fila de indexação em background
+"""
+import uuid
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from ficous.backend.app import models
+from ficous.backend.app.services import indexing_queue
+from ficous.backend.app.services.indexing_queue import (
+    enqueue_indexing,
+    process_indexing_jobs,
+    recover_indexing_jobs
+)
+
+
+def _no_workers(monkeypatch):
+    """Mantém os jobs na fila para o teste processar de forma síncrona"""
+    monkeypatch.setattr(indexing_queue, "INDEXING_MODE", "background")
+    monkeypatch.setattr(indexing_queue, "INDEXING_WORKERS", 0)
+
+
+def test_enqueue_coalesces_pending_jobs(db_session, sample_note, default_user_id, monkeypatch):
+    """Testa que saves repetidos da mesma nota geram um único job pendente"""
+    _no_workers(monkeypatch)
+
+    first = enqueue_indexing(default_user_id, "note", sample_note.id, db_session)
+    second = enqueue_indexing(default_user_id, "note", sample_note.id, db_session)
+
+    assert first.id == second.id
+    assert db_session.query(models.IndexingJob).count() == 1
+
+
+def test_process_indexes_and_marks_done(db_session, sample_note, default_user_id, monkeypatch):
+    """Testa que o worker indexa a nota e conclui o job"""
+    _no_workers(monkeypatch)
+    job = enqueue_indexing(default_user_id, "note", sample_note.id, db_session)
+
+    with patch("ficous.backend.app.services.embeddings._request_embeddings") as mock_emb:
+        mock_emb.side_effect = lambda texts: [[0.1] * 1536 for _ in texts]
+        assert process_indexing_jobs(db_session) == 1
+
+    db_session.refresh(job)
+    assert job.status == "done"
+    assert job.attempts == 1
+    assert db_session.query(models.Embedding).filter(models.Embedding.owner_id == sample_note.id).count() > 0
+
+
+def test_failed_embedding_retries_with_backoff(db_session, sample_note, default_user_id, monkeypatch):
+    """Testa que chunks sem vetor re-agendam o job e, esgotadas as tentativas, ele falha"""
+    _no_workers(monkeypatch)
+    monkeypatch.setattr(indexing_queue, "INDEXING_MAX_ATTEMPTS", 2)
+    job = enqueue_indexing(default_user_id, "note", sample_note.id, db_session)
+
+    with patch("ficous.backend.app.services.embeddings._request_embeddings") as mock_emb:
+        mock_emb.side_effect = lambda texts: [None for _ in texts]
+        assert process_indexing_jobs(db_session) == 1
+        db_session.refresh(job)
+        assert job.status == "pending"
+        assert job.attempts == 1
+        assert "sem embedding" in job.last_error
+        assert job.next_run_at.replace(tzinfo=None) > datetime.utcnow()
+
+        # Ainda em backoff: nada a processar
+        assert process_indexing_jobs(db_session) == 0
+
+        job.next_run_at = datetime.utcnow()
+        db_session.commit()
+        assert process_indexing_jobs(db_session) == 1
+
+    db_session.refresh(job)
+    assert job.status == "failed"
+    assert job.attempts == 2
+
+
+def test_job_for_deleted_note_completes(db_session, sample_note, default_user_id, monkeypatch):
+    """Testa que nota excluída antes do worker não deixa o job preso"""
+    _no_workers(monkeypatch)
+    job = enqueue_indexing(default_user_id, "note", sample_note.id, db_session)
+    db_session.delete(sample_note)
+    db_session.commit()
+
+    assert process_indexing_jobs(db_session) == 1
+    db_session.refresh(job)
+    assert job.status == "done"
+
+
+def test_create_note_enqueues_and_reports_status(client, db_session, sample_discipline, monkeypatch):
+    """Testa que POST /notes responde sem indexar e o status mostra o job pendente"""
+    from ficous.backend.app.routers import admin, notes
+    monkeypatch.setattr(admin, "ADMIN_ENABLED", True)  # test_admin recarrega o módulo desabilitado
+    _no_workers(monkeypatch)
+    monkeypatch.setenv("SAGE_AUTO_PROCESS", "true")
+
+    async def summarize(content, output_language=None):
+        return SimpleNamespace(summary="Resumo", questions=[])
+
+    async def extract(content, output_language=None):
+        return [], []
+
+    monkeypatch.setattr(notes, "_call_openai_summarize_and_questions", summarize)
+    monkeypatch.setattr(notes, "_extract_concepts_and_tags", extract)
+
+    response = client.post("/ficous/notes/", json={
+        "discipline_id": str(sample_discipline.id),
+        "title": "Herança",
+        "content": "Herança permite reaproveitar comportamento entre classes."
+    })
+    assert response.status_code == 200
+    assert db_session.query(models.Embedding).count() == 0
+
+    status = client.get("/ficous/admin/indexing-status").json()
+
+    assert status["totals"]["pending"] == 1
+    assert status["owners"][0]["owner_id"] == response.json()["id"]
+    assert status["owners"][0]["pending"] == 1
+
+
+def test_recover_resets_only_expired_leases(db_session, default_user_id, monkeypatch):
+    """Testa que a recuperação não toma jobs running com heartbeat recente (outro processo vivo)"""
+    _no_workers(monkeypatch)
+    monkeypatch.setattr(indexing_queue, "INDEXING_LEASE_SECONDS", 60)
+    now = datetime.utcnow()
+    alive, crashed = [
+        models.IndexingJob(
+            user_id=default_user_id, owner_type="note", owner_id=uuid.uuid4(),
+            status="running", attempts=0, updated_at=updated_at
+        )
+        for updated_at in (now, now - timedelta(seconds=120))
+    ]
+    db_session.add_all([alive, crashed])
+    db_session.commit()
+
+    assert recover_indexing_jobs(db_session) == 1
+
+    db_session.refresh(alive)
+    db_session.refresh(crashed)
+    assert alive.status == "running"
+    assert crashed.status == "pending"
+
+
+def test_inline_mode_processes_only_enqueued_job(db_session, sample_note, default_user_id, monkeypatch):
+    """Testa que o modo inline roda só o job da requisição, sem esvaziar a fila dos outros"""
+    _no_workers(monkeypatch)
+    other = models.IndexingJob(
+        user_id=uuid.uuid4(), owner_type="note", owner_id=uuid.uuid4(),
+        status="pending", attempts=0, next_run_at=datetime.utcnow()
+    )
+    db_session.add(other)
+    db_session.commit()
+    monkeypatch.setattr(indexing_queue, "INDEXING_MODE", "inline")
+
+    with patch("ficous.backend.app.services.embeddings._request_embeddings") as mock_emb:
+        mock_emb.side_effect = lambda texts: [[0.1] * 1536 for _ in texts]
+        job = enqueue_indexing(default_user_id, "note", sample_note.id, db_session)
+
+    db_session.refresh(job)
+    db_session.refresh(other)
+    assert job.status == "done"
+    assert other.status == "pending"
@@ -75,7 +75,7 @@ def test_rag_with_multiple_notes(client, sample_discipline):
                     notes.append(response.json()["id"])
     
     # Consultar Sage (deve usar RAG para buscar em todas as notas)
-    with patch("ficous.backend.app.routers.sage.retrieve_relevant_chunks") as mock_rag:
+    with patch("ficous.backend.app.routers.sage.retrieve_relevant_chunks_async") as mock_rag:
         mock_rag.return_value = [
             {"chunk_text": "Chunk relevante", "similarity": 0.9, "perso_score": 0.85}
         ]
@@ -205,8 +205,9 @@ def test_admin_workflow(client, sample_note, sample_embedding):
     assert response.status_code == 200
     
     # 2. Reindexar conteúdo
-    with patch("ficous.backend.app.routers.admin.index_note_content"):
-        response = client.post("/ficous/admin/index-content?content_type=notes")
+    with patch("ficous.backend.app.services.bulk_reindex.index_note_content") as mock:
+        mock.return_value = 0
+        response = client.post("/ficous/admin/index-content?content_type=notes&wait=true")
         assert response.status_code == 200
     
     # 3. Rebuild summaries
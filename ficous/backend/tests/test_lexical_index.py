@@ -0,0 +1,163 @@
+"""
+Testes para o índice BM25 e a recuperação híbrida/léxica
+"""
+import uuid
+import threading
+from unittest.mock import patch
+
+from ficous.backend.app import models
+from ficous.backend.app.services import embeddings
+from ficous.backend.app.services.embeddings import index_note_content, retrieve_relevant_chunks
+from ficous.backend.app.services.lexical_index import (
+    BM25Index,
+    tokenize,
+    get_user_lexical_index,
+    bump_lexical_version
+)
+from ficous.backend.app.services.vector_cache import bump_corpus_version
+from ficous.backend.app.services.embedding_gc import delete_owner_embeddings
+
+
+def _add_embedding(db_session, user_id, owner_id, text, vector):
+    emb = models.Embedding(
+        id=uuid.uuid4(),
+        user_id=user_id,
+        owner_type="note",
+        owner_id=owner_id,
+        chunk_text=text,
+        vector_f32=embeddings._pack_vector(vector),
+        meta={}
+    )
+    db_session.add(emb)
+    db_session.commit()
+    return emb
+
+
+def test_tokenize_folds_accents_and_drops_stopwords():
+    """Testa normalização de acentos/caixa e remoção de stopwords"""
+    assert tokenize("A Fotossíntese das Plantas") == ["fotossintese", "plantas"]
+    assert tokenize("fotossintese") == tokenize("FOTOSSÍNTESE")
+
+
+def test_bm25_ranks_matching_documents():
+    """Testa que termos raros e repetidos pesam mais no ranking"""
+    index = BM25Index()
+    index.add("a", "n1", "mitocôndria produz energia celular", "bio")
+    index.add("b", "n1", "energia cinética e energia potencial", "bio")
+    index.add("c", "n2", "revolução francesa", "hist")
+
+    hits = index.search("mitocondria energia", limit=3)
+
+    assert [doc_id for doc_id, _ in hits] == ["a", "b"]
+    assert index.search("mitocondria", limit=3, discipline_id="hist") == []
+
+
+def test_bm25_remove():
+    """Testa remoção incremental de documentos"""
+    index = BM25Index()
+    index.add("a", "n1", "polimorfismo herança")
+    index.add("b", "n2", "polimorfismo encapsulamento")
+
+    index.remove(["a"])
+    assert [doc_id for doc_id, _ in index.search("polimorfismo", 5)] == ["b"]
+    assert "heranca" not in index.postings
+
+    index.remove(["b"])
+    assert len(index) == 0
+    assert index.total_length == 0
+
+
+def test_bm25_search_while_updating_from_other_thread():
+    """Testa que pontuar durante atualizações de outra thread não quebra a iteração"""
+    index = BM25Index()
+    for i in range(200):
+        index.add(f"base{i}", "n1", "polimorfismo herança")
+    errors = []
+
+    def writer():
+        try:
+            for i in range(2000):
+                index.add(f"doc{i}", "n2", "polimorfismo encapsulamento")
+                if i % 2:
+                    index.remove([f"doc{i - 1}"])
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        while thread.is_alive():
+            index.search("polimorfismo", 5)
+    except Exception as e:
+        errors.append(e)
+    thread.join()
+
+    assert errors == []
+
+
+def test_lexical_fallback_when_embedding_unavailable(db_session, sample_note, default_user_id):
+    """Testa que /sage continua com contexto quando o provedor de embeddings cai"""
+    with patch("ficous.backend.app.services.embeddings._request_embeddings") as mock_emb:
+        mock_emb.side_effect = lambda texts: [[0.1] * 1536 for _ in texts]
+        index_note_content(sample_note, db_session)
+
+    with patch("ficous.backend.app.services.embeddings._get_embedding") as mock_query:
+        mock_query.return_value = None
+        chunks = retrieve_relevant_chunks("polimorfismo OOP", str(default_user_id), db_session)
+
+    assert chunks
+    assert "Polimorfismo" in chunks[0]["chunk_text"]
+
+
+def test_query_breaker_skips_provider_after_failures(db_session, sample_note, default_user_id):
+    """Testa que falhas consecutivas abrem o circuito e evitam novas chamadas ao provedor"""
+    with patch("ficous.backend.app.services.embeddings._get_embedding") as mock_query:
+        mock_query.return_value = None
+        for _ in range(6):
+            retrieve_relevant_chunks("polimorfismo", str(default_user_id), db_session)
+
+    assert mock_query.call_count == 5
+
+
+def test_hybrid_lexical_match_breaks_vector_tie(db_session, sample_note, default_user_id, monkeypatch):
+    """Testa que, com similaridade vetorial igual, o acerto léxico vence"""
+    monkeypatch.setattr(embeddings, "RAG_RETRIEVAL_MODE", "hybrid")
+    vector = [1.0] + [0.0] * 1535
+    _add_embedding(db_session, default_user_id, sample_note.id, "revolução francesa", vector)
+    _add_embedding(db_session, default_user_id, sample_note.id, "mitocôndria e respiração celular", vector)
+
+    with patch("ficous.backend.app.services.embeddings._get_embedding") as mock_query:
+        mock_query.return_value = vector
+        chunks = retrieve_relevant_chunks("mitocondria", str(default_user_id), db_session, top_k=2)
+
+    assert chunks[0]["chunk_text"] == "mitocôndria e respiração celular"
+    assert chunks[0]["similarity"] == chunks[1]["similarity"]
+    assert chunks[0]["perso_score"] > chunks[1]["perso_score"]
+
+
+def test_lexical_index_follows_indexing_and_delete(db_session, sample_note, default_user_id):
+    """Testa manutenção incremental do índice na indexação e na exclusão"""
+    index = get_user_lexical_index(str(default_user_id), db_session)
+    assert len(index) == 0
+
+    with patch("ficous.backend.app.services.embeddings._request_embeddings") as mock_emb:
+        mock_emb.side_effect = lambda texts: [[0.1] * 1536 for _ in texts]
+        count = index_note_content(sample_note, db_session)
+
+    index = get_user_lexical_index(str(default_user_id), db_session)
+    assert len(index) == count
+    assert index.search("polimorfismo", 5)
+
+    delete_owner_embeddings(default_user_id, "note", [sample_note.id], db_session)
+    assert get_user_lexical_index(str(default_user_id), db_session) is index
+    assert index.search("polimorfismo", 5) == []
+
+
+def test_bump_lexical_version_keeps_index(db_session, default_user_id):
+    """Testa que uma nova versão do corpus sem mudança de texto não reconstrói o índice"""
+    index = get_user_lexical_index(str(default_user_id), db_session)
+
+    bump_corpus_version(str(default_user_id))
+    bump_lexical_version(str(default_user_id))
+
+    assert get_user_lexical_index(str(default_user_id), db_session) is index
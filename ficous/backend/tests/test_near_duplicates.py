@@ -0,0 +1,152 @@
+"""
+Testes para a supressão de quase-duplicatas na indexação (referências à linha canônica)
+"""
+import uuid
+import numpy as np
+from unittest.mock import patch
+
+from ficous.backend.app import models
+from ficous.backend.app.services import embeddings
+from ficous.backend.app.services.embedding_gc import collect_orphan_embeddings, delete_owner_embeddings
+
+LECTURE = "Polimorfismo permite que objetos de classes diferentes respondam à mesma mensagem."
+
+
+def _vector(seed):
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal(1536).tolist()
+
+
+def _index(owner, db_session, vector):
+    index = embeddings.index_note_content if isinstance(owner, models.Note) else embeddings.index_source_content
+    with patch("ficous.backend.app.services.embeddings._request_embeddings") as mock_emb:
+        mock_emb.side_effect = lambda texts: [vector for _ in texts]
+        return index(owner, db_session)
+
+
+def _source(db_session, user_id, discipline_id, text=LECTURE):
+    source = models.Source(
+        id=uuid.uuid4(),
+        user_id=user_id,
+        discipline_id=discipline_id,
+        filename="aula.pdf",
+        content_excerpt=text
+    )
+    db_session.add(source)
+    db_session.commit()
+    return source
+
+
+def _rows(db_session, owner_id):
+    return db_session.query(models.Embedding).filter(models.Embedding.owner_id == owner_id).all()
+
+
+def _retrieve(user_id, db_session, vector):
+    with patch("ficous.backend.app.services.embeddings._get_embedding", return_value=vector):
+        return embeddings.retrieve_relevant_chunks("polimorfismo", str(user_id), db_session, top_k=5)
+
+
+def test_duplicate_chunk_is_stored_as_reference(db_session, default_user_id, sample_note):
+    """Testa que o PDF com o mesmo conteúdo da nota não ganha vetor próprio e volta expandido"""
+    vector = _vector(0)
+    _index(sample_note, db_session, vector)
+    source = _source(db_session, default_user_id, sample_note.discipline_id)
+    _index(source, db_session, vector)
+
+    canonical = _rows(db_session, sample_note.id)
+    refs = _rows(db_session, source.id)
+    assert refs and all(r.vector_f32 is None and r.canonical_id is not None for r in refs)
+    assert {str(r.canonical_id) for r in refs} <= {str(c.id) for c in canonical}
+    assert embeddings.count_pending_embeddings(db_session, user_id=default_user_id) == 0
+    assert len(embeddings.get_user_vector_matrix(str(default_user_id), db_session)) == len(canonical)
+
+    chunks = _retrieve(default_user_id, db_session, vector)
+    assert len(chunks) == len(canonical)
+    assert {o["owner_id"] for o in chunks[0]["owners"]} == {str(sample_note.id), str(source.id)}
+
+
+def test_distinct_or_other_discipline_chunks_keep_their_vectors(db_session, default_user_id, sample_note):
+    """Testa que conteúdo diferente ou de outra disciplina não vira referência"""
+    _index(sample_note, db_session, _vector(0))
+    different = _source(db_session, default_user_id, sample_note.discipline_id, text="Outro assunto.")
+    _index(different, db_session, _vector(1))
+    other_discipline = models.Discipline(id=uuid.uuid4(), user_id=default_user_id, name="Outra")
+    db_session.add(other_discipline)
+    db_session.commit()
+    elsewhere = _source(db_session, default_user_id, other_discipline.id)
+    _index(elsewhere, db_session, _vector(0))
+
+    assert all(r.canonical_id is None and r.vector_f32 for r in _rows(db_session, different.id))
+    assert all(r.canonical_id is None and r.vector_f32 for r in _rows(db_session, elsewhere.id))
+
+
+def test_deleting_canonical_owner_promotes_reference(db_session, default_user_id, sample_note):
+    """Testa que excluir a nota canônica passa o vetor para a referência, que segue buscável"""
+    vector = _vector(0)
+    _index(sample_note, db_session, vector)
+    source = _source(db_session, default_user_id, sample_note.discipline_id)
+    _index(source, db_session, vector)
+
+    delete_owner_embeddings(default_user_id, "note", [sample_note.id], db_session)
+
+    rows = _rows(db_session, source.id)
+    assert rows and all(r.canonical_id is None and r.vector_f32 for r in rows)
+    chunks = _retrieve(default_user_id, db_session, vector)
+    assert chunks and all(c["owner_id"] == str(source.id) for c in chunks)
+    assert embeddings.get_user_lexical_index(str(default_user_id), db_session).search("polimorfismo", 5)
+
+
+def test_moving_reference_owner_materializes_vectors(db_session, default_user_id, sample_note):
+    """Testa que a referência que muda de disciplina ganha vetor próprio"""
+    vector = _vector(0)
+    _index(sample_note, db_session, vector)
+    source = _source(db_session, default_user_id, sample_note.discipline_id)
+    _index(source, db_session, vector)
+    other = models.Discipline(id=uuid.uuid4(), user_id=default_user_id, name="Outra")
+    db_session.add(other)
+    db_session.commit()
+
+    embeddings.set_owner_discipline(default_user_id, "source", source.id, other.id, db_session)
+
+    rows = _rows(db_session, source.id)
+    assert rows and all(r.canonical_id is None and r.vector_f32 for r in rows)
+    with patch("ficous.backend.app.services.embeddings._get_embedding", return_value=vector):
+        chunks = embeddings.retrieve_relevant_chunks(
+            "polimorfismo", str(default_user_id), db_session, top_k=5, discipline_id=str(other.id)
+        )
+    assert chunks and all(c["owner_id"] == str(source.id) for c in chunks)
+
+
+def test_canonical_deleted_behind_stale_matrix_is_not_referenced(db_session, default_user_id, sample_note):
+    """Testa que a canônica vista na matriz em cache, mas já removida do banco, não vira referência"""
+    vector = _vector(0)
+    _index(sample_note, db_session, vector)
+    embeddings.get_user_vector_matrix(str(default_user_id), db_session)  # matriz em cache
+    # Outro processo removeu os chunks da nota (sem passar pelo cache deste processo)
+    db_session.query(models.Embedding).filter(models.Embedding.owner_id == sample_note.id).delete()
+    db_session.commit()
+
+    source = _source(db_session, default_user_id, sample_note.discipline_id)
+    _index(source, db_session, vector)
+
+    rows = _rows(db_session, source.id)
+    assert rows and all(r.canonical_id is None and r.vector_f32 for r in rows)
+
+
+def test_gc_makes_dangling_references_pending(db_session, default_user_id, sample_note):
+    """Testa que referências cuja canônica sumiu voltam a ser pendentes (re-embedding)"""
+    vector = _vector(0)
+    _index(sample_note, db_session, vector)
+    source = _source(db_session, default_user_id, sample_note.discipline_id)
+    _index(source, db_session, vector)
+    # Canônica removida sem release_references (SQLite não aplica o ON DELETE SET NULL)
+    db_session.query(models.Embedding).filter(models.Embedding.owner_id == sample_note.id).delete()
+    db_session.commit()
+    assert embeddings.count_pending_embeddings(db_session, user_id=default_user_id) == 0
+
+    report = collect_orphan_embeddings(db_session)
+
+    refs = _rows(db_session, source.id)
+    assert report["dangling_references"] == len(refs)
+    assert all(r.canonical_id is None for r in refs)
+    assert embeddings.count_pending_embeddings(db_session, user_id=default_user_id) == len(refs)
@@ -0,0 +1,121 @@
+"""
+Testes para o pool HTTP compartilhado das chamadas OpenAI
+"""
+import json
+import asyncio
+import weakref
+import httpx
+
+from ficous.backend.app.services import openai_client
+from ficous.backend.app.routers.sage import _call_openai_summarize_and_questions
+
+
+def _mock_pool(monkeypatch, reply):
+    """Coloca no pool um cliente com transporte simulado; devolve as requisições feitas"""
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        return httpx.Response(200, json={"choices": [{"message": {"content": reply}}]})
+
+    transport = httpx.MockTransport(handler)
+    monkeypatch.setattr(openai_client, "_client", httpx.Client(transport=transport))
+    monkeypatch.setattr(openai_client, "get_async_http_client", lambda: httpx.AsyncClient(transport=transport))
+    return seen
+
+
+def test_get_http_client_is_shared_and_reopened(monkeypatch):
+    """Testa que todas as chamadas reutilizam o mesmo cliente e que close recria o pool"""
+    monkeypatch.setattr(openai_client, "_client", None)
+
+    client = openai_client.get_http_client()
+    assert openai_client.get_http_client() is client
+
+    openai_client.close_http_client()
+    assert client.is_closed
+    reopened = openai_client.get_http_client()
+    assert reopened is not client
+    openai_client.close_http_client()
+
+
+def test_chat_completion_uses_pool(monkeypatch):
+    """Testa endpoint, autenticação e payload das chamadas pelo pool"""
+    seen = _mock_pool(monkeypatch, "ok")
+
+    assert openai_client.chat_completion("sys", "user", timeout=5) == "ok"
+    assert openai_client.call_openai_api_simple("sys", "outra") == "ok"
+
+    assert len(seen) == 2
+    assert str(seen[0].url) == f"{openai_client.OPENAI_API_BASE}/chat/completions"
+    assert seen[0].headers["Authorization"] == "Bearer test-key"
+    body = json.loads(seen[0].content)
+    assert body["messages"][1] == {"role": "user", "content": "user"}
+
+
+def test_async_client_is_shared_per_event_loop(monkeypatch):
+    """Testa que o AsyncClient é reutilizado no mesmo loop, separado por loop e fechado no shutdown"""
+    monkeypatch.setattr(openai_client, "_async_clients", weakref.WeakKeyDictionary())
+
+    async def lookups_then_close():
+        first = openai_client.get_async_http_client()
+        second = openai_client.get_async_http_client()
+        await openai_client.aclose_async_http_client()
+        return first, second
+
+    first, second = asyncio.run(lookups_then_close())
+    assert first is second
+    assert first.is_closed
+    other, _ = asyncio.run(lookups_then_close())
+    assert other is not first
+    assert len(openai_client._async_clients) == 0
+
+
+def test_async_clients_do_not_replace_each_other_across_loops(monkeypatch):
+    """Testa que um loop novo não sobrescreve (e vaza) o cliente de outro loop"""
+    monkeypatch.setattr(openai_client, "_async_clients", weakref.WeakKeyDictionary())
+    first_loop = asyncio.new_event_loop()
+    second_loop = asyncio.new_event_loop()
+
+    async def lookup():
+        return openai_client.get_async_http_client()
+
+    try:
+        first = first_loop.run_until_complete(lookup())
+        second = second_loop.run_until_complete(lookup())
+        assert first is not second
+        assert first_loop.run_until_complete(lookup()) is first
+
+        first_loop.run_until_complete(openai_client.aclose_async_http_client())
+        second_loop.run_until_complete(openai_client.aclose_async_http_client())
+        assert first.is_closed and second.is_closed
+    finally:
+        first_loop.close()
+        second_loop.close()
+
+
+def test_achat_completion_uses_async_pool(monkeypatch):
+    """Testa a chamada async pelo mesmo endpoint/autenticação"""
+    seen = _mock_pool(monkeypatch, "ok")
+
+    assert asyncio.run(openai_client.achat_completion("sys", "user")) == "ok"
+    assert seen[0].headers["Authorization"] == "Bearer test-key"
+
+
+def test_summarize_parses_model_json(monkeypatch):
+    """Testa que o resumo devolvido pelo modelo é aproveitado (antes a função retornava None)"""
+    _mock_pool(monkeypatch, json.dumps({"summary": "Resumo.", "questions": ["Q1?", "Q2?"]}))
+
+    result = asyncio.run(_call_openai_summarize_and_questions("texto qualquer"))
+
+    assert result.summary == "Resumo."
+    assert result.questions == ["Q1?", "Q2?"]
+
+
+def test_summarize_caps_questions_and_falls_back_on_empty_summary(monkeypatch):
+    """Testa o limite de 5 perguntas e o resumo de fallback quando o modelo não resume"""
+    _mock_pool(monkeypatch, json.dumps({"summary": "", "questions": [f"Q{i}?" for i in range(8)]}))
+
+    result = asyncio.run(_call_openai_summarize_and_questions("texto qualquer"))
+
+    assert result.summary == "texto qualquer"
+    assert len(result.questions) == 5
@@ -0,0 +1,114 @@
+"""
+Testes para o backend pgvector (o banco de testes é SQLite)
+"""
+import pytest
+import uuid
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from types import SimpleNamespace
+from unittest.mock import patch
+from ficous.backend.app.services import pgvector_backend
+from ficous.backend.app.services.pgvector_backend import pgvector_enabled, to_vector_literal
+from ficous.backend.app.services.embeddings import retrieve_relevant_chunks
+
+
+def test_pgvector_disabled_on_sqlite(db_session):
+    """Testa que em SQLite o caminho NumPy é mantido"""
+    assert pgvector_enabled(db_session) is False
+
+
+def test_to_vector_literal():
+    """Testa formato textual aceito pelo pgvector"""
+    assert to_vector_literal(np.array([0.5, -1.0, 2.0], dtype=np.float32)) == "[0.5,-1,2]"
+
+
+def test_retrieve_reranks_pgvector_candidates(db_session, default_user_id):
+    """Testa que os candidatos do banco são re-ranqueados com PersoScore"""
+    owner = uuid.uuid4()
+    now = datetime.now(timezone.utc)
+    candidates = [
+        {"id": uuid.uuid4(), "owner_type": "note", "owner_id": owner, "chunk_text": "fraco",
+         "meta": {}, "strength": 0.0, "created_at": now - timedelta(days=365), "similarity": 0.95},
+        {"id": uuid.uuid4(), "owner_type": "note", "owner_id": owner, "chunk_text": "forte",
+         "meta": {}, "strength": 1.0, "created_at": now, "similarity": 0.90},
+    ]
+
+    with patch("ficous.backend.app.services.embeddings.pgvector_enabled", return_value=True), \
+         patch("ficous.backend.app.services.embeddings.pgvector_search", return_value=candidates) as mock_search, \
+         patch("ficous.backend.app.services.embeddings._get_embedding", return_value=[0.1] * 1536):
+        chunks = retrieve_relevant_chunks("consulta", str(default_user_id), db_session, top_k=1)
+
+    assert mock_search.call_args.kwargs["limit"] >= 1
+    assert [c["chunk_text"] for c in chunks] == ["forte"]
+    assert chunks[0]["similarity"] == pytest.approx(0.90)
+
+
+class _FakePgSession:
+    """Simula o HNSW global: com index scan, os vizinhos globais são de outro usuário"""
+
+    def __init__(self, extversion, minority_rows, hnsw_complete=False):
+        self.extversion = extversion
+        self.minority_rows = minority_rows
+        self.hnsw_complete = hnsw_complete
+        self.statements = []
+        self.indexscan = True
+
+    def get_bind(self):
+        return SimpleNamespace(url=f"postgresql://fake/{self.extversion}", dialect=SimpleNamespace(name="postgresql"))
+
+    def execute(self, clause, params=None):
+        sql = str(clause)
+        self.statements.append(sql)
+        if "enable_indexscan = off" in sql:
+            self.indexscan = False
+        elif "enable_indexscan = on" in sql:
+            self.indexscan = True
+        rows = []
+        if "extversion" in sql:
+            rows = [(self.extversion,)]
+        elif "count(*)" in sql:
+            rows = [(min(len(self.minority_rows), params["limit"]),)]
+        elif "FROM ficous_embeddings" in sql:
+            iterative = any("iterative_scan" in s for s in self.statements)
+            hnsw_misses = self.indexscan and not iterative and not self.hnsw_complete
+            rows = [] if hnsw_misses else self.minority_rows
+        result = SimpleNamespace(first=lambda: rows[0] if rows else None, scalar=lambda: rows[0][0] if rows else None)
+        result.mappings = lambda: SimpleNamespace(all=lambda: list(rows))
+        return result
+
+
+def _minority_rows():
+    return [
+        {"id": uuid.uuid4(), "chunk_text": "perto", "similarity": 0.8},
+        {"id": uuid.uuid4(), "chunk_text": "mais perto", "similarity": 0.9},
+    ]
+
+
+def test_search_minority_tenant_falls_back_to_exact_scan():
+    """Testa que em pgvector < 0.8 o usuário minoritário recebe resultados pela busca exata"""
+    db = _FakePgSession("0.7.4", _minority_rows())
+    rows = pgvector_backend.search(db, uuid.uuid4(), np.ones(3, dtype=np.float32), limit=5)
+
+    assert [r["chunk_text"] for r in rows] == ["mais perto", "perto"]
+    assert any("enable_indexscan = off" in s for s in db.statements)
+    assert not any("iterative_scan" in s for s in db.statements)
+
+
+def test_search_small_tenant_skips_exact_scan():
+    """Testa que a busca não é refeita quando o HNSW já devolveu todas as linhas do escopo"""
+    db = _FakePgSession("0.7.4", _minority_rows(), hnsw_complete=True)
+    rows = pgvector_backend.search(db, uuid.uuid4(), np.ones(3, dtype=np.float32), limit=5)
+
+    assert len(rows) == 2
+    assert any("count(*)" in s for s in db.statements)
+    assert not any("enable_indexscan = off" in s for s in db.statements)
+
+
+def test_search_uses_iterative_scan_on_recent_pgvector():
+    """Testa que em pgvector >= 0.8 a varredura iterativa é ligada"""
+    db = _FakePgSession("0.8.0", _minority_rows())
+    rows = pgvector_backend.search(db, uuid.uuid4(), np.ones(3, dtype=np.float32), limit=2)
+
+    assert [r["chunk_text"] for r in rows] == ["mais perto", "perto"]
+    assert any("hnsw.iterative_scan = relaxed_order" in s for s in db.statements)
+    assert not any("enable_indexscan = off" in s for s in db.statements)
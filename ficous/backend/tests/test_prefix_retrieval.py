@@ -0,0 +1,92 @@
+"""
+Testes para a busca em dois estágios por prefixo de dimensões (Matryoshka)
+"""
+import uuid
+import numpy as np
+
+from ficous.backend.app import models
+from ficous.backend.app.services import embeddings, diversification
+from ficous.backend.app.services.vector_cache import (
+    bump_corpus_version,
+    get_cached_matrix,
+    get_vector_cache_stats
+)
+
+
+def _seed_vectors(db_session, user_id, owner_id, n=300, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((n, 1536)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    for i, vec in enumerate(vectors):
+        db_session.add(models.Embedding(
+            id=uuid.uuid4(),
+            user_id=user_id,
+            owner_type="note",
+            owner_id=owner_id,
+            chunk_text=f"chunk {i}",
+            vector_f32=embeddings._pack_vector(vec),
+            meta={}
+        ))
+    db_session.commit()
+    return vectors
+
+
+def test_prefix_matrix_is_renormalized_and_shares_metadata():
+    """Testa truncamento + renormalização sem copiar ids e fatores"""
+    rng = np.random.default_rng(1)
+    rows = [
+        (uuid.uuid4(), "note", uuid.uuid4(), None, embeddings._pack_vector(rng.standard_normal(1536)), None, {})
+        for _ in range(5)
+    ]
+    vm = embeddings.build_vector_matrix(rows)
+
+    prefix = vm.prefix(256)
+
+    assert prefix.dim == 256
+    assert np.allclose(np.linalg.norm(prefix.matrix, axis=1), 1.0, atol=1e-5)
+    assert prefix.ids is vm.ids
+    assert prefix.factors is vm.factors
+
+
+def test_two_stage_matches_full_search(db_session, default_user_id, sample_note, monkeypatch):
+    """Testa que o prefixo + re-ranking completo devolve o mesmo top-k da busca exata"""
+    vectors = _seed_vectors(db_session, default_user_id, sample_note.id)
+    query = (vectors[42] + 0.2 * vectors[7]).tolist()
+    monkeypatch.setattr(embeddings, "RAG_RETRIEVAL_MODE", "vector")
+    monkeypatch.setattr(diversification, "RAG_MMR_LAMBDA", 1.0)  # compara só o ranking por relevância
+    monkeypatch.setattr(embeddings, "_get_embedding", lambda text, timeout=None: query)
+
+    full = embeddings.retrieve_relevant_chunks("q", str(default_user_id), db_session, top_k=3)
+    monkeypatch.setattr(embeddings, "RAG_PREFIX_DIMS", 256)
+    monkeypatch.setattr(embeddings, "PREFIX_SHORTLIST_FACTOR", 10)
+    two_stage = embeddings.retrieve_relevant_chunks("q", str(default_user_id), db_session, top_k=3)
+
+    assert [c["chunk_text"] for c in two_stage] == [c["chunk_text"] for c in full]
+    assert [c["similarity"] for c in two_stage] == [c["similarity"] for c in full]
+    assert get_cached_matrix(str(default_user_id), kind="prefix256") is not None
+
+
+def test_prefix_cache_invalidated_with_corpus(db_session, default_user_id, sample_note):
+    """Testa que a matriz de prefixo tem entrada própria e cai junto com a versão do corpus"""
+    _seed_vectors(db_session, default_user_id, sample_note.id, n=10)
+    user = str(default_user_id)
+    vm = embeddings.get_user_vector_matrix(user, db_session)
+    embeddings.get_prefix_matrix(user, vm, 512)
+
+    assert get_vector_cache_stats()["entries"] == 2
+    assert embeddings.get_prefix_matrix(user, vm, 512) is get_cached_matrix(user, kind="prefix512")
+
+    bump_corpus_version(user)
+    assert get_cached_matrix(user, kind="prefix512") is None
+    assert get_vector_cache_stats()["entries"] == 0
+
+
+def test_prefix_stage_skipped_for_non_matryoshka_provider(db_session, default_user_id, sample_note, monkeypatch):
+    """Testa que o provedor local (hashing) não usa o estágio de prefixo"""
+    _seed_vectors(db_session, default_user_id, sample_note.id, n=100)
+    vm = embeddings.build_vector_matrix(embeddings._load_vector_rows(str(default_user_id), db_session))
+    monkeypatch.setattr(embeddings, "RAG_PREFIX_DIMS", 256)
+    assert embeddings._prefix_shortlist(str(default_user_id), vm, [0.1] * 1536, None, 1, None) is not None
+
+    monkeypatch.setenv("EMBEDDING_PROVIDER", "local")
+    assert embeddings._prefix_shortlist(str(default_user_id), vm, [0.1] * 1536, None, 1, None) is None
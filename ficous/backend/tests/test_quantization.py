@@ -0,0 +1,100 @@
+"""
+Testes para quantização (float16/int8) das matrizes de vetores
+"""
+import uuid
+import numpy as np
+import pytest
+
+from ficous.backend.app import models
+from ficous.backend.app.services import embeddings
+from ficous.backend.app.services.quantization import quantize, dequantize, score_matrix, measure_recall
+from ficous.backend.app.services.vector_cache import clear_vector_cache
+
+
+def _normalized(rng, n, dim=64):
+    matrix = rng.standard_normal((n, dim)).astype(np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("mode,ratio", [("float16", 2), ("int8", 4)])
+def test_quantize_shrinks_and_preserves_scores(mode, ratio):
+    """Testa economia de memória e erro pequeno nos scores"""
+    rng = np.random.default_rng(0)
+    matrix = _normalized(rng, 500)
+    query = _normalized(rng, 1)[0]
+
+    quantized, scales = quantize(matrix, mode)
+
+    assert quantized.nbytes * ratio == matrix.nbytes
+    assert np.abs(dequantize(quantized, scales) - matrix).max() < 0.01
+    assert np.abs(score_matrix(quantized, query, scales) - matrix @ query).max() < 0.02
+
+
+def test_measure_recall_reports_each_mode():
+    """Testa o benchmark de recall contra a busca exata"""
+    rng = np.random.default_rng(1)
+    matrix = _normalized(rng, 2000)
+    queries = _normalized(rng, 20)
+
+    report = measure_recall(matrix, queries, k=10, rerank_factor=4)
+
+    assert set(report["modes"]) == {"float16", "int8"}
+    assert report["modes"]["float16"]["recall"] >= 0.95
+    assert report["modes"]["int8"]["recall_reranked"] >= 0.95
+    assert report["modes"]["int8"]["bytes"] < report["float32_bytes"] / 3
+
+
+def test_retrieve_with_int8_matches_full_precision(db_session, default_user_id, sample_note, monkeypatch):
+    """Testa que o modo int8 + re-ranking devolve o mesmo top-k com similaridade exata"""
+    rng = np.random.default_rng(2)
+    vectors = _normalized(rng, 40, dim=1536)
+    for i, vec in enumerate(vectors):
+        db_session.add(models.Embedding(
+            id=uuid.uuid4(),
+            user_id=default_user_id,
+            owner_type="note",
+            owner_id=sample_note.id,
+            chunk_text=f"chunk {i}",
+            vector_f32=embeddings._pack_vector(vec),
+            meta={}
+        ))
+    db_session.commit()
+    query = vectors[7] + 0.1 * vectors[3]
+    monkeypatch.setattr(embeddings, "RAG_RETRIEVAL_MODE", "vector")
+    monkeypatch.setattr(embeddings, "_get_embedding", lambda text, timeout=None: query.tolist())
+
+    baseline = embeddings.retrieve_relevant_chunks("q", str(default_user_id), db_session, top_k=3)
+
+    clear_vector_cache()
+    monkeypatch.setattr(embeddings, "VECTOR_QUANTIZATION", "int8")
+    quantized = embeddings.retrieve_relevant_chunks("q", str(default_user_id), db_session, top_k=3)
+
+    assert embeddings.get_user_vector_matrix(str(default_user_id), db_session).quantization == "int8"
+    assert [c["chunk_text"] for c in quantized] == [c["chunk_text"] for c in baseline]
+    assert [c["similarity"] for c in quantized] == pytest.approx([c["similarity"] for c in baseline], abs=1e-5)
+
+
+def test_quantization_benchmark_endpoint(client, sample_embedding, monkeypatch):
+    """Testa o endpoint admin de benchmark de recall"""
+    from ficous.backend.app.routers import admin
+    monkeypatch.setattr(admin, "ADMIN_ENABLED", True)  # test_admin recarrega o módulo desabilitado
+
+    response = client.get("/ficous/admin/quantization-benchmark", params={"k": 1, "queries": 5})
+
+    assert response.status_code == 200
+    assert "benchmark" in response.json()
+
+
+@pytest.mark.parametrize("mode", ["none", "float16", "int8"])
+def test_score_matrix_batch_matches_single_queries(mode):
+    """Testa que o produto matriz-matriz (uma coluna por query) bate com o matriz-vetor"""
+    rng = np.random.default_rng(4)
+    matrix = _normalized(rng, 300)
+    queries = _normalized(rng, 5)
+    quantized, scales = quantize(matrix, mode)
+
+    batch = score_matrix(quantized, np.ascontiguousarray(queries.T), scales)
+
+    assert batch.shape == (300, 5)
+    for j, q in enumerate(queries):
+        assert np.allclose(batch[:, j], score_matrix(quantized, q, scales), atol=1e-5)
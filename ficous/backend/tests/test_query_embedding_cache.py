@@ -0,0 +1,79 @@
+"""
+Testes para o cache LRU + TTL de embeddings de query
+"""
+from unittest.mock import patch
+
+from ficous.backend.app.services import embeddings, query_embedding_cache
+from ficous.backend.app.services.query_embedding_cache import (
+    normalize_query,
+    get_cached_query_embedding,
+    set_cached_query_embedding,
+    get_query_embedding_cache_stats
+)
+
+
+def test_normalize_query_ignores_case_and_spacing():
+    """Testa a normalização usada na chave do cache"""
+    assert normalize_query("  O que é   POO? ") == "o que é poo?"
+
+
+def test_repeated_query_skips_provider(db_session):
+    """Testa que a mesma pergunta (com outra caixa/espaços) não chama o provedor de novo"""
+    hits_before = get_query_embedding_cache_stats()["hits"]
+    with patch("ficous.backend.app.services.embeddings._get_embedding") as mock_query:
+        mock_query.return_value = [0.5] * 1536
+        first = embeddings._get_query_embedding("O que é polimorfismo?")
+        second = embeddings._get_query_embedding("o que é   polimorfismo?")
+
+    assert mock_query.call_count == 1
+    assert second == first
+    stats = get_query_embedding_cache_stats()
+    assert stats["hits"] == hits_before + 1
+    assert stats["hit_rate"] > 0
+
+
+def test_cache_key_includes_model(db_session):
+    """Testa que trocar o modelo de embeddings não reaproveita vetores antigos"""
+    set_cached_query_embedding("herança", "text-embedding-3-small", [0.1] * 1536)
+
+    assert get_cached_query_embedding("herança", "text-embedding-3-small") is not None
+    assert get_cached_query_embedding("herança", "local-hashing-v1-1536") is None
+
+
+def test_failed_embedding_is_not_cached(db_session):
+    """Testa que falhas do provedor não ficam presas no cache"""
+    with patch("ficous.backend.app.services.embeddings._get_embedding") as mock_query:
+        mock_query.return_value = None
+        embeddings._get_query_embedding("encapsulamento")
+        mock_query.return_value = [0.2] * 1536
+        assert embeddings._get_query_embedding("encapsulamento") is not None
+
+    assert mock_query.call_count == 2
+
+
+def test_ttl_and_lru_eviction(db_session, monkeypatch):
+    """Testa expiração por TTL e evicção da entrada menos usada"""
+    monkeypatch.setattr(query_embedding_cache, "QUERY_EMBEDDING_CACHE_MAX_ENTRIES", 2)
+    set_cached_query_embedding("a", "m", [1.0])
+    set_cached_query_embedding("b", "m", [2.0])
+    get_cached_query_embedding("a", "m")
+    evictions_before = get_query_embedding_cache_stats()["evictions"]
+    set_cached_query_embedding("c", "m", [3.0])
+
+    assert get_cached_query_embedding("b", "m") is None
+    assert get_cached_query_embedding("a", "m") == [1.0]
+    assert get_query_embedding_cache_stats()["evictions"] == evictions_before + 1
+
+    monkeypatch.setattr(query_embedding_cache, "QUERY_EMBEDDING_CACHE_TTL", 0)
+    assert get_cached_query_embedding("a", "m") is None
+
+
+def test_cache_stats_endpoint_reports_query_cache(client, monkeypatch):
+    """Testa que /admin/cache-stats inclui a taxa de acerto do cache de query"""
+    from ficous.backend.app.routers import admin
+    monkeypatch.setattr(admin, "ADMIN_ENABLED", True)  # test_admin recarrega o módulo desabilitado
+
+    response = client.get("/ficous/admin/cache-stats")
+
+    assert response.status_code == 200
+    assert "hit_rate" in response.json()["cache_stats"]["query_embedding_cache"]
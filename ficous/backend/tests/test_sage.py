@@ -176,7 +176,7 @@ def test_sage_process_raw_content(client):
 
 def test_sage_megacontext_with_rag(client, sample_note, sample_embedding):
     """Testa construção de megacontexto com RAG"""
-    with patch("ficous.backend.app.routers.sage.retrieve_relevant_chunks") as mock_rag:
+    with patch("ficous.backend.app.routers.sage.retrieve_relevant_chunks_async") as mock_rag:
         mock_rag.return_value = [
             {
                 "chunk_text": "Chunk relevante",
@@ -0,0 +1,105 @@
+"""
+Testes para o cache de matrizes de vetores do RAG
+"""
+import pytest
+import uuid
+from unittest.mock import patch
+from ficous.backend.app.services import vector_cache
+from ficous.backend.app.services.vector_cache import (
+    get_corpus_version,
+    bump_corpus_version,
+    get_cached_matrix,
+    set_cached_matrix,
+    get_vector_cache_stats,
+    clear_vector_cache
+)
+from ficous.backend.app.services.cache import get_cache_stats
+from ficous.backend.app.services.embeddings import (
+    index_note_content,
+    retrieve_relevant_chunks,
+    get_user_vector_matrix
+)
+
+
+def test_set_and_get_cached_matrix():
+    """Testa hit quando a versão do corpus não mudou"""
+    clear_vector_cache()
+    user = str(uuid.uuid4())
+
+    assert get_cached_matrix(user) is None
+    set_cached_matrix(user, get_corpus_version(user), "matriz", 100)
+
+    assert get_cached_matrix(user) == "matriz"
+
+
+def test_bump_version_invalidates():
+    """Testa que o bump de versão invalida a entrada"""
+    clear_vector_cache()
+    user = str(uuid.uuid4())
+    set_cached_matrix(user, get_corpus_version(user), "matriz", 100)
+
+    bump_corpus_version(user)
+
+    assert get_cached_matrix(user) is None
+
+
+def test_stale_version_not_stored():
+    """Testa que uma matriz construída numa versão antiga não é armazenada"""
+    clear_vector_cache()
+    user = str(uuid.uuid4())
+    version = get_corpus_version(user)
+    bump_corpus_version(user)
+
+    set_cached_matrix(user, version, "matriz", 100)
+
+    assert get_cached_matrix(user) is None
+
+
+def test_memory_cap_evicts_lru(monkeypatch):
+    """Testa evicção LRU ao ultrapassar o limite de memória"""
+    clear_vector_cache()
+    monkeypatch.setattr(vector_cache, "VECTOR_CACHE_MAX_MB", 1)
+    users = [str(uuid.uuid4()) for _ in range(3)]
+    half_mb = 512 * 1024
+
+    set_cached_matrix(users[0], 0, "a", half_mb)
+    set_cached_matrix(users[1], 0, "b", half_mb)
+    get_cached_matrix(users[0])  # users[0] passa a ser o mais recente
+    set_cached_matrix(users[2], 0, "c", half_mb)
+
+    assert get_cached_matrix(users[1]) is None
+    assert get_cached_matrix(users[0]) == "a"
+    assert get_vector_cache_stats()["memory_bytes"] <= 1024 * 1024
+
+
+def test_retrieve_reuses_cached_matrix(db_session, default_user_id, sample_embedding):
+    """Testa que consultas repetidas não recarregam a matriz"""
+    import json
+
+    with patch("ficous.backend.app.services.embeddings._get_embedding") as mock_emb:
+        mock_emb.return_value = json.loads(sample_embedding.vector)
+        retrieve_relevant_chunks("polimorfismo", str(default_user_id), db_session)
+        hits_before = get_vector_cache_stats()["hits"]
+        chunks = retrieve_relevant_chunks("polimorfismo", str(default_user_id), db_session)
+
+    assert len(chunks) == 1
+    assert get_vector_cache_stats()["hits"] == hits_before + 1
+
+
+def test_index_invalidates_cached_matrix(db_session, default_user_id, sample_note):
+    """Testa que indexar conteúdo invalida a matriz do usuário"""
+    assert len(get_user_vector_matrix(str(default_user_id), db_session)) == 0
+
+    with patch("ficous.backend.app.services.embeddings._request_embeddings") as mock_emb:
+        mock_emb.side_effect = lambda texts: [[0.1] * 1536 for _ in texts]
+        index_note_content(sample_note, db_session)
+
+    assert len(get_user_vector_matrix(str(default_user_id), db_session)) > 0
+
+
+def test_cache_stats_include_vector_cache():
+    """Testa que as stats gerais incluem o cache de matrizes"""
+    stats = get_cache_stats()
+
+    assert "vector_cache" in stats
+    assert "hit_rate" in stats["vector_cache"]